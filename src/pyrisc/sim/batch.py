@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+
+#==========================================================================
+#
+#   The PyRISC Project
+#
+#   SNURISC: A RISC-V ISA Simulator
+#
+#   Batch runner for many independent guest programs.
+#
+#==========================================================================
+
+import io
+import os
+import sys
+import time
+import multiprocessing
+import concurrent.futures
+
+from pyrisc.sim.consts import *
+from pyrisc.sim.components import *
+from pyrisc.sim.program import *
+from pyrisc.sim.sim import *
+from pyrisc.sim.translate import *
+from pyrisc.sim.snurisc import SNURISC, map_dmem
+
+
+#--------------------------------------------------------------------------
+#   Configurations
+#--------------------------------------------------------------------------
+
+BATCH_MAX_INSTS     = 10000000      # default instruction cap per job
+BATCH_TIMEOUT       = 60.0          # default wall time limit per job (seconds)
+BATCH_SLICE         = 10000         # instructions run between timeout checks
+BATCH_TASKS_PER_CHILD = 100         # jobs run by a worker before it is replaced
+
+# Job status, in addition to the exception that stopped the guest
+JOB_DONE            = 0             # stopped on an event (see JobResult.event)
+JOB_MAX_INSTS       = 1             # instruction cap reached
+JOB_TIMEOUT         = 2             # wall time limit reached
+JOB_LOAD_ERROR      = 3             # image could not be loaded
+
+JOB_MSG = {
+    JOB_DONE        : "done",
+    JOB_MAX_INSTS   : "instruction limit",
+    JOB_TIMEOUT     : "timeout",
+    JOB_LOAD_ERROR  : "load error",
+}
+
+
+#--------------------------------------------------------------------------
+#   JobResult: the outcome of a single guest program
+#--------------------------------------------------------------------------
+
+class JobResult(object):
+
+    def __init__(self, index, name):
+        self.index      = index         # position in the list of images
+        self.name       = name
+        self.status     = JOB_DONE
+        self.event      = EXC_NONE      # exception type that stopped the guest
+        self.fault_addr = None          # for page faults
+        self.regs       = [ 0 ] * NUM_REGS
+        self.pc         = 0
+        self.retired    = 0
+        self.seconds    = 0.0
+        self.error      = None          # message for JOB_LOAD_ERROR
+
+    def __str__(self):
+        if self.status == JOB_LOAD_ERROR:
+            return self.error           # names the file already
+        reason = EXC_MSG.get(self.event, JOB_MSG[self.status]) if self.status == JOB_DONE else \
+                 JOB_MSG[self.status]
+        return "%s: %s at 0x%08x, %d instructions in %.3f s (a0 = 0x%08x)" % \
+               (self.name, reason, self.pc, self.retired, self.seconds, self.regs[10])
+
+
+#--------------------------------------------------------------------------
+#   Worker side
+#--------------------------------------------------------------------------
+
+def run_job(index, image, vm_factory, engine, max_insts, timeout):
+    # image: an ELF file name or the contents of an ELF file
+
+    start   = time.perf_counter()
+    name    = image if isinstance(image, str) else "<image %d>" % index
+    result  = JobResult(index, name)
+
+    vm      = vm_factory()
+    try:
+        f = open(image, 'rb') if isinstance(image, str) else io.BytesIO(image)
+    except IOError:
+        result.status   = JOB_LOAD_ERROR
+        result.error    = ELF_ERR_MSG[ELF_ERR_OPEN] % name
+        return result
+    with f:
+        entry_point, ret = Program().load_image(vm, f)
+    if ret != ELF_OK:
+        result.status   = JOB_LOAD_ERROR
+        result.error    = ELF_ERR_MSG[ret] % name
+        return result
+
+    map_dmem(vm)
+
+    cpu     = SNURISC(vm, engine)
+    cpu.pc.write(entry_point)
+
+    while True:
+        if result.retired >= max_insts:
+            result.status = JOB_MAX_INSTS
+            break
+        if time.perf_counter() - start > timeout:
+            result.status = JOB_TIMEOUT
+            break
+        r = cpu.resume(min(BATCH_SLICE, max_insts - result.retired))
+        result.retired += r.retired
+        if r.event is None:
+            continue
+        result.event = r.event.type
+        if isinstance(r.event, MemEvent):
+            result.fault_addr = int(r.event.fault_addr)
+        break
+
+    result.regs     = [ int(x) for x in cpu.regs.reg ]
+    result.pc       = int(cpu.pc.read())
+    result.seconds  = time.perf_counter() - start
+    return result
+
+
+#--------------------------------------------------------------------------
+#   run_batch: shards images across a process pool
+#--------------------------------------------------------------------------
+
+def run_batch(images, vm_factory = PageTable, engine = Sim, workers = None,
+              max_insts = BATCH_MAX_INSTS, timeout = BATCH_TIMEOUT):
+    # Yields a JobResult per image as jobs complete (not in order).
+    # vm_factory() returns an empty TranslatesAddresses with map() as in
+    # PageTable; it and engine must be importable by name by the workers.
+    # At most two jobs per worker are in flight, so images can be a lazy
+    # iterable of any length.
+
+    workers = workers or os.cpu_count()
+    kwargs  = { }
+    if sys.version_info >= (3, 11):
+        kwargs['max_tasks_per_child'] = BATCH_TASKS_PER_CHILD
+    context = multiprocessing.get_context('forkserver' if 'forkserver' in
+                                          multiprocessing.get_all_start_methods() else 'spawn')
+
+    with concurrent.futures.ProcessPoolExecutor(workers, context, **kwargs) as pool:
+        pending = set()
+        for index, image in enumerate(images):
+            if len(pending) >= 2 * workers:
+                done, pending = concurrent.futures.wait(pending,
+                                    return_when = concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+            pending.add(pool.submit(run_job, index, image, vm_factory, engine, max_insts, timeout))
+        for future in concurrent.futures.as_completed(pending):
+            yield future.result()
+
+
+#--------------------------------------------------------------------------
+#   Utility functions for command line parsing
+#--------------------------------------------------------------------------
+
+def show_usage(name):
+    print("Usage: %s [-j workers] [-n max_insts] [-t timeout] [-b] filename ..." % name)
+    print("\tfilename: RISC-V executable file names")
+    print("\t-j sets the number of worker processes (default: number of CPUs)")
+    print("\t-n sets the instruction limit per program (default: %d)" % BATCH_MAX_INSTS)
+    print("\t-t sets the wall time limit per program in seconds (default: %d)" % BATCH_TIMEOUT)
+    print("\t-b runs the programs with the basic-block translation engine")
+
+
+def parse_args(args):
+    opts    = { 'workers': None, 'max_insts': BATCH_MAX_INSTS, 'timeout': BATCH_TIMEOUT, 'engine': Sim }
+    index   = 1
+    while index < len(args) and args[index].startswith('-'):
+        try:
+            if args[index] == '-j':
+                opts['workers'] = int(args[index + 1])
+            elif args[index] == '-n':
+                opts['max_insts'] = int(args[index + 1])
+            elif args[index] == '-t':
+                opts['timeout'] = float(args[index + 1])
+            elif args[index] == '-b':
+                opts['engine'] = BlockSim
+                index += 1
+                continue
+            else:
+                print("Invalid option '%s'" % args[index])
+                return None
+        except (IndexError, ValueError):
+            print("Invalid value for option '%s'" % args[index])
+            return None
+        index += 2
+
+    if index == len(args):
+        return None
+    return ( args[index:], opts )
+
+
+#--------------------------------------------------------------------------
+#   Batch runner main
+#--------------------------------------------------------------------------
+
+def main():
+
+    parsed = parse_args(sys.argv)
+    if not parsed:
+        show_usage(sys.argv[0])
+        sys.exit()
+
+    filenames, opts = parsed
+    for result in run_batch(filenames, **opts):
+        print(result)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,361 @@
+#!/usr/bin/env python3
+
+#==========================================================================
+#
+#   The PyRISC Project
+#
+#   SNURISC: A RISC-V ISA Simulator
+#
+#   Microbenchmarks for the simulator hot paths.
+#
+#==========================================================================
+
+import io
+import sys
+import time
+import contextlib
+import random
+import timeit
+import numpy as np
+
+from pyrisc.sim.consts import *
+from pyrisc.sim.isa import *
+from pyrisc.sim.components import *
+from pyrisc.sim.program import *
+from pyrisc.sim.sim import *
+from pyrisc.sim.translate import *
+from pyrisc.sim.trace import TraceWriter
+from pyrisc.sim.histogram import Histogram
+from pyrisc.sim.snurisc import SNURISC
+from pyrisc.sim.machine import Machine
+from pyrisc.sim.kernels import *
+
+
+#--------------------------------------------------------------------------
+#   Helpers
+#--------------------------------------------------------------------------
+
+def report(name, seconds, count):
+    print("%-32s %10.1f ns/inst" % (name, seconds * 1e9 / count))
+
+
+def sample_insts(count, seed = 0):
+    # A mix of valid encodings with random register/immediate fields
+    rnd     = random.Random(seed)
+    keys    = list(isa.keys())
+    insts   = [ ]
+    for i in range(count):
+        k       = keys[rnd.randrange(len(keys))]
+        mask    = int(isa[k][IN_MASK])
+        insts.append((rnd.getrandbits(32) & ~mask) | int(k))
+    return insts
+
+
+#--------------------------------------------------------------------------
+#   BenchVM: a flat page table for running guest kernels
+#--------------------------------------------------------------------------
+
+class BenchVM(TranslatesAddresses):
+
+    def __init__(self, code):
+        self.pt = { }
+        text = b''.join(w.to_bytes(WORD_SIZE, "little") for w in code)
+        for off in range(0, len(text), PAGE_SIZE):
+            pte = self.map((TEXT_START + off) >> VPO_LENTGH, M_READ_ONLY)
+            pte.physical_page[0:len(text[off:off+PAGE_SIZE])] = text[off:off+PAGE_SIZE]
+        self.map(DATA_START >> VPO_LENTGH, M_READ_WRITE)
+
+    def map(self, vpn, prot):
+        pte = PageTableEntry(vpn, prot)
+        self.pt[vpn] = pte
+        return pte
+
+    def translate(self, vpn):
+        return self.pt.get(vpn)
+
+
+class WalkVM(BenchVM):
+
+    # Two-level page table walk, as done by a kernel written in Python
+
+    def map(self, vpn, prot):
+        pte = BenchVM.map(self, vpn, prot)
+        if not hasattr(self, 'dir'):
+            self.dir = { }
+        self.dir.setdefault(vpn >> 10, [ None ] * 1024)[vpn & 0x3ff] = pte
+        return pte
+
+    def translate(self, vpn):
+        table = self.dir.get(vpn >> 10)
+        if table is None:
+            return None
+        return table[vpn & 0x3ff]
+
+
+def run_kernel(code, engine, vm = None, setup = None):
+    # returns ( seconds, instructions retired )
+    cpu     = SNURISC(vm or BenchVM(code), engine)
+    if setup:
+        setup(cpu)
+    icount  = cpu.stat.icount
+    pc      = TEXT_START
+    start   = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        while True:
+            event = cpu.run(pc)
+            if event.type != EXC_CLOCK:
+                break
+            pc = cpu.pc.read()
+    return ( time.perf_counter() - start, cpu.stat.icount - icount )
+
+
+#--------------------------------------------------------------------------
+#   Benchmarks
+#--------------------------------------------------------------------------
+
+def bench_decode():
+    insts = sample_insts(10000)
+    for name, fn in [ ("decode (linear scan)", RISCV.opcode_scan),
+                      ("decode (table)", RISCV.opcode) ]:
+        t = min(timeit.repeat(lambda: [ fn(i) for i in insts ], number = 1, repeat = 5))
+        report(name, t, len(insts))
+
+
+def bench_words():
+    # An ALU instruction's arithmetic (add, slt, sra and the pc update) on
+    # NumPy scalars, as the engines used to do, vs. on ints with masking
+    rnd     = random.Random(0)
+    pairs   = [ ( rnd.getrandbits(32), rnd.getrandbits(32) ) for _ in range(10000) ]
+    np_pairs = [ ( np.uint32(a), np.uint32(b) ) for a, b in pairs ]
+    four    = np.uint32(4)
+
+    def numpy_ops():
+        np.seterr(all='ignore')
+        for a, b in np_pairs:
+            np.uint32(a + b)
+            np.uint32(1) if np.int32(a) < np.int32(b) else np.uint32(0)
+            np.uint32(np.int32(a) >> (b & np.uint32(0x1f)))
+            np.uint32(a + four)
+
+    def int_ops():
+        for a, b in pairs:
+            (a + b) & MASK32
+            1 if sword(a) < sword(b) else 0
+            (sword(a) >> (b & 0x1f)) & MASK32
+            (a + 4) & MASK32
+
+    for name, fn in [ ("words (NumPy scalars)", numpy_ops),
+                      ("words (int)", int_ops) ]:
+        t = min(timeit.repeat(fn, number = 1, repeat = 5))
+        report(name, t, len(pairs))
+
+
+def bench_engine():
+    for name, kern in kernels.items():
+        code = kern(2000)
+        for engine in [ Sim, BlockSim ]:
+            t, n = run_kernel(code, engine)
+            report("%s (%s)" % (name, engine.__name__), t, n)
+
+
+# The ALU and control transfer handlers of the interpreter before the
+# per-opcode dispatch table: one handler per instruction class, choosing
+# operands and the operation with chained conditional expressions
+
+def chained_alu(self, pc, d):
+    _, inst, opcode, cs, rs1, rs2, rd, imm = d
+    rs1_data    = self.cpu.regs.read(rs1)
+    rs2_data    = self.cpu.regs.read(rs2)
+    alu1        = rs1_data      if cs[IN_ALU1] == OP1_RS1    else \
+                  pc            if cs[IN_ALU1] == OP1_PC     else \
+                  0
+    alu2        = rs2_data      if cs[IN_ALU2] == OP2_RS2    else \
+                  imm
+    alu_out     = (alu1 + alu2) & MASK32                if (cs[IN_OP] == ALU_ADD)           else \
+                  (alu1 - alu2) & MASK32                if (cs[IN_OP] == ALU_SUB)           else \
+                  alu1 & alu2                           if (cs[IN_OP] == ALU_AND)           else \
+                  alu1 | alu2                           if (cs[IN_OP] == ALU_OR)            else \
+                  alu1 ^ alu2                           if (cs[IN_OP] == ALU_XOR)           else \
+                  1                                     if (cs[IN_OP] == ALU_SLT and             \
+                                                            (sword(alu1) < sword(alu2)))    else \
+                  1                                     if (cs[IN_OP] == ALU_SLTU and            \
+                                                            (alu1 < alu2))                  else \
+                  (alu1 << (alu2 & 0x1f)) & MASK32      if (cs[IN_OP] == ALU_SLL)           else \
+                  (sword(alu1) >> (alu2 & 0x1f)) & MASK32 if (cs[IN_OP] == ALU_SRA)         else \
+                  alu1 >> (alu2 & 0x1f)                 if (cs[IN_OP] == ALU_SRL)           else \
+                  0
+    self.cpu.regs.write(rd, alu_out)
+    self.cpu.pc.write((pc + 4) & MASK32)
+    return None
+
+
+def chained_ctrl(self, pc, d):
+    _, inst, opcode, cs, rs1, rs2, rd, imm = d
+    if inst in [ EBREAK, ECALL ]:
+        if (inst == EBREAK):
+            return self.trap.set(EXC_EBREAK)
+        self.cpu.pc.write((pc + 4) & MASK32)
+        return self.trap.set(EXC_ECALL)
+    rs1_data        = self.cpu.regs.read(rs1)
+    rs2_data        = self.cpu.regs.read(rs2)
+    pc_plus4        = (pc + 4) & MASK32
+    pc_next         = (pc + imm) & MASK32   if opcode == JAL    else                                         \
+                      (pc + imm) & MASK32   if (opcode == BEQ and rs1_data == rs2_data) or                   \
+                                            (opcode == BNE and not (rs1_data == rs2_data)) or                \
+                                            (opcode == BLT and sword(rs1_data) < sword(rs2_data)) or         \
+                                            (opcode == BGE and not (sword(rs1_data) < sword(rs2_data))) or   \
+                                            (opcode == BLTU and rs1_data < rs2_data) or                      \
+                                            (opcode == BGEU and not (rs1_data < rs2_data))  else             \
+                      (rs1_data + imm) & 0xfffffffe         if opcode == JALR   else                         \
+                      pc_plus4
+    if (opcode in [ JAL, JALR ]):
+        self.cpu.regs.write(rd, pc_plus4)
+    self.cpu.pc.write(pc_next)
+    return None
+
+
+@contextlib.contextmanager
+def chained_dispatch():
+    # Temporarily decodes ALU and control transfer instructions to the
+    # chained handlers; only CPUs created inside see them
+    saved = dict(Sim.dispatch)
+    for opcode, cs in isa.items():
+        if cs[IN_CLASS] == CL_ALU:
+            Sim.dispatch[opcode] = chained_alu
+        elif cs[IN_CLASS] == CL_CTRL:
+            Sim.dispatch[opcode] = chained_ctrl
+    try:
+        yield
+    finally:
+        Sim.dispatch.update(saved)
+
+
+def bench_dispatch():
+    # Per-opcode handlers vs. the chained handlers, on the interpreter
+    for name in [ 'alu', 'branch' ]:
+        code = kernels[name](2000)
+        with chained_dispatch():
+            t, n = run_kernel(code, Sim)
+        report("%s (chained)" % name, t, n)
+        t, n = run_kernel(code, Sim)
+        report("%s (per-opcode)" % name, t, n)
+
+
+def bench_modes():
+    # The fast loops vs. the instrumented loops picked for stats by class,
+    # per-instruction logs (printed to a discarded buffer), binary traces
+    # (written to memory) and execution counts. Runs with
+    # resume(), which has no end-of-run register dumps.
+    def stats(cpu):
+        cpu.stat.enabled = True
+    def log(cpu):
+        cpu.log.level = 3
+    def trace(cpu):
+        cpu.trace = TraceWriter(io.BytesIO())
+    def trace_gzip(cpu):
+        cpu.trace = TraceWriter(io.BytesIO(), compress = True)
+    def hist(cpu):
+        cpu.hist = Histogram()
+    modes   = [ ("fast", None), ("stats", stats), ("log 3", log),
+                ("binary trace", trace), ("gzip trace", trace_gzip),
+                ("histogram", hist) ]
+    code    = kernel_alu(2000)
+    for engine in [ Sim, BlockSim ]:
+        for name, setup in modes:
+            cpu     = SNURISC(BenchVM(code), engine)
+            if setup:
+                setup(cpu)
+            cpu.pc.write(TEXT_START)
+            n       = 0
+            start   = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                while True:
+                    r = cpu.resume(10000)
+                    n += r.retired
+                    if r.event is not None:
+                        break
+            report("alu %s (%s)" % (name, engine.__name__), time.perf_counter() - start, n)
+
+
+def bench_tlb():
+    code = kernel_mem(2000)
+    for name, ways in [ ("no TLB", 0), ("TLB 64x4", 4) ]:
+        mmus = [ ]
+        def setup(cpu):
+            cpu.mmu = MMU(cpu.mmu.page_table, 64, ways)
+            mmus.append(cpu.mmu)
+        t, n = run_kernel(code, Sim, WalkVM(code), setup)
+        report("mem %s" % name, t, n)
+        for side, tlb in [ ("I", mmus[0].itlb), ("D", mmus[0].dtlb) ]:
+            print("    %s-TLB: %d hits, %d misses" % (side, tlb.hits, tlb.misses))
+
+
+def bench_syscalls():
+    # A getpid() loop with the syscall handled by the kernel loop around
+    # run() vs. by a handler registered with the CPU
+    A0, A7 = 10, 17
+    code    = kernel([ enc_i(ADDI, A7, 0, 172), int(ECALL), enc_r(ADD, A0, A0, A0) ], 2000)
+    def getpid(cpu):
+        cpu.regs.write(10, 1)
+        return True
+    for engine in [ Sim, BlockSim ]:
+        for name in [ "kernel", "inline" ]:
+            cpu     = SNURISC(BenchVM(code), engine)
+            if name == "inline":
+                cpu.register_syscall(172, getpid)
+            start   = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                event = cpu.run(TEXT_START)
+                while event.type in [ EXC_CLOCK, EXC_ECALL ]:
+                    if event.type == EXC_ECALL:
+                        getpid(cpu)
+                    event = cpu.run(cpu.pc.read())
+            report("getpid %s (%s)" % (name, engine.__name__), time.perf_counter() - start, cpu.stat.icount)
+
+
+def bench_harts():
+    # Throughput of a Machine running the ALU kernel on every hart
+    code = kernel_alu(2000)
+    for engine in [ Sim, BlockSim ]:
+        for harts in [ 1, 2, 4 ]:
+            m = Machine(BenchVM(code), harts, engine)
+            m.start(TEXT_START)
+            with contextlib.redirect_stdout(io.StringIO()):
+                while True:
+                    hartid, event = m.run()
+                    if hartid is None:
+                        break
+                    m.halt(hartid)
+            report("alu %d harts (%s)" % (harts, engine.__name__), m.elapsed, m.retired)
+            print("    %.3f MIPS" % m.mips())
+
+
+benchmarks = {
+    'decode'    : bench_decode,
+    'words'     : bench_words,
+    'engine'    : bench_engine,
+    'dispatch'  : bench_dispatch,
+    'modes'     : bench_modes,
+    'tlb'       : bench_tlb,
+    'harts'     : bench_harts,
+    'syscalls'  : bench_syscalls,
+}
+
+
+#--------------------------------------------------------------------------
+#   Benchmark main
+#--------------------------------------------------------------------------
+
+def main():
+
+    names = sys.argv[1:] or list(benchmarks)
+    for name in names:
+        if name not in benchmarks:
+            print("Unknown benchmark '%s' (available: %s)" % (name, ', '.join(benchmarks)))
+            sys.exit(1)
+    for name in names:
+        benchmarks[name]()
+
+
+if __name__ == '__main__':
+    main()
@@ -17,6 +17,12 @@
 from pyrisc.sim.consts import *
 from pyrisc.sim.isa import *
 
+import sys
+import copy
+import mmap
+import array
+import struct
+import weakref
 from abc import ABC, abstractmethod
 
 #--------------------------------------------------------------------------
@@ -39,7 +45,7 @@ rname =  [
 class RegisterFile(object):
 
     def __init__(self):
-        self.reg = WORD([0] * NUM_REGS)
+        self.reg = [ 0 ] * NUM_REGS
 
     def read(self, regno):
 
@@ -55,7 +61,7 @@ class RegisterFile(object):
         if regno == 0:
             return
         elif regno > 0 and regno < NUM_REGS:
-            self.reg[regno] = WORD(value)
+            self.reg[regno] = int(value) & MASK32
         else:
             raise ValueError
 
@@ -79,13 +85,13 @@ class RegisterFile(object):
 class Register(object):
 
     def __init__(self, initval = 0):
-        self.r = WORD(initval)
+        self.r = int(initval) & MASK32
 
     def read(self):
         return self.r
 
     def write(self, val):
-        self.r = WORD(val)
+        self.r = int(val) & MASK32
 
 
 #--------------------------------------------------------------------------
@@ -136,12 +142,254 @@ PAGE_SIZE = 2 ** VPO_LENTGH
 VPO_MASK = 2**VPO_LENTGH - 1
 VPN_MASK = 2**32 - 1 - VPO_MASK
 
+
+#--------------------------------------------------------------------------
+#   PhysicalMemory: a fixed-size arena of physical page frames
+#--------------------------------------------------------------------------
+
+class WordView(object):
+
+    # Little-endian word (or halfword) view of a buffer, used instead of
+    # memoryview.cast() on big-endian hosts
+
+    def __init__(self, buf, fmt = "<I"):
+        self.buf = buf
+        self.fmt = fmt
+        self.size = struct.calcsize(fmt)
+
+    def __getitem__(self, index):
+        return struct.unpack_from(self.fmt, self.buf, index * self.size)[0]
+
+    def __setitem__(self, index, value):
+        struct.pack_into(self.fmt, self.buf, index * self.size, value)
+
+
+class PhysicalMemory(object):
+
+    DEFAULT_FRAMES  = 16384         # 64MB
+
+    def __init__(self, frames = DEFAULT_FRAMES):
+        self.frames     = frames
+        # Anonymous private mapping: zero-filled and committed on first touch
+        if hasattr(mmap, 'MAP_PRIVATE'):
+            self.mem    = mmap.mmap(-1, frames * PAGE_SIZE, flags = mmap.MAP_PRIVATE)
+        else:
+            self.mem    = mmap.mmap(-1, frames * PAGE_SIZE)
+        self.view       = memoryview(self.mem)
+        if sys.byteorder == 'little':
+            self.words  = self.view.cast('I')
+            self.halves = self.view.cast('H')
+        else:
+            self.words  = WordView(self.mem, "<I")
+            self.halves = WordView(self.mem, "<H")
+        self.next_frame = 0             # frames above this were never used
+        self.free_frames = [ ]
+        self.refs       = array.array('I', bytes(4 * frames))   # references per frame
+        self.cow_copies = 0             # frames copied by PageTableEntry.unshare()
+        self.allocated  = 0             # frames handed out by alloc()
+        self.freed      = 0             # frames returned to the free list
+        # frame -> caches holding decoded code of the frame (DecodeCache),
+        # to be invalidated when the frame is overwritten
+        self.code_frames = { }
+
+    def alloc(self):
+        if self.free_frames:
+            frame = self.free_frames.pop()
+            self.zero(frame)
+        elif self.next_frame < self.frames:
+            frame = self.next_frame
+            self.next_frame += 1
+        else:
+            raise MemoryError("out of physical frames")
+        self.refs[frame] = 1
+        self.allocated += 1
+        return frame
+
+    def ref(self, frame):
+        self.refs[frame] += 1
+
+    # Drops a reference; the frame is reused when the last one is gone
+    def free(self, frame):
+        self.refs[frame] -= 1
+        if self.refs[frame] == 0:
+            self.free_frames.append(frame)
+            self.freed += 1
+
+    def resident(self):
+        # frames in use
+        return self.next_frame - len(self.free_frames)
+
+    def page(self, frame):
+        # zero-copy view of a frame
+        off = frame << VPO_LENTGH
+        return self.view[off:off+PAGE_SIZE]
+
+    def zero(self, frame):
+        off = frame << VPO_LENTGH
+        self.mem[off:off+PAGE_SIZE] = ZERO_PAGE
+        self.invalidate_code(frame)
+
+    def copy(self, dst, src):
+        doff = dst << VPO_LENTGH
+        soff = src << VPO_LENTGH
+        self.mem[doff:doff+PAGE_SIZE] = self.view[soff:soff+PAGE_SIZE]
+        self.invalidate_code(dst)
+
+    def write(self, frame, data, offset = 0):
+        off = (frame << VPO_LENTGH) + offset
+        self.mem[off:off+len(data)] = data
+        self.invalidate_code(frame)
+
+    def add_code(self, frame, cache):
+        # Called by cache when it first caches code of frame
+        caches = self.code_frames.get(frame)
+        if caches is None:
+            caches = weakref.WeakSet()
+            self.code_frames[frame] = caches
+        caches.add(cache)
+
+    def invalidate_code(self, frame):
+        caches = self.code_frames.pop(frame, None)
+        if caches is not None:
+            for cache in caches:
+                cache.invalidate(frame)
+
+
+ZERO_PAGE = bytes(PAGE_SIZE)
+
+# Upper bits set when sign-extending a value of the given size
+SIGN_EXTEND = { 1: 0xffffff00, 2: 0xffff0000, 4: 0 }
+
+
+#--------------------------------------------------------------------------
+#   FrameStat: frames allocated and freed on behalf of an address space
+#--------------------------------------------------------------------------
+
+class FrameStat(object):
+
+    def __init__(self):
+        self.allocated  = 0         # frames allocated (zero fill or copy)
+        self.shared     = 0         # references taken to frames of other PTEs
+        self.freed      = 0         # frame references dropped
+
+    def referenced(self):
+        # frames the address space holds a reference to
+        return self.allocated + self.shared - self.freed
+
+
+#--------------------------------------------------------------------------
+#   PageTableEntry: maps a virtual page to a physical frame
+#--------------------------------------------------------------------------
+
 class PageTableEntry:
-    def __init__(self, vpn, prot):
+
+    # Frames come from PageTableEntry.memory unless the kernel supplies one
+    # (a frame number in the same arena); every MMU accesses this arena.
+    memory = PhysicalMemory()
+
+    # Replaces the arena by one of the given number of frames. MMUs keep
+    # the arena they were created with, so this must be done before
+    # creating any MMU, and no frame of the current arena may be in use.
+    @staticmethod
+    def set_memory(frames):
+        if PageTableEntry.memory.resident():
+            raise ValueError("%d frames of physical memory in use" % PageTableEntry.memory.resident())
+        PageTableEntry.memory = PhysicalMemory(frames)
+        return PageTableEntry.memory
+
+    # A demand-zero PTE gets its zeroed frame on the first access through
+    # the MMU (or through physical_page). stat is the FrameStat of the
+    # address space the PTE belongs to, if any.
+    def __init__(self, vpn, prot, frame = None, demand_zero = False, stat = None):
         self.vpn = vpn
         self.perms = prot
-        self.physical_page     = bytes(PAGE_SIZE)
-    
+        self.stat = stat
+        self.frame = frame
+        self.owns_frame = frame is None
+        self.cow = False        # frame shared copy-on-write with other PTEs
+        if frame is None and not demand_zero:
+            self.populate()
+
+    def __del__(self):
+        if getattr(self, 'owns_frame', False) and self.frame is not None:
+            self.release()
+
+    def populate(self):
+        self.frame = PageTableEntry.memory.alloc()
+        if self.stat is not None:
+            self.stat.allocated += 1
+
+    # Drops the frame the PTE owns, leaving it as a demand-zero page
+    def release(self):
+        if not self.owns_frame or self.frame is None:
+            return
+        PageTableEntry.memory.free(self.frame)
+        self.frame = None
+        self.cow = False
+        if self.stat is not None:
+            self.stat.freed += 1
+
+    # Returns a PTE for the same frame. Frames allocated by PTEs are shared
+    # copy-on-write, so both PTEs get a private copy on their next store;
+    # frames managed by the kernel stay shared. A demand-zero PTE is shared
+    # as another demand-zero PTE.
+    def share(self, vpn = None, stat = None):
+        vpn = self.vpn if vpn is None else vpn
+        if self.owns_frame and self.frame is None:
+            return PageTableEntry(vpn, self.perms, demand_zero = True, stat = stat)
+        pte = PageTableEntry(vpn, self.perms, self.frame, stat = stat)
+        if self.owns_frame:
+            PageTableEntry.memory.ref(self.frame)
+            pte.owns_frame = True
+            pte.cow = self.cow = True
+            if stat is not None:
+                stat.shared += 1
+        return pte
+
+    # Returns a PTE with a private copy of the frame
+    def copy(self, vpn = None, stat = None):
+        vpn = self.vpn if vpn is None else vpn
+        if self.frame is None:
+            return PageTableEntry(vpn, self.perms, demand_zero = True, stat = stat)
+        pte = PageTableEntry(vpn, self.perms, stat = stat)
+        PageTableEntry.memory.copy(pte.frame, self.frame)
+        return pte
+
+    # Gives the PTE a private copy of a copy-on-write frame. The last PTE
+    # left sharing a frame keeps it. Returns True if the frame was copied.
+    # Raises MemoryError, leaving the PTE as it was, if there is no free
+    # frame.
+    def unshare(self):
+        memory = PageTableEntry.memory
+        if memory.refs[self.frame] == 1:
+            self.cow = False
+            return False
+        frame = self.frame
+        self.populate()
+        self.cow = False
+        memory.copy(self.frame, frame)
+        memory.free(frame)
+        if self.stat is not None:
+            self.stat.freed += 1
+        memory.cow_copies += 1
+        return True
+
+    # Zero-copy, writable view of the frame. Assigning copies the data into
+    # the frame.
+    @property
+    def physical_page(self):
+        if self.frame is None:
+            self.populate()
+        return PageTableEntry.memory.page(self.frame)
+
+    @physical_page.setter
+    def physical_page(self, data):
+        if self.frame is None:
+            self.populate()
+        elif self.cow:
+            self.unshare()
+        PageTableEntry.memory.write(self.frame, data)
+
 
 class TranslatesAddresses(ABC):
     
@@ -151,58 +399,515 @@ class TranslatesAddresses(ABC):
         raise NotImplementedError
 
 
-class MMU():
-    def __init__(self, translates_addresses: TranslatesAddresses):
-        self.page_table = translates_addresses
+class PageTable(TranslatesAddresses):
+
+    # A flat, single address space page table (vpn -> pte), enough to load
+    # and run a standalone program
 
-    # def mem_store(self, va, data) -> (WORD, int):
-    #     NotImplementedError
+    def __init__(self):
+        self.entries = { }
+        self.stat = FrameStat()
+
+    def map(self, vpn, prot, frame = None, demand_zero = False) -> PageTableEntry:
+        pte = PageTableEntry(vpn, prot, frame, demand_zero, self.stat)
+        self.entries[vpn] = pte
+        return pte
+
+    # Maps the frame of pte at the same vpn, shared as by pte.share()
+    def map_shared(self, pte) -> PageTableEntry:
+        shared = pte.share(stat = self.stat)
+        self.entries[pte.vpn] = shared
+        return shared
+
+    def unmap(self, vpn):
+        return self.entries.pop(vpn, None)
+
+    # Unmaps every page and drops the frames they own right away, rather
+    # than when the PTEs are collected. PTEs still cached by a TLB read as
+    # demand-zero pages, so MMUs using the page table must flush their TLBs.
+    def release(self):
+        for pte in self.entries.values():
+            pte.release()
+        self.entries.clear()
+
+    def translate(self, vpn):
+        return self.entries.get(vpn)
+
+    # Copy of the address space that shares its frames copy-on-write: no
+    # page data is copied until one of the two sides stores to it. Writable
+    # frames managed by the kernel cannot be shared copy-on-write, as the
+    # kernel keeps using them, and are copied right away.
+    def clone(self):
+        pt = copy.copy(self)
+        pt.stat = FrameStat()
+        pt.entries = { }
+        for vpn, pte in self.entries.items():
+            if pte.owns_frame or pte.perms != M_READ_WRITE:
+                pt.entries[vpn] = pte.share(stat = pt.stat)
+            else:
+                pt.entries[vpn] = pte.copy(stat = pt.stat)
+        return pt
 
-    # def mem_load(self,va) -> (WORD, int):
-    #     NotImplementedError
+    def resident(self):
+        # pages backed by a frame
+        return sum(1 for pte in self.entries.values() if pte.frame is not None)
 
-    def mem_access(self, valid, va, data, function) -> (WORD, int):
-        # if not valid:
-        #     return ( WORD(0), True )
-        vpn = va >> VPO_LENTGH
-        vpo = (va & VPO_MASK)
-        pte = self.page_table.translate(vpn)
+    def dump(self, skipzero = False):
+        # Dumps the words of the mapped pages, as Memory.dump() does. Pages
+        # without a frame yet read as zero and are not dumped.
+        memory = PageTableEntry.memory
+        for vpn, pte in sorted(self.entries.items()):
+            if pte.frame is None:
+                continue
+            if skipzero and memory.page(pte.frame) == ZERO_PAGE:
+                continue
+            va = vpn << VPO_LENTGH
+            print("Memory 0x%08x - 0x%08x" % (va, va + PAGE_SIZE - 1))
+            print("=" * 30)
+            base = pte.frame << (VPO_LENTGH - 2)
+            for i in range(PAGE_SIZE // WORD_SIZE):
+                val = memory.words[base + i]
+                if (not skipzero) or (val != 0):
+                    print("0x%08x: " % (va + i * WORD_SIZE), ' '.join("%02x" % ((val >> s) & 0xff) for s in [0, 8, 16, 24]), " (0x%08x)" % val)
+
+
+#--------------------------------------------------------------------------
+#   DecodeCache: caches predecoded instructions per physical page
+#--------------------------------------------------------------------------
+
+class DecodeCache(object):
+
+    # Entries are tagged by the physical frame rather than by the virtual
+    # address, so that a PTE that points to a different frame (e.g., after
+    # exec() or a context switch) never hits stale entries. The frames are
+    # registered with memory, which invalidates them when they are reused.
+
+    def __init__(self, memory = None):
+        self.pages = { }
+        self.version = 0        # bumped whenever cached entries are dropped
+        self.memory = memory
+
+    def add(self, frame, offset, rec):
+        entry = self.pages.get(frame)
+        if entry is None:
+            entry = { }
+            self.pages[frame] = entry
+            if self.memory is not None:
+                self.memory.add_code(frame, self)
+        entry[offset] = rec
+
+    def lookup(self, frame, offset):
+        # returns None if not found
+        entry = self.pages.get(frame)
+        if entry is None:
+            return None
+        return entry.get(offset)
+
+    def invalidate(self, frame):
+        if self.pages.pop(frame, None) is not None:
+            self.version += 1
+
+    def flush(self):
+        self.pages.clear()
+        self.version += 1
+
+
+#--------------------------------------------------------------------------
+#   TLB: caches page table entries returned by TranslatesAddresses
+#--------------------------------------------------------------------------
+
+class TLB(object):
+
+    # A set-associative TLB with FIFO replacement within a set (ways = 1 is
+    # direct-mapped; ways = 0 disables it). The number of sets must be a
+    # power of two. Entries are tagged with an address-space id. Only
+    # mappings are cached: permission or physical page changes made to a
+    # cached PTE are seen immediately, but removing or replacing a PTE
+    # requires a flush.
+
+    ASID_SHIFT      = 32 - VPO_LENTGH
+
+    def __init__(self, sets = 64, ways = 4):
+        if sets <= 0 or sets & (sets - 1):
+            raise ValueError("TLB sets must be a power of two")
+        self.ways       = ways
+        self.set_mask   = sets - 1
+        self.sets       = [ { } for i in range(sets) ]
+        self.hits       = 0
+        self.misses     = 0
+
+    def lookup(self, vpn, asid):
+        # returns None if not found
+        pte = self.sets[vpn & self.set_mask].get((asid << TLB.ASID_SHIFT) | vpn)
+        if pte is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return pte
+
+    def insert(self, vpn, asid, pte):
+        if self.ways == 0:
+            return
+        s   = self.sets[vpn & self.set_mask]
+        tag = (asid << TLB.ASID_SHIFT) | vpn
+        if tag not in s and len(s) >= self.ways:
+            del s[next(iter(s))]
+        s[tag] = pte
+
+    def flush(self):
+        for s in self.sets:
+            s.clear()
+
+    def flush_vpn(self, vpn, asid = None):
+        s = self.sets[vpn & self.set_mask]
+        for tag in list(s):
+            if (tag & (VPN_MASK >> VPO_LENTGH)) == vpn and (asid is None or tag >> TLB.ASID_SHIFT == asid):
+                del s[tag]
+
+    def flush_asid(self, asid):
+        for s in self.sets:
+            for tag in [ t for t in s if t >> TLB.ASID_SHIFT == asid ]:
+                del s[tag]
+
+
+class MMU():
+    def __init__(self, translates_addresses: TranslatesAddresses, tlb_sets = 64, tlb_ways = 4):
+        self.itlb = TLB(tlb_sets, tlb_ways)
+        self.dtlb = TLB(tlb_sets, tlb_ways)
+        self.asid = 0                       # address-space id tagging TLB entries
+        self.page_table = translates_addresses
+        self.memory = PageTableEntry.memory     # the arena frames are allocated from
+        self.mem = self.memory.mem
+        self.words = self.memory.words
+        self.halves = self.memory.halves
+        self.fault_addr = 0                 # address of the last faulting access
+        self.miss_status = EXC_PAGE_FAULT_MISS  # why the last translate() returned None
+        # Stores to copy-on-write pages are handled here unless cow_fast is
+        # False, in which case they fault with EXC_PAGE_FAULT_PERMS and the
+        # kernel calls pte.unshare() before restarting the store
+        self.cow_fast = True
+        self.cow_faults = 0                 # stores to copy-on-write pages
+        self.decode_cache = DecodeCache(self.memory)
+        self.block_cache = DecodeCache(self.memory)     # translated blocks (see translate.py)
+
+    @property
+    def page_table(self):
+        return self._page_table
+
+    # Replacing the page table flushes the TLBs
+    @page_table.setter
+    def page_table(self, translates_addresses):
+        self.switch(translates_addresses)
+
+    # Switches to another address space. TLB entries of the previous one
+    # are kept if the kernel supplies an asid, and flushed otherwise.
+    def switch(self, translates_addresses, asid = None):
+        self._page_table = translates_addresses
+        if asid is None:
+            self.tlb_flush()
+        else:
+            self.asid = asid
+
+    # TLB invalidation: must be called by the kernel when it removes or
+    # replaces a mapping
+    def tlb_flush(self):
+        self.itlb.flush()
+        self.dtlb.flush()
+
+    def tlb_flush_vpn(self, vpn, asid = None):
+        self.itlb.flush_vpn(vpn, asid)
+        self.dtlb.flush_vpn(vpn, asid)
+
+    def tlb_flush_asid(self, asid):
+        self.itlb.flush_asid(asid)
+        self.dtlb.flush_asid(asid)
+
+    def translate(self, vpn, tlb):
+        # returns pte or None, with the exception to raise in miss_status:
+        # EXC_PAGE_FAULT_MISS if there is no such page, EXC_OUT_OF_MEMORY if
+        # there is no frame left for a demand-zero page
+        pte = tlb.lookup(vpn, self.asid)
+        if pte is None:
+            pte = self._page_table.translate(vpn)
+            if pte is None:
+                self.miss_status = EXC_PAGE_FAULT_MISS
+                return None
+            if pte.frame is None:
+                try:
+                    pte.populate()          # demand-zero page
+                except MemoryError:
+                    self.miss_status = EXC_OUT_OF_MEMORY
+                    return None
+            tlb.insert(vpn, self.asid, pte)
+        return pte
+
+    # Must be called by the kernel when it writes to a frame through
+    # pte.physical_page (e.g., loading a new image into a mapped page).
+    # The frame is invalidated in the caches of every MMU that holds code
+    # from it; if frame is None, every frame in this MMU's caches is.
+    def invalidate_code(self, frame = None):
+        if frame is None:
+            self.decode_cache.flush()
+            self.block_cache.flush()
+        else:
+            self.memory.invalidate_code(frame)
+
+    def code_page(self, va):
+        # returns ( frame, exception ) for an instruction fetch
+        pte = self.translate(va >> VPO_LENTGH, self.itlb)
+        if pte == None:
+            return ( None, self.miss_status )
+        if pte.perms != M_READ_ONLY and pte.perms != M_READ_WRITE:
+            return ( None, EXC_PAGE_FAULT_PERMS )
+        return ( pte.frame, EXC_NONE )
+
+    def fetch(self, va, decode):
+        # returns ( predecoded instruction, exception )
+        frame, status = self.code_page(va)
+        if status != EXC_NONE:
+            return ( None, status )
+        vpo = va & VPO_MASK
+        rec = self.decode_cache.lookup(frame, vpo)
+        if rec is None:
+            inst = self.words[((frame << VPO_LENTGH) | vpo) >> 2]
+            rec = decode(inst)
+            self.decode_cache.add(frame, vpo, rec)
+        return ( rec, EXC_NONE )
+
+    # Sized loads and stores (size = 1, 2 or 4 bytes) work directly on the
+    # frame with a single translation. Addresses and data are ints. On a
+    # fault, the faulting address is left in self.fault_addr.
+
+    def mem_load(self, va, size = WORD_SIZE, signed = False) -> (int, int):
+        vpo = va & VPO_MASK
+        if vpo + size > PAGE_SIZE:
+            return self.mem_load_split(va, size, signed)
+        pte = self.translate(va >> VPO_LENTGH, self.dtlb)
         if pte == None:
             # there's no such page in pt
             # kernel must do something
-            return ( WORD(0), EXC_PAGE_FAULT_MISS )
-        elif function == M_XRD:
-            # check pte permissions, validity etc
-            if pte.perms == M_READ_ONLY or pte.perms == M_READ_WRITE:
-                page = pte.physical_page
-                ppo = vpo
-                word_value = int.from_bytes(page[ppo:ppo+WORD_SIZE], "little")
-                return ( WORD(word_value), EXC_NONE )
-            else:
-                # fault
-                return ( WORD(0), EXC_PAGE_FAULT_PERMS )
+            self.fault_addr = va
+            return ( 0, self.miss_status )
+        if pte.perms != M_READ_ONLY and pte.perms != M_READ_WRITE:
+            self.fault_addr = va
+            return ( 0, EXC_PAGE_FAULT_PERMS )
+        pa = (pte.frame << VPO_LENTGH) | vpo
+        if size == WORD_SIZE and not (pa & 0x3):
+            value = self.words[pa >> 2]
+        elif size == 1:
+            value = self.mem[pa]
+        elif size == 2 and not (pa & 0x1):
+            value = self.halves[pa >> 1]
+        else:
+            value = int.from_bytes(self.mem[pa:pa+size], "little")
+        if signed and value >> (size * 8 - 1):
+            value |= SIGN_EXTEND[size]
+        return ( value, EXC_NONE )
+
+    def mem_store(self, va, data, size = WORD_SIZE) -> (int, int):
+        vpo = va & VPO_MASK
+        if vpo + size > PAGE_SIZE:
+            return self.mem_store_split(va, data, size)
+        pte = self.translate(va >> VPO_LENTGH, self.dtlb)
+        if pte == None:
+            self.fault_addr = va
+            return ( 0, self.miss_status )
+        if pte.perms != M_READ_WRITE:
+            self.fault_addr = va
+            return ( 0, EXC_PAGE_FAULT_PERMS )
+        if pte.cow:
+            self.cow_faults += 1
+            if not self.cow_fast:
+                self.fault_addr = va
+                return ( 0, EXC_PAGE_FAULT_PERMS )
+            try:
+                pte.unshare()
+            except MemoryError:
+                self.fault_addr = va
+                return ( 0, EXC_OUT_OF_MEMORY )
+        frame = pte.frame
+        pa = (frame << VPO_LENTGH) | vpo
+        if size == WORD_SIZE and not (pa & 0x3):
+            self.words[pa >> 2] = data & MASK32
+        elif size == 1:
+            self.mem[pa] = data & 0xff
+        elif size == 2 and not (pa & 0x1):
+            self.halves[pa >> 1] = data & 0xffff
+        else:
+            self.mem[pa:pa+size] = (data & MASK32).to_bytes(WORD_SIZE, "little")[:size]
+        self.memory.invalidate_code(frame)
+        return ( 0, EXC_NONE )
+
+    def mem_load_split(self, va, size, signed) -> (int, int):
+        # Misaligned access that crosses a page boundary: one byte at a time
+        value = 0
+        for i in range(size):
+            byte, status = self.mem_load((va + i) & MASK32, 1)
+            if status != EXC_NONE:
+                return ( 0, status )
+            value |= byte << (i * 8)
+        if signed and value >> (size * 8 - 1):
+            value |= SIGN_EXTEND[size]
+        return ( value, EXC_NONE )
+
+    def mem_store_split(self, va, data, size) -> (int, int):
+        for i in range(size):
+            _, status = self.mem_store((va + i) & MASK32, data >> (i * 8), 1)
+            if status != EXC_NONE:
+                return ( 0, status )
+        return ( 0, EXC_NONE )
+
+    # Buffers of any length (e.g. for syscall handlers), a page at a time
+    # with the checks of mem_load() and mem_store(). A faulting write_bytes()
+    # leaves the pages before the fault written.
+
+    def read_bytes(self, va, size) -> (bytes, int):
+        data = bytearray()
+        while size > 0:
+            vpo = va & VPO_MASK
+            n   = min(size, PAGE_SIZE - vpo)
+            pte = self.translate(va >> VPO_LENTGH, self.dtlb)
+            if pte is None:
+                self.fault_addr = va
+                return ( b'', self.miss_status )
+            if pte.perms != M_READ_ONLY and pte.perms != M_READ_WRITE:
+                self.fault_addr = va
+                return ( b'', EXC_PAGE_FAULT_PERMS )
+            pa  = (pte.frame << VPO_LENTGH) | vpo
+            data += self.mem[pa:pa+n]
+            va  = (va + n) & MASK32
+            size -= n
+        return ( bytes(data), EXC_NONE )
+
+    def write_bytes(self, va, data) -> int:
+        off = 0
+        while off < len(data):
+            vpo = va & VPO_MASK
+            n   = min(len(data) - off, PAGE_SIZE - vpo)
+            pte = self.translate(va >> VPO_LENTGH, self.dtlb)
+            if pte is None:
+                self.fault_addr = va
+                return self.miss_status
+            if pte.perms != M_READ_WRITE:
+                self.fault_addr = va
+                return EXC_PAGE_FAULT_PERMS
+            if pte.cow:
+                self.cow_faults += 1
+                if not self.cow_fast:
+                    self.fault_addr = va
+                    return EXC_PAGE_FAULT_PERMS
+                try:
+                    pte.unshare()
+                except MemoryError:
+                    self.fault_addr = va
+                    return EXC_OUT_OF_MEMORY
+            pa  = (pte.frame << VPO_LENTGH) | vpo
+            self.mem[pa:pa+n] = data[off:off+n]
+            self.memory.invalidate_code(pte.frame)
+            va  = (va + n) & MASK32
+            off += n
+        return EXC_NONE
+
+    def mem_access(self, valid, va, data, function) -> (int, int):
+        # if not valid:
+        #     return ( 0, True )
+        if function == M_XRD:
+            return self.mem_load(va)
         elif function == M_XWR:
-            # check permissions, validity etc
-            if pte.perms == M_READ_WRITE:
-                page = pte.physical_page
-                ppo = vpo
-                word_as_bytes = int(data).to_bytes(WORD_SIZE, "little")
-                page[ppo:ppo+WORD_SIZE] = word_as_bytes
-                return ( WORD(0), EXC_NONE )
-            else:
-                # fault
-                return ( WORD(0), EXC_PAGE_FAULT_PERMS )
+            return self.mem_store(va, data)
         else:
-            return ( WORD(0), EXC_ILLEGAL_INST )
+            return ( 0, EXC_ILLEGAL_INST )
 
 
 #--------------------------------------------------------------------------
-#   Clock: models a cpu clock
+#   Timer: models the RISC-V mtime and mtimecmp registers
+#
+#   mtime counts the instructions retired by run() and resume(). A timer
+#   interrupt is pending once mtime reaches mtimecmp; run() stops exactly
+#   there with EXC_CLOCK, while resume() ignores the timer. The kernel can
+#   reprogram the timer between runs. A periodic timer is rearmed on
+#   delivery, keeping its phase; periods missed while interrupts were not
+#   taken (e.g., during resume()) are coalesced into one interrupt.
+#--------------------------------------------------------------------------
+
+class Timer(object):
+
+    NEVER       = (1 << 64) - 1     # mtimecmp of a disarmed timer
+
+    def __init__(self, period = 0):
+        self.mtime      = 0
+        self.mtimecmp   = Timer.NEVER
+        self.interval   = 0         # rearm interval of a periodic timer, 0 if one-shot
+        self.interrupts = 0         # interrupts delivered
+        if period:
+            self.periodic(period)
+
+    def oneshot(self, delay):
+        # One interrupt after delay more instructions
+        self.mtimecmp   = self.mtime + delay
+        self.interval   = 0
+
+    def periodic(self, period):
+        # An interrupt every period instructions, starting now
+        self.mtimecmp   = self.mtime + period
+        self.interval   = period
+
+    def cancel(self):
+        self.mtimecmp   = Timer.NEVER
+        self.interval   = 0
+
+    def pending(self):
+        return self.mtime >= self.mtimecmp
+
+    def remaining(self):
+        # instructions until the deadline
+        return max(self.mtimecmp - self.mtime, 0)
+
+    def deliver(self):
+        # Called by the engine when it stops on the pending interrupt
+        self.interrupts += 1
+        if not self.interval:
+            self.mtimecmp = Timer.NEVER
+            return
+        self.mtimecmp += self.interval
+        if self.mtimecmp <= self.mtime:
+            self.mtimecmp = self.mtime + self.interval
+
+
+#--------------------------------------------------------------------------
+#   Clock: the former cpu clock, kept as a view of a periodic Timer
+#
+#   cpu.clock is a Clock over cpu.timer, for kernels written against the
+#   old interface: period is the timer interval (0 if the timer is not
+#   periodic), and cycles the instructions since the last interrupt.
+#   Setting either reprograms the timer. Unlike the old clock, which
+#   interrupted every period + 1 instructions, the timer interrupts every
+#   period instructions. New code should use the Timer directly.
 #--------------------------------------------------------------------------
 
 class Clock(object):
 
-    def __init__(self):
-        self.cycles = 0
-        ## period - how often clock interrupt occurs
-        self.period = 500
+    def __init__(self, period = 500, timer = None):
+        self.timer = Timer(period) if timer is None else timer
+
+    @property
+    def period(self):
+        return self.timer.interval
+
+    @period.setter
+    def period(self, period):
+        if period:
+            self.timer.periodic(period)
+        else:
+            self.timer.cancel()
+
+    @property
+    def cycles(self):
+        if not self.timer.interval:
+            return 0
+        return self.timer.interval - self.timer.remaining()
+
+    @cycles.setter
+    def cycles(self, cycles):
+        if self.timer.interval:
+            self.timer.mtimecmp = self.timer.mtime + self.timer.interval - cycles
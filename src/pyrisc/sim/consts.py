@@ -24,6 +24,14 @@ import numpy as np
 WORD                = np.uint32
 SWORD               = np.int32
 
+# The execution core keeps 32-bit words in plain ints in [0, 2**32), which
+# is much faster than NumPy scalars; results are masked with MASK32
+MASK32              = 0xffffffff
+
+def sword(v):
+    # signed value of a 32-bit word
+    return v - 0x100000000 if v & 0x80000000 else v
+
 
 #--------------------------------------------------------------------------
 #   RISC-V constants
@@ -32,21 +40,21 @@ SWORD               = np.int32
 WORD_SIZE           = 4
 NUM_REGS            = 32
 
-BUBBLE              = WORD(0x00004033)      # Machine-generated NOP:  xor x0, x0, x0
-NOP                 = WORD(0x00000013)      # Software-generated NOP: addi zero, zero, 0
-ILLEGAL             = WORD(0xffffffff)
+BUBBLE              = 0x00004033      # Machine-generated NOP:  xor x0, x0, x0
+NOP                 = 0x00000013      # Software-generated NOP: addi zero, zero, 0
+ILLEGAL             = 0xffffffff
 
-OP_MASK             = WORD(0x0000007f)
+OP_MASK             = 0x0000007f
 OP_SHIFT            = 0
-RD_MASK             = WORD(0x00000f80)
+RD_MASK             = 0x00000f80
 RD_SHIFT            = 7
-FUNCT3_MASK         = WORD(0x00007000)
+FUNCT3_MASK         = 0x00007000
 FUNCT3_SHIFT        = 12
-RS1_MASK            = WORD(0x000f8000)
+RS1_MASK            = 0x000f8000
 RS1_SHIFT           = 15
-RS2_MASK            = WORD(0x01f00000)
+RS2_MASK            = 0x01f00000
 RS2_SHIFT           = 20
-FUNCT7_MASK         = WORD(0xfe000000)
+FUNCT7_MASK         = 0xfe000000
 FUNCT7_SHIFT        = 25
 
 
@@ -155,6 +163,25 @@ MT_BU               = 5
 MT_HU               = 6
 MT_WU               = 7
 
+# ( access size in bytes, sign-extended ) for each memory operation type
+MT_ACCESS           = {
+                    MT_B:   ( 1, True ),
+                    MT_H:   ( 2, True ),
+                    MT_W:   ( 4, False ),
+                    MT_BU:  ( 1, False ),
+                    MT_HU:  ( 2, False ),
+                    MT_WU:  ( 4, False ),
+}
+
+
+#--------------------------------------------------------------------------
+#   Execution trace record kinds (see trace.py)
+#--------------------------------------------------------------------------
+
+TR_NONE             = 0         # no memory access
+TR_LOAD             = 1
+TR_STORE            = 2
+
 
 #--------------------------------------------------------------------------
 #   Exceptions
@@ -168,6 +195,8 @@ EXC_ILLEGAL_INST    = 4
 EXC_EBREAK          = 8
 EXC_ECALL           = 16        ## ? takie są exception codes na riscv?
 EXC_CLOCK           = 32        ## przerwanie zegarowe
+EXC_INTERRUPT       = 64        # interrupt posted by a device
+EXC_OUT_OF_MEMORY   = 128       # no free frame for a demand-zero or copy-on-write page
 
 EXC_MSG = {         
                     EXC_PAGE_FAULT_MISS: "page fault - page not present",
@@ -177,4 +206,6 @@ EXC_MSG = {
                     EXC_EBREAK:         "ebreak",
                     EXC_ECALL:          "syscall",
                     EXC_CLOCK:          "clock interrupt",
+                    EXC_INTERRUPT:      "external interrupt",
+                    EXC_OUT_OF_MEMORY:  "out of physical memory",
 }
@@ -0,0 +1,126 @@
+#==========================================================================
+#
+#   The PyRISC Project
+#
+#   SNURISC: A RISC-V ISA Simulator
+#
+#   Per-opcode and per-pc execution counts.
+#
+#==========================================================================
+
+import csv
+import json
+from array import array
+
+import numpy as np
+
+from pyrisc.sim.consts import *
+from pyrisc.sim.isa import *
+from pyrisc.sim.snurisc import IMEM_START, IMEM_SIZE
+
+
+#--------------------------------------------------------------------------
+#   Configurations
+#--------------------------------------------------------------------------
+
+HIST_BUFFER         = 1 << 20       # keys buffered before they are counted
+
+# Compact opcode ids: index into HIST_OPCODES
+HIST_OPCODES        = sorted(isa.keys())
+HIST_OPCODE_ID      = { opcode: i for i, opcode in enumerate(HIST_OPCODES) }
+HIST_BRANCHES       = [ BEQ, BNE, BLT, BGE, BLTU, BGEU ]
+
+
+#--------------------------------------------------------------------------
+#   Histogram: execution counts per opcode, per pc and per branch outcome
+#
+#   Set cpu.hist to a Histogram to collect the counts; like logs, this
+#   uses the instrumented loop of the interpreter. Each instruction only
+#   appends a key ( opcode id, pc index, taken ) to a buffer, and the
+#   buffer is added to the NumPy arrays in bulk with np.bincount().
+#   pcs outside [ base, base + size ) are counted in the last pc slot.
+#--------------------------------------------------------------------------
+
+class Histogram(object):
+
+    def __init__(self, base = IMEM_START, size = IMEM_SIZE):
+        # Keys are 32-bit, which limits size to about 200MB
+        self.base       = int(base)
+        self.npcs       = int(size) // WORD_SIZE + 1
+        nops            = len(HIST_OPCODES)
+        self.ops        = np.zeros(nops, dtype = np.uint64)             # per opcode id
+        self.pcs        = np.zeros(self.npcs, dtype = np.uint64)        # per pc index
+        self.branches   = np.zeros(self.npcs, dtype = np.uint64)        # conditional branches
+        self.taken      = np.zeros(self.npcs, dtype = np.uint64)        # ... taken
+        self.keys       = array('I')
+        self.is_branch  = np.array([ op in HIST_BRANCHES for op in HIST_OPCODES ])
+
+    # taken: outcome of a conditional branch, as evaluated by the engine
+    # (a taken branch may still go to pc + 4)
+    def add(self, pc, opcode, taken):
+        i = (pc - self.base) >> 2
+        if not 0 <= i < self.npcs - 1:
+            i = self.npcs - 1
+        key = (HIST_OPCODE_ID[opcode] * self.npcs + i) << 1
+        if taken:
+            key |= 1
+        self.keys.append(key)
+        if len(self.keys) >= HIST_BUFFER:
+            self.flush()
+
+    def flush(self):
+        # Adds the buffered keys to the counts
+        if not self.keys:
+            return
+        keys    = np.frombuffer(self.keys, dtype = np.uint32)
+        taken   = (keys & 1).astype(bool)
+        ops     = (keys >> 1) // self.npcs
+        pcs     = (keys >> 1) % self.npcs
+        self.ops        += np.bincount(ops, minlength = len(HIST_OPCODES)).astype(np.uint64)
+        self.pcs        += np.bincount(pcs, minlength = self.npcs).astype(np.uint64)
+        self.branches   += np.bincount(pcs[self.is_branch[ops]], minlength = self.npcs).astype(np.uint64)
+        self.taken      += np.bincount(pcs[taken], minlength = self.npcs).astype(np.uint64)
+        self.keys       = array('I')
+
+    def pc(self, index):
+        # pc of a pc index (None for the slot of pcs outside the range)
+        return self.base + int(index) * WORD_SIZE if index < self.npcs - 1 else None
+
+    def opcode_counts(self):
+        # { opcode name: count } of the executed opcodes
+        self.flush()
+        return { RISCV.opcode_name(HIST_OPCODES[i]): int(n) for i, n in enumerate(self.ops) if n }
+
+    def hot_pcs(self, count = 10):
+        # [ ( pc, executions ) ] of the most executed pcs
+        self.flush()
+        order = np.argsort(self.pcs[:-1], kind = 'stable')[::-1][:count]
+        return [ ( self.pc(i), int(self.pcs[i]) ) for i in order if self.pcs[i] ]
+
+    def to_json(self):
+        self.flush()
+        pcs = np.nonzero(self.pcs[:-1])[0]
+        brs = np.nonzero(self.branches[:-1])[0]
+        return json.dumps({
+            'opcodes'   : self.opcode_counts(),
+            'pcs'       : { "0x%08x" % self.pc(i): int(self.pcs[i]) for i in pcs },
+            'branches'  : { "0x%08x" % self.pc(i): [ int(self.taken[i]), int(self.branches[i] - self.taken[i]) ]
+                            for i in brs },
+            'outside'   : int(self.pcs[-1]),
+        })
+
+    def write_csv(self, f, table = 'pc'):
+        # table 'opcode': opcode, count
+        # table 'pc'    : pc, count, taken, not taken (for branches)
+        self.flush()
+        w = csv.writer(f)
+        if table == 'opcode':
+            w.writerow([ 'opcode', 'count' ])
+            for name, n in sorted(self.opcode_counts().items(), key = lambda x: -x[1]):
+                w.writerow([ name, n ])
+            return
+        w.writerow([ 'pc', 'count', 'taken', 'not_taken' ])
+        for i in np.nonzero(self.pcs[:-1])[0]:
+            br = self.branches[i]
+            w.writerow([ "0x%08x" % self.pc(i), int(self.pcs[i]),
+                         int(self.taken[i]) if br else '', int(br - self.taken[i]) if br else '' ])
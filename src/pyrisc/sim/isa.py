@@ -21,103 +21,103 @@ from pyrisc.sim.consts import *
 #   Instruction encodings
 #--------------------------------------------------------------------------
 
-LW          = WORD(0b00000000000000000010000000000011)
-SW          = WORD(0b00000000000000000010000000100011)
-AUIPC       = WORD(0b00000000000000000000000000010111)
-LUI         = WORD(0b00000000000000000000000000110111)
-ADDI        = WORD(0b00000000000000000000000000010011)
-
-SLLI        = WORD(0b00000000000000000001000000010011)
-SLTI        = WORD(0b00000000000000000010000000010011)
-SLTIU       = WORD(0b00000000000000000011000000010011)
-XORI        = WORD(0b00000000000000000100000000010011)
-SRLI        = WORD(0b00000000000000000101000000010011)
-
-SRAI        = WORD(0b01000000000000000101000000010011)
-ORI         = WORD(0b00000000000000000110000000010011)
-ANDI        = WORD(0b00000000000000000111000000010011)
-ADD         = WORD(0b00000000000000000000000000110011)
-SUB         = WORD(0b01000000000000000000000000110011)
-
-SLL         = WORD(0b00000000000000000001000000110011)
-SLT         = WORD(0b00000000000000000010000000110011)
-SLTU        = WORD(0b00000000000000000011000000110011)
-XOR         = WORD(0b00000000000000000100000000110011)
-SRL         = WORD(0b00000000000000000101000000110011)
-
-SRA         = WORD(0b01000000000000000101000000110011)
-OR          = WORD(0b00000000000000000110000000110011)
-AND         = WORD(0b00000000000000000111000000110011)
-JALR        = WORD(0b00000000000000000000000001100111)
-JAL         = WORD(0b00000000000000000000000001101111)
-
-BEQ         = WORD(0b00000000000000000000000001100011)
-BNE         = WORD(0b00000000000000000001000001100011)
-BLT         = WORD(0b00000000000000000100000001100011)
-BGE         = WORD(0b00000000000000000101000001100011)
-BLTU        = WORD(0b00000000000000000110000001100011)
-
-BGEU        = WORD(0b00000000000000000111000001100011)
-ECALL       = WORD(0b00000000000000000000000001110011)
-EBREAK      = WORD(0b00000000000100000000000001110011)
-
-LB          = WORD(0b00000000000000000000000000000011)
-LBU         = WORD(0b00000000000000000100000000000011)
-LH          = WORD(0b00000000000000000001000000000011)
-LHU         = WORD(0b00000000000000000101000000000011)
-SB          = WORD(0b00000000000000000000000000100011)
-SH          = WORD(0b00000000000000000001000000100011)
+LW          = 0b00000000000000000010000000000011
+SW          = 0b00000000000000000010000000100011
+AUIPC       = 0b00000000000000000000000000010111
+LUI         = 0b00000000000000000000000000110111
+ADDI        = 0b00000000000000000000000000010011
+
+SLLI        = 0b00000000000000000001000000010011
+SLTI        = 0b00000000000000000010000000010011
+SLTIU       = 0b00000000000000000011000000010011
+XORI        = 0b00000000000000000100000000010011
+SRLI        = 0b00000000000000000101000000010011
+
+SRAI        = 0b01000000000000000101000000010011
+ORI         = 0b00000000000000000110000000010011
+ANDI        = 0b00000000000000000111000000010011
+ADD         = 0b00000000000000000000000000110011
+SUB         = 0b01000000000000000000000000110011
+
+SLL         = 0b00000000000000000001000000110011
+SLT         = 0b00000000000000000010000000110011
+SLTU        = 0b00000000000000000011000000110011
+XOR         = 0b00000000000000000100000000110011
+SRL         = 0b00000000000000000101000000110011
+
+SRA         = 0b01000000000000000101000000110011
+OR          = 0b00000000000000000110000000110011
+AND         = 0b00000000000000000111000000110011
+JALR        = 0b00000000000000000000000001100111
+JAL         = 0b00000000000000000000000001101111
+
+BEQ         = 0b00000000000000000000000001100011
+BNE         = 0b00000000000000000001000001100011
+BLT         = 0b00000000000000000100000001100011
+BGE         = 0b00000000000000000101000001100011
+BLTU        = 0b00000000000000000110000001100011
+
+BGEU        = 0b00000000000000000111000001100011
+ECALL       = 0b00000000000000000000000001110011
+EBREAK      = 0b00000000000100000000000001110011
+
+LB          = 0b00000000000000000000000000000011
+LBU         = 0b00000000000000000100000000000011
+LH          = 0b00000000000000000001000000000011
+LHU         = 0b00000000000000000101000000000011
+SB          = 0b00000000000000000000000000100011
+SH          = 0b00000000000000000001000000100011
 
 #--------------------------------------------------------------------------
 #   Instruction masks
 #--------------------------------------------------------------------------
 
-LW_MASK     = WORD(0b00000000000000000111000001111111)
-SW_MASK     = WORD(0b00000000000000000111000001111111)
-AUIPC_MASK  = WORD(0b00000000000000000000000001111111)
-LUI_MASK    = WORD(0b00000000000000000000000001111111)
-ADDI_MASK   = WORD(0b00000000000000000111000001111111)
-
-SLLI_MASK   = WORD(0b11111100000000000111000001111111)
-SLTI_MASK   = WORD(0b00000000000000000111000001111111)
-SLTIU_MASK  = WORD(0b00000000000000000111000001111111)
-XORI_MASK   = WORD(0b00000000000000000111000001111111)
-SRLI_MASK   = WORD(0b11111100000000000111000001111111)
-
-SRAI_MASK   = WORD(0b11111100000000000111000001111111)
-ORI_MASK    = WORD(0b00000000000000000111000001111111)
-ANDI_MASK   = WORD(0b00000000000000000111000001111111)
-ADD_MASK    = WORD(0b11111110000000000111000001111111)
-SUB_MASK    = WORD(0b11111110000000000111000001111111)
-
-SLL_MASK    = WORD(0b11111110000000000111000001111111)
-SLT_MASK    = WORD(0b11111110000000000111000001111111)
-SLTU_MASK   = WORD(0b11111110000000000111000001111111)
-XOR_MASK    = WORD(0b11111110000000000111000001111111)
-SRL_MASK    = WORD(0b11111110000000000111000001111111)
-
-SRA_MASK    = WORD(0b11111110000000000111000001111111)
-OR_MASK     = WORD(0b11111110000000000111000001111111)
-AND_MASK    = WORD(0b11111110000000000111000001111111)
-JALR_MASK   = WORD(0b00000000000000000111000001111111)
-JAL_MASK    = WORD(0b00000000000000000000000001111111)
-
-BEQ_MASK    = WORD(0b00000000000000000111000001111111)
-BNE_MASK    = WORD(0b00000000000000000111000001111111)
-BLT_MASK    = WORD(0b00000000000000000111000001111111)
-BGE_MASK    = WORD(0b00000000000000000111000001111111)
-BLTU_MASK   = WORD(0b00000000000000000111000001111111)
-
-BGEU_MASK   = WORD(0b00000000000000000111000001111111)
-ECALL_MASK  = WORD(0b11111111111111111111111111111111)
-EBREAK_MASK = WORD(0b11111111111111111111111111111111)
-
-LB_MASK         = WORD(0b00000000000000000111000001111111)
-LBU_MASK        = WORD(0b00000000000000000111000001111111)
-LH_MASK         = WORD(0b00000000000000000111000001111111)
-LHU_MASK        = WORD(0b00000000000000000111000001111111)
-SB_MASK         = WORD(0b00000000000000000111000001111111)
-SH_MASK         = WORD(0b00000000000000000111000001111111)
+LW_MASK     = 0b00000000000000000111000001111111
+SW_MASK     = 0b00000000000000000111000001111111
+AUIPC_MASK  = 0b00000000000000000000000001111111
+LUI_MASK    = 0b00000000000000000000000001111111
+ADDI_MASK   = 0b00000000000000000111000001111111
+
+SLLI_MASK   = 0b11111100000000000111000001111111
+SLTI_MASK   = 0b00000000000000000111000001111111
+SLTIU_MASK  = 0b00000000000000000111000001111111
+XORI_MASK   = 0b00000000000000000111000001111111
+SRLI_MASK   = 0b11111100000000000111000001111111
+
+SRAI_MASK   = 0b11111100000000000111000001111111
+ORI_MASK    = 0b00000000000000000111000001111111
+ANDI_MASK   = 0b00000000000000000111000001111111
+ADD_MASK    = 0b11111110000000000111000001111111
+SUB_MASK    = 0b11111110000000000111000001111111
+
+SLL_MASK    = 0b11111110000000000111000001111111
+SLT_MASK    = 0b11111110000000000111000001111111
+SLTU_MASK   = 0b11111110000000000111000001111111
+XOR_MASK    = 0b11111110000000000111000001111111
+SRL_MASK    = 0b11111110000000000111000001111111
+
+SRA_MASK    = 0b11111110000000000111000001111111
+OR_MASK     = 0b11111110000000000111000001111111
+AND_MASK    = 0b11111110000000000111000001111111
+JALR_MASK   = 0b00000000000000000111000001111111
+JAL_MASK    = 0b00000000000000000000000001111111
+
+BEQ_MASK    = 0b00000000000000000111000001111111
+BNE_MASK    = 0b00000000000000000111000001111111
+BLT_MASK    = 0b00000000000000000111000001111111
+BGE_MASK    = 0b00000000000000000111000001111111
+BLTU_MASK   = 0b00000000000000000111000001111111
+
+BGEU_MASK   = 0b00000000000000000111000001111111
+ECALL_MASK  = 0b11111111111111111111111111111111
+EBREAK_MASK = 0b11111111111111111111111111111111
+
+LB_MASK         = 0b00000000000000000111000001111111
+LBU_MASK        = 0b00000000000000000111000001111111
+LH_MASK         = 0b00000000000000000111000001111111
+LHU_MASK        = 0b00000000000000000111000001111111
+SB_MASK         = 0b00000000000000000111000001111111
+SH_MASK         = 0b00000000000000000111000001111111
 
 #--------------------------------------------------------------------------
 #   ISA table
@@ -164,15 +164,59 @@ isa         = {
     ECALL   : [ "ecall",    ECALL_MASK, X_TYPE,  CL_CTRL, OP1_X,   OP2_X,   ALU_X,    MT_X,  ],
     EBREAK  : [ "ebreak",   EBREAK_MASK,X_TYPE,  CL_CTRL, OP1_X,   OP2_X,   ALU_X,    MT_X,  ],
 
-    LB      : [ "lb",       LB_MASK,          IL_TYPE, CL_MEM,  OP1_RS1, OP2_IMI, MEM_LD,   MT_W,  ],
-    LBU     : [ "lbu",      LBU_MASK,         IL_TYPE, CL_MEM,  OP1_RS1, OP2_IMI, MEM_LD,   MT_W,  ],
-    LH      : [ "lh",       LH_MASK,          IL_TYPE, CL_MEM,  OP1_RS1, OP2_IMI, MEM_LD,   MT_W,  ],
-    LHU     : [ "lhu",      LHU_MASK,         IL_TYPE, CL_MEM,  OP1_RS1, OP2_IMI, MEM_LD,   MT_W,  ],
-    SB      : [ "sb",       SB_MASK,          S_TYPE,  CL_MEM,  OP1_RS1, OP2_IMS, MEM_ST,   MT_W,  ],
-    SH      : [ "sh",       SH_MASK,          S_TYPE,  CL_MEM,  OP1_RS1, OP2_IMS, MEM_ST,   MT_W,  ],
+    LB      : [ "lb",       LB_MASK,          IL_TYPE, CL_MEM,  OP1_RS1, OP2_IMI, MEM_LD,   MT_B,  ],
+    LBU     : [ "lbu",      LBU_MASK,         IL_TYPE, CL_MEM,  OP1_RS1, OP2_IMI, MEM_LD,   MT_BU, ],
+    LH      : [ "lh",       LH_MASK,          IL_TYPE, CL_MEM,  OP1_RS1, OP2_IMI, MEM_LD,   MT_H,  ],
+    LHU     : [ "lhu",      LHU_MASK,         IL_TYPE, CL_MEM,  OP1_RS1, OP2_IMI, MEM_LD,   MT_HU, ],
+    SB      : [ "sb",       SB_MASK,          S_TYPE,  CL_MEM,  OP1_RS1, OP2_IMS, MEM_ST,   MT_B,  ],
+    SH      : [ "sh",       SH_MASK,          S_TYPE,  CL_MEM,  OP1_RS1, OP2_IMS, MEM_ST,   MT_H,  ],
 }
 
 
+#--------------------------------------------------------------------------
+#   Decode table: built once from the ISA table
+#
+#   decode_table[opcode] is None for unused opcodes, or a list of 1024
+#   slots indexed by (funct7 << 3 | funct3). A slot holds the ISA table key,
+#   ILLEGAL, or None when the mask also covers bits outside opcode, funct3
+#   and funct7. Such slots are resolved via decode_slow, which keeps the
+#   candidates in ISA table order.
+#--------------------------------------------------------------------------
+
+DECODE_MASK         = int(OP_MASK | FUNCT3_MASK | FUNCT7_MASK)
+
+decode_table        = [ None ] * (int(OP_MASK) + 1)
+decode_slow         = { }
+
+def build_decode_table():
+    candidates = { }
+    for k, v in isa.items():
+        key     = int(k)
+        mask    = int(v[IN_MASK])
+        op      = key & 0x7f
+        for funct7 in range(0x80):
+            if ((funct7 << FUNCT7_SHIFT) ^ key) & mask & 0xfe000000:
+                continue
+            for funct3 in range(0x8):
+                if ((funct3 << FUNCT3_SHIFT) ^ key) & mask & 0x00007000:
+                    continue
+                slot = (funct7 << 3) | funct3
+                candidates.setdefault((op, slot), []).append((k, key, mask))
+
+    for (op, slot), cands in candidates.items():
+        if decode_table[op] is None:
+            decode_table[op] = [ ILLEGAL ] * 1024
+        k, key, mask = cands[0]
+        if mask & ~DECODE_MASK:
+            bits = (slot >> 3) << FUNCT7_SHIFT | (slot & 0x7) << FUNCT3_SHIFT | op
+            decode_table[op][slot] = None
+            decode_slow[bits] = cands
+        else:
+            decode_table[op][slot] = k
+
+build_decode_table()
+
+
 #--------------------------------------------------------------------------
 #   RISCV: decodes RISC-V instructions
 #--------------------------------------------------------------------------
@@ -186,6 +230,22 @@ class RISCV(object):
 
     @staticmethod
     def opcode(inst):
+        inst    = int(inst)
+        row     = decode_table[inst & 0x7f]
+        if row is None:
+            return ILLEGAL
+        k       = row[((inst >> 22) & 0x3f8) | ((inst >> 12) & 0x7)]
+        if k is None:
+            # The mask also covers rd/rs1/rs2 (e.g., ecall and ebreak)
+            for k, key, mask in decode_slow[inst & DECODE_MASK]:
+                if not (inst & mask) ^ key:
+                    return k
+            return ILLEGAL
+        return k
+
+    @staticmethod
+    def opcode_scan(inst):
+        # Reference decoder: linear scan over the ISA table
         for k, v in isa.items():
             if not (inst & v[IN_MASK]) ^ k:
                 return k
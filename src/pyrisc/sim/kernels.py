@@ -0,0 +1,72 @@
+#==========================================================================
+#
+#   The PyRISC Project
+#
+#   SNURISC: A RISC-V ISA Simulator
+#
+#   Instruction encoders and guest kernels for benchmarks and tests.
+#
+#==========================================================================
+
+from pyrisc.sim.consts import *
+from pyrisc.sim.isa import *
+
+
+#--------------------------------------------------------------------------
+#   Guest kernels
+#--------------------------------------------------------------------------
+
+TEXT_START  = 0x80000000
+DATA_START  = 0x80010000
+
+def enc_r(op, rd, rs1, rs2):
+    return int(op) | (rd << 7) | (rs1 << 15) | (rs2 << 20)
+
+def enc_i(op, rd, rs1, imm):
+    return int(op) | (rd << 7) | (rs1 << 15) | ((imm & 0xfff) << 20)
+
+def enc_s(op, rs2, rs1, imm):
+    return int(op) | ((imm & 0x1f) << 7) | (rs1 << 15) | (rs2 << 20) | (((imm >> 5) & 0x7f) << 25)
+
+def enc_b(op, rs1, rs2, imm):
+    return int(op) | (((imm >> 11) & 1) << 7) | (((imm >> 1) & 0xf) << 8) | (rs1 << 15) | \
+           (rs2 << 20) | (((imm >> 5) & 0x3f) << 25) | (((imm >> 12) & 1) << 31)
+
+def enc_u(op, rd, imm):
+    return int(op) | (rd << 7) | (imm & 0xfffff000)
+
+def enc_j(op, rd, imm):
+    return int(op) | (rd << 7) | (((imm >> 12) & 0xff) << 12) | (((imm >> 11) & 1) << 20) | \
+           (((imm >> 1) & 0x3ff) << 21) | (((imm >> 20) & 1) << 31)
+
+def kernel(body, iterations):
+    # t0 = iterations; s0 = DATA_START; loop: body; t0 -= 1; bnez t0, loop; ebreak
+    T0, S0 = 5, 8
+    code = [ enc_i(ADDI, T0, 0, 0), enc_u(LUI, T0, iterations << 12), enc_i(SRLI, T0, T0, 12),
+             enc_u(LUI, S0, DATA_START) ]
+    code += body
+    code += [ enc_i(ADDI, T0, T0, -1), enc_b(BNE, T0, 0, -4 * (len(body) + 1)), int(EBREAK) ]
+    return code
+
+def kernel_alu(iterations):
+    A0, A1, A2, A3, A4, T0 = 10, 11, 12, 13, 14, 5
+    return kernel([ enc_r(ADD, A0, A0, T0), enc_r(XOR, A1, A1, A0), enc_i(SLLI, A2, A0, 3),
+                    enc_r(SRL, A3, A2, T0), enc_r(SUB, A4, A3, A1), enc_i(ANDI, A0, A4, 0x7ff),
+                    enc_r(SLTU, A2, A1, A0), enc_r(OR, A3, A3, A2) ], iterations)
+
+def kernel_mem(iterations):
+    A0, A1, S0, T0 = 10, 11, 8, 5
+    return kernel([ enc_s(SW, T0, S0, 0), enc_i(LW, A0, S0, 0), enc_r(ADD, A1, A1, A0),
+                    enc_s(SW, A1, S0, 4), enc_i(LW, A0, S0, 4), enc_i(LBU, A1, S0, 1) ], iterations)
+
+def kernel_branch(iterations):
+    A0, A1, T0 = 10, 11, 5
+    return kernel([ enc_i(ANDI, A0, T0, 1), enc_b(BEQ, A0, 0, 8), enc_i(ADDI, A1, A1, 1),
+                    enc_i(ANDI, A0, T0, 2), enc_b(BNE, A0, 0, 8), enc_i(ADDI, A1, A1, -1),
+                    enc_b(BLTU, T0, A1, 8), enc_i(XORI, A1, A1, 5) ], iterations)
+
+kernels = {
+    'alu'       : kernel_alu,
+    'mem'       : kernel_mem,
+    'branch'    : kernel_branch,
+}
@@ -0,0 +1,154 @@
+#==========================================================================
+#
+#   The PyRISC Project
+#
+#   SNURISC: A RISC-V ISA Simulator
+#
+#   Multi-hart machine with a deterministic scheduler.
+#
+#==========================================================================
+
+import time
+import random
+
+from pyrisc.sim.consts import *
+from pyrisc.sim.components import *
+from pyrisc.sim.sim import *
+from pyrisc.sim.snurisc import SNURISC
+
+
+#--------------------------------------------------------------------------
+#   Configurations
+#--------------------------------------------------------------------------
+
+MACHINE_QUANTUM     = 1000          # instructions per hart before switching
+MACHINE_POLICIES    = [ 'rr', 'random' ]
+
+
+#--------------------------------------------------------------------------
+#   Machine: N harts sharing one address space
+#
+#   Each hart is a SNURISC with its own registers, pc, TLBs, timer, stats
+#   and engine; all of them map the same page table, and so the same
+#   frames of the physical memory. Decoded instructions and translated
+#   blocks only depend on the frame, so the harts share one decode cache
+#   and one block cache. Syscall handlers registered on any hart are
+#   registered on all of them.
+#
+#   run() interleaves the harts one quantum at a time, in hart id order
+#   ('rr') or picking a runnable hart at random ('random'). The harts run
+#   through resume(), so a quantum is exact and a given seed always gives
+#   the same interleaving. run() returns ( hart id, event ) when a hart
+#   raises an event, including timer interrupts (cpu.timer of each hart)
+#   and interrupts posted to it when it is scheduled; the hart goes on
+#   with the rest of its quantum on the next run().
+#--------------------------------------------------------------------------
+
+class Machine(object):
+
+    def __init__(self, vm, harts = 2, engine = Sim, quantum = MACHINE_QUANTUM,
+                 policy = 'rr', seed = 0):
+        if policy not in MACHINE_POLICIES:
+            raise ValueError("unknown scheduling policy '%s'" % policy)
+        self.harts      = [ ]
+        for i in range(harts):
+            hart = SNURISC(vm, engine, 0)
+            hart.hartid = i
+            if self.harts:
+                hart.mmu.decode_cache   = self.harts[0].mmu.decode_cache
+                hart.mmu.block_cache    = self.harts[0].mmu.block_cache
+                hart.syscalls           = self.harts[0].syscalls
+            self.harts.append(hart)
+        self.quantum    = quantum
+        self.policy     = policy
+        self.rnd        = random.Random(seed)
+        self.halted     = [ False ] * harts
+        self.current    = None          # hart running its quantum
+        self.last       = -1            # last hart scheduled
+        self.left       = 0             # instructions left in the quantum
+        self.switches   = 0             # quanta started
+        self.retired    = 0             # instructions retired by run()
+        self.elapsed    = 0.0           # seconds spent in run()
+
+    def start(self, entry_point):
+        # All harts start at entry_point with their hart id in a0
+        for hart in self.harts:
+            hart.pc.write(entry_point)
+            hart.regs.write(10, hart.hartid)
+
+    def halt(self, hartid):
+        # The hart is not scheduled until wake()
+        self.halted[hartid] = True
+        if self.current == hartid:
+            self.preempt()
+
+    def wake(self, hartid):
+        self.halted[hartid] = False
+
+    def preempt(self):
+        # Ends the quantum of the current hart
+        if self.current is not None:
+            self.last       = self.current
+            self.current    = None
+
+    def schedule(self):
+        # returns the next hart id, or None if all harts are halted
+        runnable = [ i for i, halted in enumerate(self.halted) if not halted ]
+        if not runnable:
+            return None
+        if self.policy == 'random':
+            return self.rnd.choice(runnable)
+        for i in runnable:
+            if i > self.last:
+                return i
+        return runnable[0]
+
+    def run(self, max_insts = None):
+        # Runs the harts until one raises an event, all are halted, or
+        # max_insts instructions are retired. Returns ( hart id, event ),
+        # or ( None, None ) in the last two cases.
+
+        start   = time.perf_counter()
+        retired = 0
+        try:
+            while max_insts is None or retired < max_insts:
+                if self.current is None:
+                    self.current = self.schedule()
+                    if self.current is None:
+                        break
+                    self.left       = self.quantum
+                    self.switches   += 1
+
+                hartid  = self.current
+                hart    = self.harts[hartid]
+                timer   = hart.timer
+                if hart.irqs:
+                    return ( hartid, IrqEvent(EXC_INTERRUPT, hart.irqs.popleft()) )
+                if timer.pending():
+                    timer.deliver()
+                    return ( hartid, Event(EXC_CLOCK) )
+
+                budget  = min(self.left, timer.remaining())
+                if max_insts is not None:
+                    budget = min(budget, max_insts - retired)
+                r = hart.resume(budget)
+                retired     += r.retired
+                self.left   -= r.retired
+                if self.left == 0:
+                    self.preempt()
+                if r.event is not None:
+                    return ( hartid, r.event )
+            return ( None, None )
+        finally:
+            self.retired    += retired
+            self.elapsed    += time.perf_counter() - start
+
+    def mips(self):
+        # Simulated instructions per second of run(), all harts together
+        return self.retired / self.elapsed / 1e6 if self.elapsed else 0.0
+
+    def show(self):
+        for hart in self.harts:
+            print("hart %d: %d instructions" % (hart.hartid, hart.stat.icount))
+        print("%d instructions in %.3f s (%d quanta): %.3f MIPS" %
+              (self.retired, self.elapsed, self.switches, self.mips()))
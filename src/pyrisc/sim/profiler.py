@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+
+#==========================================================================
+#
+#   The PyRISC Project
+#
+#   SNURISC: A RISC-V ISA Simulator
+#
+#   Sampling profiler for guest programs.
+#
+#==========================================================================
+
+import sys
+
+from pyrisc.sim.consts import *
+from pyrisc.sim.components import *
+from pyrisc.sim.program import *
+from pyrisc.sim.sim import *
+from pyrisc.sim.translate import *
+from pyrisc.sim.snurisc import SNURISC, map_dmem
+
+
+#--------------------------------------------------------------------------
+#   Configurations
+#--------------------------------------------------------------------------
+
+PROFILE_INTERVAL    = 10000         # instructions retired between samples
+PROFILE_MAX_INSTS   = 100000000     # default instruction cap of main()
+
+
+#--------------------------------------------------------------------------
+#   Profiler: samples the pc of a CPU every interval instructions
+#
+#   Drive the CPU through prof.resume(budget) instead of cpu.resume(); the
+#   CPU runs in slices that end exactly at the sample points, so the
+#   engines run at full speed between samples. BlockSim single-steps the
+#   end of each slice, which is why the interval should not be too small.
+#   With callers, the return address in ra is sampled as well. It
+#   identifies the caller of leaf functions, and of other functions until
+#   they make a call.
+#--------------------------------------------------------------------------
+
+class Profiler(object):
+
+    def __init__(self, cpu, interval = PROFILE_INTERVAL, callers = False):
+        self.cpu        = cpu
+        self.interval   = interval
+        self.callers    = callers
+        self.left       = interval      # instructions until the next sample
+        self.samples    = { }           # pc -> samples
+        self.edges      = { }           # ( ra, pc ) -> samples, with callers
+        self.count      = 0
+
+    def resume(self, budget) -> RunResult:
+        # Same as cpu.resume(budget)
+        retired = 0
+        while retired < budget:
+            r = self.cpu.resume(min(self.left, budget - retired))
+            retired     += r.retired
+            self.left   -= r.retired
+            if self.left == 0:
+                self.sample()
+                self.left = self.interval
+            if r.event is not None:
+                return RunResult(r.event, retired)
+        return RunResult(None, retired)
+
+    def sample(self):
+        pc = self.cpu.pc.read()
+        self.samples[pc] = self.samples.get(pc, 0) + 1
+        if self.callers:
+            key = ( self.cpu.regs.read(1), pc )
+            self.edges[key] = self.edges.get(key, 0) + 1
+        self.count += 1
+
+    def stacks(self, symbols):
+        # { ( caller, function ) or ( function, ): samples }
+        stacks = { }
+        if not self.callers:
+            for pc, n in self.samples.items():
+                key = ( symbols.lookup(pc), )
+                stacks[key] = stacks.get(key, 0) + n
+            return stacks
+        for ( ra, pc ), n in self.edges.items():
+            func    = symbols.lookup(pc)
+            # ra points after the call; a stale ra points into func itself
+            caller  = symbols.lookup((ra - 4) & MASK32) if ra else None
+            key     = ( func, ) if caller is None or caller == func else ( caller, func )
+            stacks[key] = stacks.get(key, 0) + n
+        return stacks
+
+    def flat(self, symbols):
+        # Samples per function, hottest first
+        funcs = { }
+        for pc, n in self.samples.items():
+            name = symbols.lookup(pc)
+            funcs[name] = funcs.get(name, 0) + n
+        return sorted(funcs.items(), key = lambda x: (-x[1], x[0]))
+
+    def show_flat(self, symbols):
+        print("%d samples, one every %d instructions" % (self.count, self.interval))
+        print("%8s %7s  %s" % ("samples", "%", "function"))
+        for name, n in self.flat(symbols):
+            print("%8d %6.2f%%  %s" % (n, n * 100.0 / self.count, name))
+
+    def show_callgraph(self, symbols):
+        # Each function with its callers, hottest first
+        callers = { }
+        for key, n in self.stacks(symbols).items():
+            c = callers.setdefault(key[-1], { })
+            caller = key[0] if len(key) == 2 else "(unknown)"
+            c[caller] = c.get(caller, 0) + n
+        for name, n in self.flat(symbols):
+            print("%6.2f%%  %s" % (n * 100.0 / self.count, name))
+            for caller, m in sorted(callers.get(name, { }).items(), key = lambda x: (-x[1], x[0])):
+                print("           %8d  <- %s" % (m, caller))
+
+    def write_collapsed(self, symbols, f):
+        # One "caller;function samples" line per stack, for flame graphs
+        for key, n in sorted(self.stacks(symbols).items()):
+            f.write("%s %d\n" % (";".join(key), n))
+
+
+#--------------------------------------------------------------------------
+#   Utility functions for command line parsing
+#--------------------------------------------------------------------------
+
+def show_usage(name):
+    print("Usage: %s [-i interval] [-n max_insts] [-g] [-o file] [-b] filename" % name)
+    print("\tfilename: RISC-V executable file name")
+    print("\t-i sets the number of instructions between samples (default: %d)" % PROFILE_INTERVAL)
+    print("\t-n sets the instruction limit (default: %d)" % PROFILE_MAX_INSTS)
+    print("\t-g samples the return address and shows the call graph")
+    print("\t-o writes collapsed stacks for flame graphs to file")
+    print("\t-b runs the program with the basic-block translation engine")
+
+
+def parse_args(args):
+    opts    = { 'interval': PROFILE_INTERVAL, 'max_insts': PROFILE_MAX_INSTS,
+                'callers': False, 'output': None, 'engine': Sim }
+    index   = 1
+    while index < len(args) and args[index].startswith('-'):
+        try:
+            if args[index] == '-i':
+                opts['interval'] = int(args[index + 1])
+            elif args[index] == '-n':
+                opts['max_insts'] = int(args[index + 1])
+            elif args[index] == '-o':
+                opts['output'] = args[index + 1]
+            elif args[index] in [ '-g', '-b' ]:
+                if args[index] == '-g':
+                    opts['callers'] = True
+                else:
+                    opts['engine'] = BlockSim
+                index += 1
+                continue
+            else:
+                print("Invalid option '%s'" % args[index])
+                return None
+        except (IndexError, ValueError):
+            print("Invalid value for option '%s'" % args[index])
+            return None
+        index += 2
+
+    if index != len(args) - 1 or opts['interval'] <= 0:
+        return None
+    return ( args[index], opts )
+
+
+#--------------------------------------------------------------------------
+#   Profiler main
+#--------------------------------------------------------------------------
+
+def main():
+
+    parsed = parse_args(sys.argv)
+    if not parsed:
+        show_usage(sys.argv[0])
+        sys.exit()
+
+    filename, opts = parsed
+    prog    = Program()
+    vm      = PageTable()
+    try:
+        f = open(filename, 'rb')
+    except IOError:
+        print(ELF_ERR_MSG[ELF_ERR_OPEN] % filename)
+        sys.exit()
+    with f:
+        entry_point, ret = prog.load_image(vm, f)
+        symbols = prog.load_symbols(f)
+    if ret != ELF_OK:
+        print(ELF_ERR_MSG[ret] % filename)
+        sys.exit()
+
+    map_dmem(vm)
+
+    cpu     = SNURISC(vm, opts['engine'])
+    cpu.pc.write(entry_point)
+    prof    = Profiler(cpu, opts['interval'], opts['callers'])
+    r       = prof.resume(opts['max_insts'])
+    reason  = "instruction limit" if r.event is None else EXC_MSG.get(r.event.type, "exception")
+    print("%s at 0x%08x after %d instructions" % (reason, cpu.pc.read(), r.retired))
+    if prof.count == 0:
+        return
+
+    prof.show_flat(symbols)
+    if opts['callers']:
+        print()
+        prof.show_callgraph(symbols)
+    if opts['output']:
+        with open(opts['output'], 'w') as out:
+            prof.write_collapsed(symbols, out)
+
+
+if __name__ == '__main__':
+    main()
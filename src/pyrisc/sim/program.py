@@ -14,7 +14,15 @@
 #==========================================================================
 
 
+import io
+import mmap
+import bisect
+import hashlib
+import collections
+
 from elftools.elf import elffile as elf
+from elftools.elf.constants import P_FLAGS, SH_FLAGS
+from elftools.common.exceptions import ELFError
 from pyrisc.sim.consts import *
 from pyrisc.sim.isa import *
 from pyrisc.sim.components import *
@@ -37,6 +45,106 @@ class AsmCache(object):
         return self.cache.get(pc)
 
 
+#--------------------------------------------------------------------------
+#   Symbols: maps code addresses to symbol names
+#--------------------------------------------------------------------------
+
+class Symbols(object):
+
+    def __init__(self, syms):
+        # syms: ( addr, size, name ) of code symbols; size 0 if unknown
+        self.syms   = sorted(syms)
+        self.addrs  = [ s[0] for s in self.syms ]
+
+    def lookup(self, pc):
+        # Name of the symbol covering pc, or its address if there is none
+        i = bisect.bisect_right(self.addrs, pc) - 1
+        if i >= 0:
+            addr, size, name = self.syms[i]
+            if size == 0 or pc < addr + size:
+                return name
+        return "0x%08x" % pc
+
+
+#--------------------------------------------------------------------------
+#   Image: the pages of an executable file, ready to be mapped
+#--------------------------------------------------------------------------
+
+IMAGE_CACHE_SIZE    = 64            # images kept by Program.image_cache
+
+class Image(object):
+
+    # Read-only pages with file data are copied into a frame when the image
+    # is built, and only the frame is kept; that frame is shared by every
+    # address space the image is mapped into. Writable pages keep their
+    # data, and get one private copy per map().
+
+    def __init__(self, entry, pages):
+        self.entry  = entry
+        self.frames = { }           # vpn -> PTE holding a read-only page
+        self.pages  = [ ]           # [ ( vpn, prot, data ) ]; data is None for demand-zero
+                                    # pages and pages in self.frames
+        for vpn, prot, data in pages:
+            if data is not None and prot == M_READ_ONLY:
+                self.frames[vpn] = self.frame(vpn, data)
+                data = None
+            self.pages.append(( vpn, prot, data ))
+
+    def map(self, vm):
+        # vm must provide map() and map_shared() as PageTable does
+        for vpn, prot, data in self.pages:
+            if vpn in self.frames:
+                vm.map_shared(self.frames[vpn])
+                continue
+            pte = vm.translate(vpn)
+            if pte is None:
+                pte = vm.map(vpn, prot, demand_zero = data is None)
+            else:
+                pte.perms = prot
+                if data is None and pte.frame is not None:
+                    data = ZERO_PAGE    # a mapped page left over from the old image
+            if data is not None:
+                pte.physical_page = data
+
+    @staticmethod
+    def frame(vpn, data):
+        # The PTE owns a reference to the frame until the image is dropped;
+        # the frame is reused once no address space maps it either.
+        pte = PageTableEntry(vpn, M_READ_ONLY)
+        pte.physical_page = data
+        return pte
+
+
+class ImageCache(object):
+
+    # Parsed images by SHA-256 of the file contents, least recently used
+    # first
+
+    def __init__(self, size = IMAGE_CACHE_SIZE):
+        self.size       = size
+        self.images     = collections.OrderedDict()
+        self.hits       = 0
+        self.misses     = 0
+
+    def lookup(self, key):
+        # returns None if not found
+        image = self.images.get(key)
+        if image is None:
+            self.misses += 1
+            return None
+        self.images.move_to_end(key)
+        self.hits += 1
+        return image
+
+    def add(self, key, image):
+        self.images[key] = image
+        if len(self.images) > self.size:
+            self.images.popitem(last = False)
+
+    def flush(self):
+        self.images.clear()
+
+
 #--------------------------------------------------------------------------
 #   Program: loads an ELF file into memory and supports disassembling
 #--------------------------------------------------------------------------
@@ -47,6 +155,8 @@ ELF_ERR_CLASS       = 2
 ELF_ERR_DATA        = 3
 ELF_ERR_TYPE        = 4
 ELF_ERR_MACH        = 5
+ELF_ERR_FORMAT      = 6
+ELF_ERR_RANGE       = 7
 
 ELF_ERR_MSG = {
     ELF_ERR_OPEN    : 'File %s not found',
@@ -54,12 +164,14 @@ ELF_ERR_MSG = {
     ELF_ERR_DATA    : 'File %s is not a little-endian ELF file',
     ELF_ERR_TYPE    : 'File %s is not an executable file',
     ELF_ERR_MACH    : 'File %s is not an RISC-V executable file',
+    ELF_ERR_FORMAT  : 'File %s is not an ELF file',
+    ELF_ERR_RANGE   : 'File %s has a segment outside the address space',
 }
 
 class Program(object):
 
     def __init__(self):
-        Program.asmcache = AsmCache()
+        self.asmcache = AsmCache()
 
     def check_elf(self, filename, header):
         e_ident = header['e_ident']
@@ -82,46 +194,120 @@ class Program(object):
             return ELF_ERR_MACH
         return ELF_OK
 
+    # Shared by all Programs; assign an ImageCache(0) to disable caching
+    image_cache = ImageCache()
+
     def load(self, cpu, filename):
+        # Maps an ELF file into cpu.mmu.page_table (see load_image()) and
+        # flushes the TLBs of cpu. Returns the entry point, or 0 on errors.
         print("Loading file %s" % filename)
         try:
             f = open(filename, 'rb')
         except IOError:
             print(ELF_ERR_MSG[ELF_ERR_OPEN] % filename)
-            return WORD(0)
+            return 0
 
         with f:
-            ef = elf.ELFFile(f)
-            efh = ef.header
-            ret = self.check_elf(filename, efh)
+            entry_point, ret = self.load_image(cpu.mmu.page_table, f)
+        if ret != ELF_OK:
+            print(ELF_ERR_MSG[ret] % filename)
+            return 0
+        cpu.mmu.tlb_flush()
+        return entry_point
+
+    def load_image(self, vm, f):
+        # Maps the PT_LOAD segments of an ELF file object into vm, which must
+        # provide map() and map_shared() as PageTable does. Pages of
+        # writable segments are mapped M_READ_WRITE, the others M_READ_ONLY
+        # on frames shared by every vm the image is mapped into; pages with
+        # no file data (.bss) are mapped demand-zero. Parsed images are
+        # cached by contents in Program.image_cache. Shared pages replace
+        # the PTEs already mapped at their vpn, so the caller must flush the
+        # TLBs of the CPUs running on vm.
+        # Returns ( entry_point, ELF_OK or ELF_ERR_* )
+        # Files are memory-mapped, so hashing and parsing read the page
+        # cache directly; other file objects are read into memory.
+        try:
+            data = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+        except (AttributeError, io.UnsupportedOperation, ValueError, OSError):
+            data = f.read()
+        try:
+            key     = hashlib.sha256(data).digest()
+            image   = self.image_cache.lookup(key)
+            if image is None:
+                image, ret = self.parse_image(data)
+                if ret != ELF_OK:
+                    return ( 0, ret )
+                self.image_cache.add(key, image)
+        finally:
+            if isinstance(data, mmap.mmap):
+                data.close()
+        image.map(vm)
+        return ( image.entry, ELF_OK )
+
+    def parse_image(self, data):
+        # Returns ( Image or None, ELF_OK or ELF_ERR_* ) for the contents of
+        # an ELF file (bytes or an mmap). The part of a segment beyond its
+        # file size is zero.
+        try:
+            ef = elf.ELFFile(data if isinstance(data, mmap.mmap) else io.BytesIO(data))
+            ret = self.check_elf(None, ef.header)
             if ret != ELF_OK:
-                print(ELF_ERR_MSG[ret] % filename)
-                return WORD(0)
-
-            entry_point = WORD(efh['e_entry'])
+                return ( None, ret )
 
+            pages = { }             # vpn -> [ prot, bytearray or None ]
             for seg in ef.iter_segments():
-                addr = seg.header['p_vaddr']
-                memsz = seg.header['p_memsz']
                 if seg.header['p_type'] != 'PT_LOAD':
                     continue
-                if addr >= cpu.imem.mem_start and addr + memsz < cpu.imem.mem_end:
-                    mem = cpu.imem
-                elif addr >= cpu.dmem.mem_start and addr + memsz < cpu.dmem.mem_end:
-                    mem = cpu.dmem
-                else:
-                    print("Invalid address range: 0x%08x - 0x%08x" \
-                        % (addr, addr + memsz - 1))
-                    continue
-                image = seg.data()
-                for i in range(0, len(image), WORD_SIZE):
-                    c = int.from_bytes(image[i:i+WORD_SIZE], byteorder='little')
-                    mem.access(True, addr, c, M_XWR)
-                    addr += WORD_SIZE
-            return entry_point
+                addr    = seg.header['p_vaddr']
+                memsz   = seg.header['p_memsz']
+                if addr + memsz > 1 << 32:
+                    return ( None, ELF_ERR_RANGE )
+                prot    = M_READ_WRITE if seg.header['p_flags'] & P_FLAGS.PF_W else M_READ_ONLY
+                image   = seg.data()
+                for va in range(addr & VPN_MASK, addr + memsz, PAGE_SIZE):
+                    vpn     = va >> VPO_LENTGH
+                    lo      = max(addr, va)
+                    hi      = min(addr + len(image), va + PAGE_SIZE)
+                    page    = pages.get(vpn)
+                    if page is None:
+                        page = pages[vpn] = [ prot, None ]
+                    elif prot == M_READ_WRITE:
+                        page[0] = M_READ_WRITE
+                    if lo < hi:
+                        if page[1] is None:
+                            page[1] = bytearray(PAGE_SIZE)
+                        page[1][lo - va:hi - va] = image[lo - addr:hi - addr]
+        except ELFError:
+            return ( None, ELF_ERR_FORMAT )
+
+        pages = [ ( vpn, prot, bytes(page) if page is not None else None )
+                  for vpn, ( prot, page ) in sorted(pages.items()) ]
+        return ( Image(ef.header['e_entry'], pages), ELF_OK )
+
+    def load_symbols(self, f):
+        # Returns the Symbols of the functions and labels in the executable
+        # sections of an ELF file object, from .symtab (empty if stripped)
+        try:
+            ef = elf.ELFFile(f)
+        except ELFError:
+            return Symbols([ ])
+        symtab = ef.get_section_by_name('.symtab')
+        if symtab is None:
+            return Symbols([ ])
+        code = set(i for i, sec in enumerate(ef.iter_sections())
+                   if sec['sh_flags'] & SH_FLAGS.SHF_EXECINSTR)
+        syms = [ ]
+        for sym in symtab.iter_symbols():
+            if sym['st_info']['type'] not in [ 'STT_FUNC', 'STT_NOTYPE' ] or \
+               sym['st_shndx'] not in code or not sym.name or sym.name.startswith('$'):
+                continue
+            syms.append(( sym['st_value'], sym['st_size'], sym.name ))
+        return Symbols(syms)
 
     @staticmethod
-    def disasm(pc, inst):
+    def disasm(pc, inst, asmcache = None):
+        # asmcache: caches the result by pc (e.g., cpu.asmcache)
 
         if inst == BUBBLE:
             asm = "BUBBLE"
@@ -130,14 +316,16 @@ class Program(object):
             asm = "nop"
             return asm
 
-        asm = Program.asmcache.lookup(pc)
+        asm = asmcache.lookup(pc) if asmcache else None
         if asm is not None:
             return asm
 
+        inst = int(inst)
         opcode = RISCV.opcode(inst)
         if opcode == ILLEGAL:
             asm = "(illegal)"
-            Program.asmcache.add(pc, asm)
+            if asmcache:
+                asmcache.add(pc, asm)
             return asm
 
         info = isa[opcode]
@@ -153,27 +341,28 @@ class Program(object):
         if info[IN_TYPE] == R_TYPE:
             asm = "%-7s%s, %s, %s" % (opname, rname[rd], rname[rs1], rname[rs2])
         elif info[IN_TYPE] == I_TYPE:
-            asm = "%-7s%s, %s, %d" % (opname, rname[rd], rname[rs1], SWORD(imm_i))
+            asm = "%-7s%s, %s, %d" % (opname, rname[rd], rname[rs1], sword(imm_i))
         elif info[IN_TYPE] == IL_TYPE:
-            asm = "%-7s%s, %d(%s)" % (opname, rname[rd], SWORD(imm_i), rname[rs1])
+            asm = "%-7s%s, %d(%s)" % (opname, rname[rd], sword(imm_i), rname[rs1])
         elif info[IN_TYPE] == IJ_TYPE:
-            asm = "%-7s%s, %s, %d" % (opname, rname[rd], rname[rs1], SWORD(imm_i))
+            asm = "%-7s%s, %s, %d" % (opname, rname[rd], rname[rs1], sword(imm_i))
         elif info[IN_TYPE] == IS_TYPE:
-            asm = "%-7s%s, %s, %d" % (opname, rname[rd], rname[rs1], SWORD(imm_i & 0x1f))
+            asm = "%-7s%s, %s, %d" % (opname, rname[rd], rname[rs1], imm_i & 0x1f)
         elif info[IN_TYPE] == U_TYPE:
             asm = "%-7s%s, 0x%05x" % (opname, rname[rd], imm_u)
         elif info[IN_TYPE] == S_TYPE:
-            asm = "%-7s%s, %d(%s)" % (opname, rname[rs2], SWORD(imm_s), rname[rs1])
+            asm = "%-7s%s, %d(%s)" % (opname, rname[rs2], sword(imm_s), rname[rs1])
         elif info[IN_TYPE] == B_TYPE:
-            asm = "%-7s%s, %s, 0x%08x" % (opname, rname[rs1], rname[rs2], pc + SWORD(imm_b))
+            asm = "%-7s%s, %s, 0x%08x" % (opname, rname[rs1], rname[rs2], pc + sword(imm_b))
         elif info[IN_TYPE] == J_TYPE:
-            asm = "%-7s%s, 0x%08x" % (opname, rname[rd], pc + SWORD(imm_j))
+            asm = "%-7s%s, 0x%08x" % (opname, rname[rd], pc + sword(imm_j))
         elif info[IN_TYPE] == X_TYPE:
             return info[IN_NAME]
         else:
             asm = "(unknown)"
 
-        Program.asmcache.add(pc, asm)
+        if asmcache:
+            asmcache.add(pc, asm)
         return asm
 
 
@@ -185,9 +374,14 @@ class Log(object):
 
     MAX_LOG_LEVEL   = 6
 
+    # Defaults for new CPUs (set from the command line)
     level           = 0
     start_cycle     = 0
 
+    def __init__(self, level = None, start_cycle = None):
+        self.level          = Log.level         if level is None        else level
+        self.start_cycle    = Log.start_cycle   if start_cycle is None  else start_cycle
+
 
 #--------------------------------------------------------------------------
 #   Stat: supports run-time stat collecting and printing
@@ -195,16 +389,32 @@ class Log(object):
 
 class Stat(object):
 
-    cycle           = 0         # number of CPU cycles
-    icount          = 0         # number of instructions executed
+    # Default for new CPUs: counting instructions by class needs the
+    # instrumented execution loops (cycle and icount are always kept)
+    enabled         = False
 
-    inst_alu        = 0         # number of ALU instructions
-    inst_mem        = 0         # number of load/store instructions
-    inst_ctrl       = 0         # number of control transfer instructions
+    def __init__(self, enabled = None):
+        self.enabled        = Stat.enabled      if enabled is None      else enabled
 
-    @staticmethod
-    def show():
-        print("%d instructions executed in %d cycles. CPI = %.3f" % (Stat.icount, Stat.cycle, Stat.cycle / Stat.icount))
-        print("Data transfer:    %d instructions (%.2f%%)" % (Stat.inst_mem, Stat.inst_mem * 100.0 / Stat.icount))
-        print("ALU operation:    %d instructions (%.2f%%)" % (Stat.inst_alu, Stat.inst_alu * 100.0 / Stat.icount))
-        print("Control transfer: %d instructions (%.2f%%)" % (Stat.inst_ctrl, Stat.inst_ctrl * 100.0 / Stat.icount))
+        self.cycle          = 0         # number of CPU cycles
+        self.icount         = 0         # number of instructions executed
+
+        self.inst_alu       = 0         # number of ALU instructions
+        self.inst_mem       = 0         # number of load/store instructions
+        self.inst_ctrl      = 0         # number of control transfer instructions
+
+    def count(self, cl):
+        if cl == CL_ALU:
+            self.inst_alu   += 1
+        elif cl == CL_MEM:
+            self.inst_mem   += 1
+        else:
+            self.inst_ctrl  += 1
+
+    def show(self):
+        print("%d instructions executed in %d cycles. CPI = %.3f" % (self.icount, self.cycle, self.cycle / self.icount))
+        if not self.enabled:
+            return
+        print("Data transfer:    %d instructions (%.2f%%)" % (self.inst_mem, self.inst_mem * 100.0 / self.icount))
+        print("ALU operation:    %d instructions (%.2f%%)" % (self.inst_alu, self.inst_alu * 100.0 / self.icount))
+        print("Control transfer: %d instructions (%.2f%%)" % (self.inst_ctrl, self.inst_ctrl * 100.0 / self.icount))
@@ -36,250 +36,453 @@ class MemEvent(Event):
         self.fault_addr = fault_addr
         self.fault_pc = fault_pc
 
+class IrqEvent(Event):
+    def __init__(self, exception_type: int, source):
+        super().__init__(exception_type)
+        self.source = source
+
+class TrapRecord(object):
+
+    # The trap raised by the last instruction, preallocated per CPU
+    # (cpu.trap). Handlers fill it in with set() and return it; normal
+    # completion returns None, so nothing is allocated per instruction.
+    # event() makes the Event handed to the kernel when a run stops.
+
+    __slots__ = ( 'type', 'fault_addr', 'fault_pc' )
+
+    def __init__(self):
+        self.type       = EXC_NONE
+        self.fault_addr = None          # None unless a memory access faulted
+        self.fault_pc   = None
+
+    def set(self, exception_type, fault_addr = None, fault_pc = None):
+        self.type       = exception_type
+        self.fault_addr = fault_addr
+        self.fault_pc   = fault_pc
+        return self
+
+    def event(self) -> Event:
+        if self.fault_addr is None:
+            return Event(self.type)
+        return MemEvent(self.type, self.fault_addr, self.fault_pc)
+
+class RunResult(object):
+
+    # Returned by resume(): the event that stopped the CPU (None if the
+    # instruction budget ran out) and the number of instructions retired
+
+    __slots__ = ( 'event', 'retired' )
+
+    def __init__(self, event, retired):
+        self.event      = event
+        self.retired    = retired
+
 class Sim(object):
 
-    @staticmethod
+    # One engine per CPU: all execution state, stats and logs belong to cpu
+    def __init__(self, cpu):
+        self.cpu    = cpu
+        self.stat   = cpu.stat
+        self.trap   = cpu.trap
+
+    def traced(self):
+        # Per-instruction logs, a binary trace (cpu.trace, see trace.py) or
+        # execution counts (cpu.hist, see histogram.py)
+        return self.cpu.log.level >= 3 or self.cpu.trace is not None or \
+               self.cpu.hist is not None
+
+    def instrumented(self):
+        # Stats by instruction class, logs and traces are only kept by the
+        # instrumented loops; the choice is made once per run() or resume()
+        return self.stat.enabled or self.traced()
+
     # ta procedura będzie przyjmować ca
-    def run(cpu, entry_point) -> Event:
+    def run(self, entry_point) -> Event:
+
+        self.cpu.pc.write(entry_point)
+        return self.run_slice(Timer.NEVER)
+
+    def run_slice(self, budget) -> Event:
+        # Same as run() from the current pc, but returns None after budget
+        # instructions if nothing else stopped the CPU first.
+
+        # Interrupts posted by devices are taken first, one per call
+        cpu = self.cpu
+        if cpu.irqs:
+            return IrqEvent(EXC_INTERRUPT, cpu.irqs.popleft())
+
+        # Runs straight to the deadline of the timer: the loops only count
+        # their budget down, with no clock check per instruction. An event
+        # raised by the last instruction before the deadline is returned
+        # first; the interrupt is then delivered by the next run().
+        timer = cpu.timer
+        if not timer.pending():
+            r = self.resume(min(budget, timer.remaining()))
+            if r.event is not None:
+                return self.finish(r.event)
+            if not timer.pending():
+                return None
+        timer.deliver()
+        return Event(EXC_CLOCK)
+
+    def resume(self, budget) -> RunResult:
+        # Runs up to budget instructions from the current pc. No timer
+        # interrupt or end-of-run messages; the instruction that raises an
+        # event is counted as retired, as in stat.icount and timer.mtime.
+
+        if self.instrumented():
+            return self.resume_instrumented(budget)
+
+        cpu     = self.cpu
+        pc_reg  = cpu.pc
+        fetch   = cpu.mmu.fetch
+        decode  = Sim.decode
+        event   = None
+        n       = 0
+
+        while n < budget:
+            pc = pc_reg.read()
+            d, mem_status = fetch(pc, decode)
+            n += 1
+            if mem_status != EXC_NONE:
+                event = self.trap.set(mem_status, pc, pc).event()
+                break
+            status = d[0](self, pc, d)
+            if status is not None:
+                event = status.event()
+                break
 
-        Sim.cpu = cpu # ta linijka potrzebna?
-        Sim.cpu.pc.write(entry_point)
-        ## jakoś uruchom cpu clock tutaj?
+        self.stat.cycle     += n
+        self.stat.icount    += n
+        self.cpu.timer.mtime += n
+        return RunResult(event, n)
 
-        while True:
-            # Execute a single instruction
-            status = Sim.single_step()
+    def resume_instrumented(self, budget) -> RunResult:
+        # Counts each instruction as it retires, so that logs show (and
+        # start at) its own cycle
 
-            Sim.cpu.clock.cycles += 1
-            if (Sim.cpu.clock.cycles > Sim.cpu.clock.period):
-                Sim.cpu.clock.cycles = 0
-                ## Tutaj pewnie chcemy zwrócić coś
-                ## status = ??
-                return Event(EXC_CLOCK)
+        event   = None
+        n       = 0
 
-            # Update stats
-            Stat.cycle      += 1
-            Stat.icount     += 1
+        while n < budget:
+            n += 1
+            status = self.single_step()
+            self.stat.cycle     += 1
+            self.stat.icount    += 1
 
             # Show logs after executing a single instruction
-            if Log.level >= 5:
-                Sim.cpu.regs.dump()
-            if Log.level >= 6:
-                Sim.cpu.dmem.dump(skipzero = True)
+            if self.cpu.log.level >= 5:
+                self.cpu.regs.dump()
+            if self.cpu.log.level >= 6:
+                self.dump_memory()
 
-            if status.type != EXC_NONE:
+            if status is not None:
+                event = status.event()
                 break
 
+        self.cpu.timer.mtime += n
+        return RunResult(event, n)
+
+    def finish(self, status) -> Event:
+
         ## Może poniższe dwie sekcje należy zamienić miejscami?
         ## Wtedy na końcu możemy robić 'Handle exceptions' i zwracać różne wartości
 
         # Handle exceptions, if any
         # if (status.type & EXC_PAGE_FAULT):
-        #     print("Exception '%s' occurred at 0x%08x" % (EXC_MSG[status.type], Sim.cpu.pc.read()))
+        #     print("Exception '%s' occurred at 0x%08x" % (EXC_MSG[status.type], self.cpu.pc.read()))
         if (status.type & EXC_EBREAK):
             print("Execution completed")
         elif (status.type & EXC_ILLEGAL_INST):
-            print("Exception '%s' occurred at 0x%08x -- Program terminated" % (EXC_MSG[EXC_ILLEGAL_INST], Sim.cpu.pc.read()))
+            print("Exception '%s' occurred at 0x%08x -- Program terminated" % (EXC_MSG[EXC_ILLEGAL_INST], self.cpu.pc.read()))
 
         # Show logs after finishing the program execution
-        if Log.level > 0:
-            if Log.level < 5:
-                Sim.cpu.regs.dump()
-                print("pc =", hex(Sim.cpu.pc.read()))
-            if Log.level > 1 and Log.level < 6:
-                Sim.cpu.dmem.dump(skipzero = True)
+        if self.cpu.log.level > 0:
+            if self.cpu.log.level < 5:
+                self.cpu.regs.dump()
+                print("pc =", hex(self.cpu.pc.read()))
+            if self.cpu.log.level > 1 and self.cpu.log.level < 6:
+                self.dump_memory()
 
         return status
 
-    @staticmethod
-    def log(pc, inst, rd, wbdata, pc_next):
+    def dump_memory(self):
+        # Dumps the mapped pages if the page table can list them (as
+        # PageTable.dump() does); a kernel's page table may not
+        dump = getattr(self.cpu.mmu.page_table, 'dump', None)
+        if dump is not None:
+            dump(skipzero = True)
+
+    def log(self, pc, inst, rd, wbdata, pc_next):
 
-        if Stat.cycle < Log.start_cycle:
+        if self.stat.cycle < self.cpu.log.start_cycle:
             return
-        if Log.level >= 4:
+        if self.cpu.log.level >= 4:
             info = "# R[%2d] <- 0x%08x, pc_next=0x%08x" % (rd, wbdata, pc_next) if rd else \
                    "# " + 21*" " + "pc_next=0x%08x" % pc_next
         else:
             info = ''
-        if Log.level >= 3:
-            print("%3d 0x%08x: %-30s%-s" % (Stat.cycle, pc, Program.disasm(pc, inst), info))
+        if self.cpu.log.level >= 3:
+            print("%3d 0x%08x: %-30s%-s" % (self.stat.cycle, pc, Program.disasm(pc, inst, self.cpu.asmcache), info))
         else:
             return
 
-    def run_alu(pc, inst, opcode, cs) -> Event:
-        np.seterr(all='ignore')
-
-        Stat.inst_alu += 1
-
-        rs1         = RISCV.rs1(inst)
-        rs2         = RISCV.rs2(inst)
-        rd          = RISCV.rd(inst)
-
-        imm_i       = RISCV.imm_i(inst)
-        imm_u       = RISCV.imm_u(inst)
-
-        rs1_data    = Sim.cpu.regs.read(rs1)
-        rs2_data    = Sim.cpu.regs.read(rs2)
-
-        alu1        = rs1_data      if cs[IN_ALU1] == OP1_RS1    else \
-                      pc            if cs[IN_ALU1] == OP1_PC     else \
-                      WORD(0)
-
-        alu2        = rs2_data      if cs[IN_ALU2] == OP2_RS2    else \
-                      imm_i         if cs[IN_ALU2] == OP2_IMI    else \
-                      imm_u         if cs[IN_ALU2] == OP2_IMU    else \
-                      WORD(0)
-
-
-        alu_out     = WORD(alu1 + alu2)                     if (cs[IN_OP] == ALU_ADD)           else \
-                      WORD(alu1 - alu2)                     if (cs[IN_OP] == ALU_SUB)           else \
-                      WORD(alu1 & alu2)                     if (cs[IN_OP] == ALU_AND)           else \
-                      WORD(alu1 | alu2)                     if (cs[IN_OP] == ALU_OR)            else \
-                      WORD(alu1 ^ alu2)                     if (cs[IN_OP] == ALU_XOR)           else \
-                      WORD(1)                               if (cs[IN_OP] == ALU_SLT and             \
-                                                                (SWORD(alu1) < SWORD(alu2)))    else \
-                      WORD(1)                               if (cs[IN_OP] == ALU_SLTU and            \
-                                                                (alu1 < alu2))                  else \
-                      WORD(alu1 << (alu2 & 0x1f))           if (cs[IN_OP] == ALU_SLL)           else \
-                      WORD(SWORD(alu1) >> (alu2 & 0x1f))    if (cs[IN_OP] == ALU_SRA)           else \
-                      WORD(alu1 >> (alu2 & 0x1f))           if (cs[IN_OP] == ALU_SRL)           else \
-                      WORD(0)
-
-        pc_next     = pc + 4
-
-        Sim.cpu.regs.write(rd, alu_out)
-        Sim.cpu.pc.write(pc_next)
-        Sim.log(pc, inst, rd, alu_out, pc_next)
-        return Event(EXC_NONE)
-
-    def run_mem(pc, inst, opcode, cs) -> Event:
-
-        Stat.inst_mem += 1
-
-        rs1         = RISCV.rs1(inst)
-        rs1_data    = Sim.cpu.regs.read(rs1)
-
-        if (cs[IN_OP] == MEM_LD):
-            rd          = RISCV.rd(inst)
-            imm_i       = RISCV.imm_i(inst)
-            mem_addr    = rs1_data + SWORD(imm_i)
-            funct3      = (inst & FUNCT3_MASK) >> FUNCT3_SHIFT
-            remainder   = mem_addr % WORD_SIZE
-            if (remainder != 0 and funct3 != 2):
-                mem_addr -= remainder
-
-            # mem_data, dmem_ok = Sim.cpu.dmem.access(True, mem_addr, 0, M_XRD)
-            mem_data, mem_status = Sim.cpu.mmu.mem_access(True, mem_addr, 0, M_XRD)
-            if mem_status == EXC_NONE:
-                if (funct3 == 0):                           # LB
-                    mem_data = (mem_data >> (remainder * 8)) & 0xFF
-                    sign = mem_data >> 7
-                    mem_data += ((0 - sign) << 8)
-                elif (funct3 == 4):                         # LBU
-                    mem_data = (mem_data >> (remainder * 8)) & 0xFF
-                elif (funct3 == 1):                         # LH
-                    mem_data = (mem_data >> (remainder * 8)) & 0xFFFF
-                    sign = mem_data >> 15
-                    mem_data += ((0 - sign) << 8)
-                elif (funct3 == 5):                         # LHU
-                    mem_data = (mem_data >> (remainder * 8)) & 0xFFFF
-                elif (funct3 != 2):
-                    return Event(EXC_ILLEGAL_INST)
-                Sim.cpu.regs.write(rd, mem_data)
-            if mem_status != EXC_NONE:
-                return MemEvent(mem_status, mem_addr, pc)
-        else:
-            rd          = 0
-            rs2         = RISCV.rs2(inst)
-            rs2_data    = Sim.cpu.regs.read(rs2)
-
-            imm_s       = RISCV.imm_s(inst)
-            mem_addr    = rs1_data + SWORD(imm_s)
-            # mem_data, dmem_ok = Sim.cpu.dmem.access(True, mem_addr, rs2_data, M_XWR)
-
-
-            funct3      = (inst & FUNCT3_MASK) >> FUNCT3_SHIFT
-            remainder   = mem_addr % WORD_SIZE
-            if (remainder != 0 and funct3 != 2):
-                mem_addr -= remainder
-            if (funct3 == 0):                               # SB
-                rs2_data = rs2_data & 0xFF
-            # elif (funct3 == 1):                           # SH
-            #     rs2_data = rs2_data & 0xFFFF
-            rs2_data = rs2_data << (remainder * 8)
-            save_data, mem_status = Sim.cpu.mmu.mem_access(True, mem_addr, 0, M_XRD)
-            mem_data = WORD(0)
-            if mem_status == EXC_NONE:
-                save_data = save_data & ((1 << (remainder * 8)) - 1)
-                rs2_data += save_data
-                mem_data, mem_status = Sim.cpu.mmu.mem_access(True, mem_addr, rs2_data, M_XWR)
-            if mem_status != EXC_NONE:
-                return MemEvent(mem_status, mem_addr, pc)
+    # ALU operations on 32-bit unsigned operands; a and b are expressions.
+    # Shared with the block translator (translate.py).
+    alu = {
+        ALU_ADD     : "(%(a)s + %(b)s) & 0xffffffff",
+        ALU_SUB     : "(%(a)s - %(b)s) & 0xffffffff",
+        ALU_AND     : "%(a)s & %(b)s",
+        ALU_OR      : "%(a)s | %(b)s",
+        ALU_XOR     : "%(a)s ^ %(b)s",
+        ALU_SLT     : "(1 if (%(a)s ^ 0x80000000) < (%(b)s ^ 0x80000000) else 0)",
+        ALU_SLTU    : "(1 if %(a)s < %(b)s else 0)",
+        ALU_SLL     : "(%(a)s << (%(b)s & 0x1f)) & 0xffffffff",
+        ALU_SRL     : "%(a)s >> (%(b)s & 0x1f)",
+        ALU_SRA     : "(((%(a)s ^ 0x80000000) - 0x80000000) >> (%(b)s & 0x1f)) & 0xffffffff",
+    }
+
+    # Branch conditions; a and b are expressions
+    cond = {
+        BEQ         : "%(a)s == %(b)s",
+        BNE         : "%(a)s != %(b)s",
+        BLT         : "(%(a)s ^ 0x80000000) < (%(b)s ^ 0x80000000)",
+        BGE         : "(%(a)s ^ 0x80000000) >= (%(b)s ^ 0x80000000)",
+        BLTU        : "%(a)s < %(b)s",
+        BGEU        : "%(a)s >= %(b)s",
+    }
+
+    # Handlers of the ALU instructions and conditional branches, one per
+    # opcode, are generated from alu and cond by make_handlers() below.
+    # The others are written out.
+
+    def run_load(self, pc, d) -> Event:
+
+        _, inst, opcode, cs, rs1, rs2, rd, imm = d
+        size, signed = MT_ACCESS[cs[IN_MT]]
+        mem_addr    = (self.cpu.regs.reg[rs1] + imm) & MASK32
+        mem_data, mem_status = self.cpu.mmu.mem_load(mem_addr, size, signed)
+        if mem_status != EXC_NONE:
+            return self.trap.set(mem_status, self.cpu.mmu.fault_addr, pc)
+        self.cpu.regs.write(rd, mem_data)
+        self.cpu.pc.write((pc + 4) & MASK32)
+        return None
 
-        pc_next         = pc + 4
-        Sim.cpu.pc.write(pc_next)
-        Sim.log(pc, inst, rd, mem_data, pc_next)
-        return Event(EXC_NONE)
+    def run_store(self, pc, d) -> Event:
 
-    def run_ctrl(pc, inst, opcode, cs) -> Event:
+        _, inst, opcode, cs, rs1, rs2, rd, imm = d
+        R           = self.cpu.regs.reg
+        mem_addr    = (R[rs1] + imm) & MASK32
+        mem_data, mem_status = self.cpu.mmu.mem_store(mem_addr, R[rs2], MT_ACCESS[cs[IN_MT]][0])
+        if mem_status != EXC_NONE:
+            return self.trap.set(mem_status, self.cpu.mmu.fault_addr, pc)
+        self.cpu.pc.write((pc + 4) & MASK32)
+        return None
+
+    def run_jal(self, pc, d) -> Event:
+
+        self.cpu.regs.write(d[6], (pc + 4) & MASK32)
+        self.cpu.pc.write((pc + d[7]) & MASK32)
+        return None
+
+    def run_jalr(self, pc, d) -> Event:
+
+        # The target is computed before rd is written, as rd may be rs1
+        pc_next     = (self.cpu.regs.reg[d[4]] + d[7]) & 0xfffffffe
+        self.cpu.regs.write(d[6], (pc + 4) & MASK32)
+        self.cpu.pc.write(pc_next)
+        return None
+
+    def run_ecall(self, pc, d) -> Event:
+        self.cpu.pc.write((pc + 4) & MASK32)
+        if self.syscall():
+            return None
+        return self.trap.set(EXC_ECALL)
+
+    def syscall(self):
+        # Runs the handler registered for the syscall number in a7, if any
+        # (see SNURISC.register_syscall()). Returns True if it handled the
+        # ecall, which then completes without leaving the engine.
+        cpu     = self.cpu
+        handler = cpu.syscalls.get(cpu.regs.reg[17])
+        return handler is not None and bool(handler(cpu))
+
+    def run_ebreak(self, pc, d) -> Event:
+        return self.trap.set(EXC_EBREAK)
+
+    def run_illegal(self, pc, d) -> Event:
+        return self.trap.set(EXC_ILLEGAL_INST)
+
+
+    # Immediate used by each ALU operand select 2
+    imm = {
+        OP2_IMI : RISCV.imm_i,
+        OP2_IMS : RISCV.imm_s,
+        OP2_IMU : RISCV.imm_u,
+        OP2_IMJ : RISCV.imm_j,
+        OP2_IMB : RISCV.imm_b,
+    }
+
+    # Handler per opcode, filled by make_handlers()
+    dispatch = { }
+
+    # Outcome of each conditional branch, taken(R, d), filled by
+    # make_handlers(); branches do not write registers, so it can be
+    # evaluated after the branch
+    taken = { }
 
-        Stat.inst_ctrl += 1
+    @staticmethod
+    def decode(inst):
+        # Predecoded instruction (all fields ints, except cs):
+        #   ( handler, inst, opcode, cs, rs1, rs2, rd, imm )
+        inst    = int(inst)
+        opcode  = RISCV.opcode(inst)
+        if opcode == ILLEGAL:
+            return ( Sim.run_illegal, inst, opcode, None, 0, 0, 0, 0 )
 
-        if inst in [ EBREAK, ECALL ]:
-            Sim.log(pc, inst, 0, 0, 0)
-            if (inst == EBREAK):
-                return Event(EXC_EBREAK)
-            else:
-                pc_next     = pc + 4
-                Sim.cpu.pc.write(pc_next)
-                return Event(EXC_ECALL)
-
-        rs1             = RISCV.rs1(inst)
-        rs2             = RISCV.rs2(inst)
-        rd              = RISCV.rd(inst)
-        rs1_data        = Sim.cpu.regs.read(rs1)
-        rs2_data        = Sim.cpu.regs.read(rs2)
-
-        imm_i           = RISCV.imm_i(inst)
-        imm_j           = RISCV.imm_j(inst)
-        imm_b           = RISCV.imm_b(inst)
-        pc_plus4        = pc + 4
-
-        pc_next         = pc + imm_j        if opcode == JAL    else                                             \
-                          pc + imm_b        if (opcode == BEQ and rs1_data == rs2_data) or                       \
-                                                (opcode == BNE and not (rs1_data == rs2_data)) or                \
-                                                (opcode == BLT and SWORD(rs1_data) < SWORD(rs2_data)) or         \
-                                                (opcode == BGE and not (SWORD(rs1_data) < SWORD(rs2_data))) or   \
-                                                (opcode == BLTU and WORD(rs1_data) < WORD(rs2_data)) or          \
-                                                (opcode == BGEU and not (WORD(rs1_data) < WORD(rs2_data)))  else \
-                          (rs1_data + imm_i) & WORD(0xfffffffe)     if opcode == JALR   else                     \
-                          pc_plus4
-        pc_next = WORD(pc_next)
-
-        if (opcode in [ JAL, JALR ]):
-            Sim.cpu.regs.write(rd, pc_plus4)
-        Sim.cpu.pc.write(pc_next)
-        Sim.log(pc, inst, rd, pc_plus4, pc_next)
-        return Event(EXC_NONE)
-
-
-    func = [ run_alu, run_mem, run_ctrl ]
+        cs      = isa[opcode]
+        imm     = Sim.imm[cs[IN_ALU2]](inst) if cs[IN_ALU2] in Sim.imm else 0
+        return ( Sim.dispatch[opcode], inst, opcode, cs,
+                 RISCV.rs1(inst), RISCV.rs2(inst), RISCV.rd(inst), imm )
 
-    @staticmethod
-    def single_step() -> Event:
+    def single_step(self) -> TrapRecord:
+        # Executes a single instruction with stats by class and logs, if
+        # enabled; the instruction count and the timer are left to the
+        # caller. Returns None, or self.trap if it raised an exception.
 
-        pc      = Sim.cpu.pc.read()
+        pc      = self.cpu.pc.read()
+        trace   = self.cpu.trace
 
-        # Instruction fetch
-        # inst, imem_status = Sim.cpu.imem.access(True, pc, 0, M_XRD)
-        inst, mem_status = Sim.cpu.mmu.mem_access(True, pc, 0, M_XRD)
+        # Instruction fetch and decode, served from the decode cache
+        d, mem_status = self.cpu.mmu.fetch(pc, Sim.decode)
         if mem_status != EXC_NONE:
-            return MemEvent(mem_status, pc, pc)
+            if trace is not None:
+                trace.write(pc, 0, 0, 0, TR_NONE, 0, 0, mem_status)
+            return self.trap.set(mem_status, pc, pc)
+
+        # Source operands, before rd overwrites them
+        if trace is not None:
+            rs1_data    = self.cpu.regs.read(d[4])
+            rs2_data    = self.cpu.regs.read(d[5])
+
+        status  = d[0](self, pc, d)
+        exc     = EXC_NONE if status is None else status.type
+        cs      = d[3]
+        if trace is not None:
+            self.record(trace, pc, d, exc, rs1_data, rs2_data)
+        if cs is None:                  # illegal instruction
+            return status
+        if self.stat.enabled:
+            self.stat.count(cs[IN_CLASS])
+        if self.cpu.hist is not None:
+            taken = Sim.taken.get(d[2])
+            self.cpu.hist.add(pc, d[2], taken is not None and taken(self.cpu.regs.reg, d))
+        if self.cpu.log.level >= 3:
+            self.log_inst(pc, d, exc)
+        return status
 
-        # Instruction decode
-        opcode  = RISCV.opcode(inst)
-        if opcode == ILLEGAL:
-            return Event(EXC_ILLEGAL_INST)
+    def record(self, trace, pc, d, exc, rs1_data, rs2_data):
+        # Writes the trace record of an executed instruction that raised
+        # exception exc (EXC_NONE if none)
+
+        _, inst, opcode, cs, rs1, rs2, rd, imm = d
+        kind    = TR_NONE
+        addr    = 0
+        data    = 0
+        wbdata  = 0
+        if cs is None or exc != EXC_NONE and cs[IN_CLASS] != CL_MEM:
+            rd      = 0
+        elif cs[IN_CLASS] == CL_MEM:
+            # The data of a load to x0 is not kept
+            addr    = (rs1_data + imm) & MASK32
+            if cs[IN_OP] == MEM_LD:
+                kind    = TR_LOAD
+                data    = self.cpu.regs.read(rd) if exc == EXC_NONE else 0
+            else:
+                kind    = TR_STORE
+                data    = rs2_data & ((1 << (MT_ACCESS[cs[IN_MT]][0] * 8)) - 1)
+            if kind == TR_STORE or exc != EXC_NONE:
+                rd      = 0
+            wbdata  = data if rd else 0
+        elif cs[IN_CLASS] == CL_CTRL:
+            if opcode in [ JAL, JALR ]:
+                wbdata  = (pc + 4) & MASK32
+            else:
+                rd      = 0
+        else:
+            wbdata  = self.cpu.regs.read(rd)
+        trace.write(pc, inst, rd, wbdata, kind, addr, data, exc)
+
+    def log_inst(self, pc, d, exc):
+        # Logs an executed instruction, except one that faulted
+
+        _, inst, opcode, cs, rs1, rs2, rd, imm = d
+        if exc in [ EXC_EBREAK, EXC_ECALL ]:
+            self.log(pc, inst, 0, 0, 0)
+        elif exc == EXC_NONE:
+            if cs[IN_CLASS] == CL_MEM and cs[IN_OP] == MEM_ST:
+                rd  = 0
+            wbdata  = (pc + 4) & MASK32 if cs[IN_CLASS] == CL_CTRL else self.cpu.regs.read(rd)
+            self.log(pc, inst, rd, wbdata, self.cpu.pc.read())
 
-        cs = isa[opcode]
-        return Sim.func[cs[IN_CLASS]](pc, inst, opcode, cs)
+
+#--------------------------------------------------------------------------
+#   Per-opcode handlers
+#
+#   The handler of an instruction is looked up in Sim.dispatch when it is
+#   decoded and kept in its predecoded record, so executing it is a single
+#   call. ALU and branch handlers are specialised per opcode: the operation
+#   and the operand selects (rs1, pc or 0; rs2 or the immediate) are fixed
+#   in their code instead of being tested on every execution.
+#--------------------------------------------------------------------------
+
+ALU_HANDLER = """
+def %(name)s(self, pc, d):
+    rd = d[6]
+    if rd:
+        R = self.cpu.regs.reg
+        R[rd] = %(expr)s
+    self.cpu.pc.write((pc + 4) & 0xffffffff)
+    return None
+"""
+
+BRANCH_HANDLER = """
+def %(name)s(self, pc, d):
+    R = self.cpu.regs.reg
+    if %(cond)s:
+        self.cpu.pc.write((pc + d[7]) & 0xffffffff)
+    else:
+        self.cpu.pc.write((pc + 4) & 0xffffffff)
+    return None
+"""
+
+def make_handlers():
+    # Fills Sim.dispatch; generated handlers are also added to Sim as
+    # Sim.op_<name> (e.g. Sim.op_addi)
+
+    fixed = { JAL: Sim.run_jal, JALR: Sim.run_jalr, ECALL: Sim.run_ecall, EBREAK: Sim.run_ebreak }
+    for opcode, cs in isa.items():
+        name    = "op_" + cs[IN_NAME]
+        if cs[IN_CLASS] == CL_MEM:
+            Sim.dispatch[opcode] = Sim.run_load if cs[IN_OP] == MEM_LD else Sim.run_store
+            continue
+        if opcode in fixed:
+            Sim.dispatch[opcode] = fixed[opcode]
+            continue
+        if cs[IN_CLASS] == CL_ALU:
+            a   = "R[d[4]]"     if cs[IN_ALU1] == OP1_RS1   else \
+                  "pc"          if cs[IN_ALU1] == OP1_PC    else \
+                  "0"
+            b   = "R[d[5]]"     if cs[IN_ALU2] == OP2_RS2   else \
+                  "d[7]"
+            src = ALU_HANDLER % { 'name': name, 'expr': Sim.alu[cs[IN_OP]] % { 'a': a, 'b': b } }
+        else:
+            cond = Sim.cond[opcode] % { 'a': "R[d[4]]", 'b': "R[d[5]]" }
+            src = BRANCH_HANDLER % { 'name': name, 'cond': cond }
+            Sim.taken[opcode] = eval(compile("lambda R, d: " + cond, "<%s>" % name, "eval"))
+        env = { }
+        exec(compile(src, "<%s>" % name, "exec"), env)
+        setattr(Sim, name, env[name])
+        Sim.dispatch[opcode] = env[name]
+
+make_handlers()
@@ -0,0 +1,118 @@
+#==========================================================================
+#
+#   The PyRISC Project
+#
+#   SNURISC: A RISC-V ISA Simulator
+#
+#   CPU and memory snapshots, and copy-on-write cloning.
+#
+#==========================================================================
+
+import struct
+
+from pyrisc.sim.consts import *
+from pyrisc.sim.components import *
+from pyrisc.sim.sim import *
+from pyrisc.sim.snurisc import SNURISC
+
+
+#--------------------------------------------------------------------------
+#   Snapshot format (little-endian)
+#
+#   header  : magic, version, pc, timer mtime, mtimecmp and interval,
+#             page count, frame count
+#   regs    : NUM_REGS words
+#   pages   : ( vpn, perms, frame index ) per page, sorted by vpn;
+#             frame index -1 is a zero-filled (demand-zero) frame
+#   frames  : PAGE_SIZE bytes per frame, in index order
+#
+#   Frames mapped by several pages are saved once and shared again (copy-
+#   on-write) on restore.
+#--------------------------------------------------------------------------
+
+SNAPSHOT_MAGIC      = b'PRSN'
+SNAPSHOT_VERSION    = 2
+
+SNAPSHOT_HEADER     = struct.Struct('<4sIIQQQII')
+SNAPSHOT_REGS       = struct.Struct('<%dI' % NUM_REGS)
+SNAPSHOT_PAGE       = struct.Struct('<IBi')
+
+
+def snapshot(cpu) -> bytes:
+    # cpu.mmu.page_table must be a PageTable (or provide its entries)
+
+    memory  = cpu.mmu.memory
+    pages   = [ ]
+    frames  = [ ]
+    index   = { }           # frame -> frame index
+    for vpn, pte in sorted(cpu.mmu.page_table.entries.items()):
+        i = index.get(pte.frame) if pte.frame is not None else -1
+        if i is None:
+            data = memory.page(pte.frame)
+            if data == ZERO_PAGE:
+                i = -1
+            else:
+                i = len(frames)
+                frames.append(data)
+            index[pte.frame] = i
+        pages.append(SNAPSHOT_PAGE.pack(vpn, pte.perms, i))
+
+    timer   = cpu.timer
+    header  = SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, int(cpu.pc.read()),
+                                   timer.mtime, timer.mtimecmp, timer.interval, len(pages), len(frames))
+    regs    = SNAPSHOT_REGS.pack(*[ int(r) for r in cpu.regs.reg ])
+    return b''.join([ header, regs ] + pages + frames)
+
+
+def restore(data, engine = Sim, vm = None) -> SNURISC:
+    # Rebuilds a CPU from snapshot() into vm (a new PageTable by default)
+
+    magic, version, pc, mtime, mtimecmp, interval, npages, nframes = SNAPSHOT_HEADER.unpack_from(data, 0)
+    if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+        raise ValueError("not a snapshot (version %d)" % SNAPSHOT_VERSION)
+    off     = SNAPSHOT_HEADER.size
+    regs    = SNAPSHOT_REGS.unpack_from(data, off)
+    off     += SNAPSHOT_REGS.size
+    frames  = off + npages * SNAPSHOT_PAGE.size
+    if len(data) != frames + nframes * PAGE_SIZE:
+        raise ValueError("truncated snapshot")
+
+    vm      = PageTable() if vm is None else vm
+    data    = memoryview(data)
+    owners  = { }           # frame index -> first pte restored
+    for p in range(npages):
+        vpn, perms, i = SNAPSHOT_PAGE.unpack_from(data, off + p * SNAPSHOT_PAGE.size)
+        pte = owners.get(i) if i >= 0 else None
+        if pte is None:
+            pte = vm.map(vpn, perms, demand_zero = i < 0)
+            if i >= 0:
+                pte.physical_page = data[frames + i * PAGE_SIZE:frames + (i + 1) * PAGE_SIZE]
+                owners[i] = pte
+        else:
+            pte = pte.share(vpn, stat = vm.stat)
+            pte.perms = perms
+            vm.entries[vpn] = pte
+
+    cpu     = SNURISC(vm, engine, 0)
+    for r in range(1, NUM_REGS):
+        cpu.regs.write(r, regs[r])
+    cpu.pc.write(pc)
+    cpu.timer.mtime     = mtime
+    cpu.timer.mtimecmp  = mtimecmp
+    cpu.timer.interval  = interval
+    return cpu
+
+
+def clone(cpu, engine = None) -> SNURISC:
+    # fork(): a new CPU with the same registers and a copy-on-write copy of
+    # the address space (see PageTable.clone()). Only pages that are stored
+    # to later get copied, except writable frames managed by the kernel.
+
+    child   = SNURISC(cpu.mmu.page_table.clone(), engine or type(cpu.engine), 0)
+    for r in range(1, NUM_REGS):
+        child.regs.write(r, cpu.regs.read(r))
+    child.pc.write(cpu.pc.read())
+    child.timer.mtime       = cpu.timer.mtime
+    child.timer.mtimecmp    = cpu.timer.mtimecmp
+    child.timer.interval    = cpu.timer.interval
+    return child
@@ -16,12 +16,15 @@
 #==========================================================================
 
 import sys
+import asyncio
+import collections
 
 from pyrisc.sim.consts import *
 from pyrisc.sim.isa import *
 from pyrisc.sim.components import *
 from pyrisc.sim.program import *
 from pyrisc.sim.sim import *
+from pyrisc.sim.translate import *
 
 
 #--------------------------------------------------------------------------
@@ -37,6 +40,16 @@ IMEM_SIZE   = WORD(64 * 1024)
 DMEM_START  = WORD(0x80010000)      # DMEM: 0x80010000 - 0x8001ffff (64KB)
 DMEM_SIZE   = WORD(64 * 1024)
 
+ASYNC_SLICE = 10000                 # instructions between yields of run_async()
+
+
+def map_dmem(vm):
+    # Maps the pages of data memory (and the stack) that a program does not
+    # map itself, demand-zero
+    for vpn in range(int(DMEM_START) >> VPO_LENTGH, int(DMEM_START + DMEM_SIZE) >> VPO_LENTGH):
+        if vm.translate(vpn) is None:
+            vm.map(vpn, M_READ_WRITE, demand_zero = True)
+
 
 #--------------------------------------------------------------------------
 #   SNURISC: Target machine to simulate
@@ -45,15 +58,70 @@ DMEM_SIZE   = WORD(64 * 1024)
 class SNURISC(object):
 
 
-    def __init__(self, vm: TranslatesAddresses):
-
-        self.pc     = Register()
-        self.regs   = RegisterFile()
-        self.mmu    = MMU(vm)
-        self.clock  = Clock() ## cpu clock
+    # engine: Sim (interpreter) or BlockSim (basic-block translation)
+    # period: instructions between timer interrupts in run(), 0 for none
+    # (the kernel may reprogram cpu.timer at any time between runs)
+    def __init__(self, vm: TranslatesAddresses, engine = Sim, period = 500):
+
+        self.pc         = Register()
+        self.regs       = RegisterFile()
+        self.mmu        = MMU(vm)
+        self.timer      = Timer(period)
+        self.stat       = Stat()
+        self.log        = Log()
+        self.asmcache   = AsmCache()
+        self.trace      = None          # TraceWriter (see trace.py)
+        self.hist       = None          # Histogram (see histogram.py)
+        self.trap       = TrapRecord()  # last exception raised (see sim.py)
+        self.irqs       = collections.deque()   # sources of posted interrupts
+        self.syscalls   = { }           # syscall number -> handler (see register_syscall())
+        self.engine     = engine(self)
+
+    # The former clock, as a view of the timer (see Clock)
+    @property
+    def clock(self):
+        return Clock(timer = self.timer)
 
     def run(self, entry_point) -> Event:
-        return Sim.run(self, entry_point)
+        return self.engine.run(entry_point)
+
+    # Same as run(), for asyncio: runs slices of up to slice instructions
+    # and yields to the event loop between them. Cancelling the task stops
+    # the CPU between two slices, with cpu.pc at the next instruction.
+    # Smaller slices take posted interrupts and cancellation sooner, at
+    # some cost in throughput.
+    async def run_async(self, entry_point, slice = ASYNC_SLICE) -> Event:
+        self.pc.write(entry_point)
+        while True:
+            event = self.engine.run_slice(slice)
+            if event is not None:
+                return event
+            await asyncio.sleep(0)
+
+    # handler(cpu) runs inside the engine on an ecall with a7 == number,
+    # with the pc already past the ecall. It can use cpu.regs and guest
+    # memory through cpu.mmu (mem_load(), read_bytes(), ...), and returns
+    # True if it handled the syscall; if it returns False, the ecall stops
+    # the CPU with EXC_ECALL as usual. handler None removes the handler.
+    def register_syscall(self, number, handler):
+        if handler is None:
+            self.syscalls.pop(number, None)
+        else:
+            self.syscalls[number] = handler
+
+    # Posts an interrupt, e.g. from a device callback. The next run(), or
+    # run_async() at its next slice, stops with an IrqEvent (EXC_INTERRUPT)
+    # whose source is source; several posts are taken one by one.
+    def post_interrupt(self, source = None):
+        self.irqs.append(source)
+
+    # Runs up to budget instructions from the current pc and returns a
+    # RunResult; no timer interrupt is taken
+    def resume(self, budget) -> RunResult:
+        return self.engine.resume(budget)
+
+    def step(self, n = 1) -> RunResult:
+        return self.engine.resume(n)
 
 
 #--------------------------------------------------------------------------
@@ -124,13 +192,17 @@ def main():
         show_usage(sys.argv[0])
         sys.exit()
 
-    cpu = SNURISC()
+    Stat.enabled = True
+    cpu = SNURISC(PageTable())
     prog = Program()
     entry_point = prog.load(cpu, filename)
     if not entry_point:
         sys.exit()
-    cpu.run(entry_point)
-    Stat.show()
+    map_dmem(cpu.mmu.page_table)
+    event = cpu.run(entry_point)
+    while event.type == EXC_CLOCK:
+        event = cpu.run(cpu.pc.read())
+    cpu.stat.show()
 
 
 if __name__ == '__main__':
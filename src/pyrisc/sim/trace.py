@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+
+#==========================================================================
+#
+#   The PyRISC Project
+#
+#   SNURISC: A RISC-V ISA Simulator
+#
+#   Binary execution trace writer and decoder.
+#
+#==========================================================================
+
+import io
+import sys
+import gzip
+import struct
+
+from pyrisc.sim.consts import *
+from pyrisc.sim.isa import *
+from pyrisc.sim.program import *
+
+
+#--------------------------------------------------------------------------
+#   Trace format (little-endian)
+#
+#   header  : magic, version, record size, number of the first record
+#   records : ( pc, inst, wbdata, mem addr, mem data, rd, kind, event )
+#             per executed instruction, TRACE_RECORD.size bytes each
+#
+#   kind is TR_NONE, TR_LOAD or TR_STORE. rd is 0 if no register is
+#   written. event is the exception raised by the instruction (EXC_NONE
+#   if none); a faulting instruction has inst 0 if its fetch failed.
+#   The whole stream is gzip-compressed if it starts with the gzip magic.
+#--------------------------------------------------------------------------
+
+TRACE_MAGIC         = b'PRTR'
+TRACE_VERSION       = 1
+
+TRACE_HEADER        = struct.Struct('<4sHHQ')
+TRACE_RECORD        = struct.Struct('<IIIIIBBBx')
+
+TRACE_BUFFER        = 4096          # records buffered before a write
+
+GZIP_MAGIC          = b'\x1f\x8b'
+GZIP_LEVEL          = 1             # fast; records compress well anyway
+
+
+#--------------------------------------------------------------------------
+#   TraceWriter: buffered writer of trace records
+#
+#   Set cpu.trace to a TraceWriter to trace a CPU. With ring = N, only the
+#   last N records are kept in memory and written on close(), e.g. after
+#   the run stopped on a fault.
+#--------------------------------------------------------------------------
+
+class TraceWriter(object):
+
+    def __init__(self, f, compress = False, ring = 0):
+        # f: a file name or a binary file object (left open on close())
+        self.owned  = isinstance(f, str)
+        self.raw    = open(f, 'wb') if self.owned else f
+        self.f      = gzip.GzipFile(fileobj = self.raw, mode = 'wb',
+                                    compresslevel = GZIP_LEVEL) if compress else self.raw
+        self.ring   = ring
+        self.size   = ring or TRACE_BUFFER
+        self.buf    = bytearray(self.size * TRACE_RECORD.size)
+        self.n      = 0             # records in buf (next slot)
+        self.total  = 0             # records written so far
+        if not ring:
+            self.f.write(TRACE_HEADER.pack(TRACE_MAGIC, TRACE_VERSION, TRACE_RECORD.size, 0))
+
+    def write(self, pc, inst, rd, wbdata, kind, addr, data, event):
+        TRACE_RECORD.pack_into(self.buf, self.n * TRACE_RECORD.size,
+                               pc, inst, wbdata, addr, data, rd, kind, event)
+        self.n      += 1
+        self.total  += 1
+        if self.n == self.size:
+            if self.ring:
+                self.n = 0
+            else:
+                self.f.write(self.buf)
+                self.n = 0
+
+    def close(self):
+        if self.f is None:
+            return
+        if not self.ring:
+            self.f.write(memoryview(self.buf)[:self.n * TRACE_RECORD.size])
+        else:
+            # The oldest record is at n once the ring has wrapped around
+            kept    = min(self.total, self.ring)
+            first   = self.n if self.total > self.ring else 0
+            data    = memoryview(self.buf)
+            self.f.write(TRACE_HEADER.pack(TRACE_MAGIC, TRACE_VERSION, TRACE_RECORD.size,
+                                           self.total - kept))
+            self.f.write(data[first * TRACE_RECORD.size:kept * TRACE_RECORD.size])
+            self.f.write(data[:first * TRACE_RECORD.size])
+        if self.f is not self.raw:
+            self.f.close()
+        if self.owned:
+            self.raw.close()
+        else:
+            self.raw.flush()
+        self.f = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+#--------------------------------------------------------------------------
+#   read_trace: decodes a trace
+#--------------------------------------------------------------------------
+
+def read_trace(f):
+    # f: a file name or a binary file object. Yields
+    #   ( number, pc, inst, wbdata, addr, data, rd, kind, event )
+    # per record, numbered from the first instruction traced.
+
+    owned   = isinstance(f, str)
+    f       = open(f, 'rb') if owned else f
+    try:
+        if not hasattr(f, 'peek'):
+            f = io.BufferedReader(f)
+        if f.peek(2)[:2] == GZIP_MAGIC:
+            f = gzip.GzipFile(fileobj = f, mode = 'rb')
+        head = f.read(TRACE_HEADER.size)
+        if len(head) < TRACE_HEADER.size:
+            raise ValueError("not a trace")
+        magic, version, size, number = TRACE_HEADER.unpack(head)
+        if magic != TRACE_MAGIC or version != TRACE_VERSION or size != TRACE_RECORD.size:
+            raise ValueError("not a trace (version %d)" % TRACE_VERSION)
+        while True:
+            chunk = f.read(TRACE_BUFFER * size)
+            if not chunk:
+                break
+            chunk = chunk[:len(chunk) - len(chunk) % size]
+            for rec in TRACE_RECORD.iter_unpack(chunk):
+                yield ( number, ) + rec
+                number += 1
+    finally:
+        if owned:
+            f.close()
+
+
+def format_record(rec, asm):
+    # One line per record, in the format of log level 4
+
+    number, pc, inst, wbdata, addr, data, rd, kind, event = rec
+    info = "# R[%2d] <- 0x%08x" % (rd, wbdata) if rd else "# " + 16 * " "
+    if kind == TR_LOAD:
+        info += "  [0x%08x] -> 0x%08x" % (addr, data)
+    elif kind == TR_STORE:
+        info += "  [0x%08x] <- 0x%08x" % (addr, data)
+    if event != EXC_NONE:
+        info += "  (%s)" % EXC_MSG.get(event, "exception %d" % event)
+    return "%3d 0x%08x: %-30s%-s" % (number, pc, asm, info)
+
+
+#--------------------------------------------------------------------------
+#   Utility functions for command line parsing
+#--------------------------------------------------------------------------
+
+def show_usage(name):
+    print("Usage: %s [-s first] [-n count] filename" % name)
+    print("\tfilename: trace file written by TraceWriter")
+    print("\t-s skips the records before instruction number first (default: 0)")
+    print("\t-n shows at most count records (default: all)")
+
+
+def parse_args(args):
+    opts    = { 'first': 0, 'count': None }
+    index   = 1
+    while index < len(args) and args[index].startswith('-'):
+        try:
+            if args[index] == '-s':
+                opts['first'] = int(args[index + 1])
+            elif args[index] == '-n':
+                opts['count'] = int(args[index + 1])
+            else:
+                print("Invalid option '%s'" % args[index])
+                return None
+        except (IndexError, ValueError):
+            print("Invalid value for option '%s'" % args[index])
+            return None
+        index += 2
+
+    if index != len(args) - 1:
+        return None
+    return ( args[index], opts )
+
+
+#--------------------------------------------------------------------------
+#   Trace decoder main
+#--------------------------------------------------------------------------
+
+def main():
+
+    parsed = parse_args(sys.argv)
+    if not parsed:
+        show_usage(sys.argv[0])
+        sys.exit()
+
+    filename, opts = parsed
+    shown   = 0
+    asms    = { }               # ( pc, inst ) -> disassembly, filled lazily
+    for rec in read_trace(filename):
+        if rec[0] < opts['first']:
+            continue
+        if opts['count'] is not None and shown >= opts['count']:
+            break
+        key = ( rec[1], rec[2] )
+        asm = asms.get(key)
+        if asm is None:
+            asm = Program.disasm(rec[1], rec[2]) if rec[2] or rec[8] == EXC_NONE else "(fetch fault)"
+            asms[key] = asm
+        print(format_record(rec, asm))
+        shown += 1
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,249 @@
+#==========================================================================
+#
+#   The PyRISC Project
+#
+#   SNURISC: A RISC-V ISA Simulator
+#
+#   Basic-block translation engine.
+#
+#==========================================================================
+
+
+from pyrisc.sim.consts import *
+from pyrisc.sim.isa import *
+from pyrisc.sim.components import *
+from pyrisc.sim.program import *
+from pyrisc.sim.sim import *
+
+
+#--------------------------------------------------------------------------
+#   Block: a guest basic block translated into a Python function
+#--------------------------------------------------------------------------
+
+class Block(object):
+
+    def __init__(self, pc, func, ninsts, counts, source):
+        self.pc     = pc            # guest pc of the first instruction
+        self.func   = func          # func(R, PC, mmu, trap) -> ( n, trap or None )
+        self.ninsts = ninsts
+        self.counts = counts        # counts[n]: [ alu, mem, ctrl ] among the first n instructions
+        self.source = source
+
+
+#--------------------------------------------------------------------------
+#   Translator: generates Python source for a basic block
+#--------------------------------------------------------------------------
+
+class Translator(object):
+
+    MAX_BLOCK_INSTS = 64
+
+    # ALU operations and branch conditions, as in the interpreter
+    alu     = Sim.alu
+    cond    = Sim.cond
+
+    def __init__(self, pc):
+        self.pc         = pc
+        self.lines      = [ ]
+        self.loaded     = [ ]       # live-in registers, loaded on entry
+        self.written    = [ ]       # registers modified so far
+        self.mem        = False     # the block accesses memory
+
+    @staticmethod
+    def scan(memory, frame, pc):
+        # Collects predecoded instructions up to the first control transfer,
+        # the end of the page, or an illegal instruction
+        insts   = [ ]
+        vpo     = pc & VPO_MASK
+        while vpo < PAGE_SIZE and len(insts) < Translator.MAX_BLOCK_INSTS:
+            inst    = memory.words[((frame << VPO_LENTGH) | vpo) >> 2]
+            d       = Sim.decode(inst)
+            if d[0] is Sim.run_illegal:
+                break
+            insts.append(d)
+            if d[3][IN_CLASS] == CL_CTRL:
+                break
+            vpo     += WORD_SIZE
+        return insts
+
+    def emit(self, line, indent = 1):
+        self.lines.append("    " * indent + line)
+
+    def read(self, r):
+        if r == 0:
+            return "0"
+        if r not in self.written and r not in self.loaded:
+            self.loaded.append(r)
+        return "x%d" % r
+
+    def write(self, r, expr):
+        if r == 0:
+            return
+        self.emit("x%d = %s" % (r, expr))
+        if r not in self.written:
+            self.written.append(r)
+
+    def exit(self, n, pc_next, event = "None", indent = 1):
+        for r in self.written:
+            self.emit("R[%d] = x%d" % (r, r), indent)
+        self.emit("PC.write(0x%08x)" % pc_next, indent)
+        self.emit("return ( %d, %s )" % (n, event), indent)
+
+    def gen_alu(self, pc, d):
+        _, inst, opcode, cs, rs1, rs2, rd, imm = d
+        a   = self.read(rs1)        if cs[IN_ALU1] == OP1_RS1   else \
+              "0x%08x" % pc         if cs[IN_ALU1] == OP1_PC    else \
+              "0"
+        b   = self.read(rs2)        if cs[IN_ALU2] == OP2_RS2   else \
+              "0x%08x" % imm
+        self.write(rd, Translator.alu[cs[IN_OP]] % { 'a': a, 'b': b })
+
+    def gen_mem(self, pc, d, i):
+        _, inst, opcode, cs, rs1, rs2, rd, imm = d
+        self.mem = True
+        size, signed = MT_ACCESS[cs[IN_MT]]
+        self.emit("a = (%s + %d) & 0xffffffff" % (self.read(rs1), sword(imm)))
+        if cs[IN_OP] == MEM_LD:
+            self.emit("v, st = load(a, %d, %s)" % (size, signed))
+            self.emit("if st:")
+            self.exit(i + 1, pc, "trap.set(st, mmu.fault_addr, 0x%08x)" % pc, 2)
+            self.write(rd, "v")
+        else:
+            self.emit("v, st = store(a, %s, %d)" % (self.read(rs2), size))
+            self.emit("if st:")
+            self.exit(i + 1, pc, "trap.set(st, mmu.fault_addr, 0x%08x)" % pc, 2)
+            # The store may have overwritten translated code
+            self.emit("if cache.version != version:")
+            self.exit(i + 1, pc + 4, "None", 2)
+
+    def gen_ctrl(self, pc, d, n):
+        _, inst, opcode, cs, rs1, rs2, rd, imm = d
+        if opcode == EBREAK:
+            self.exit(n, pc, "trap.set(EXC_EBREAK)")
+        elif opcode == ECALL:
+            self.exit(n, pc + 4, "trap.set(EXC_ECALL)")
+        elif opcode == JAL:
+            self.write(rd, "0x%08x" % (pc + 4))
+            self.exit(n, (pc + imm) & MASK32)
+        elif opcode == JALR:
+            self.emit("t = (%s + 0x%08x) & 0xfffffffe" % (self.read(rs1), imm))
+            self.write(rd, "0x%08x" % (pc + 4))
+            for r in self.written:
+                self.emit("R[%d] = x%d" % (r, r))
+            self.emit("PC.write(t)")
+            self.emit("return ( %d, None )" % n)
+        else:
+            c = Translator.cond[opcode] % { 'a': self.read(rs1), 'b': self.read(rs2) }
+            self.emit("if %s:" % c)
+            self.exit(n, (pc + imm) & MASK32, "None", 2)
+            self.exit(n, pc + 4)
+
+    def translate(self, insts):
+        counts  = [ [ 0, 0, 0 ] ]
+        pc      = self.pc
+        for i, d in enumerate(insts):
+            cl      = d[3][IN_CLASS]
+            c       = list(counts[-1])
+            c[cl]   += 1
+            counts.append(c)
+            if cl == CL_ALU:
+                self.gen_alu(pc, d)
+            elif cl == CL_MEM:
+                self.gen_mem(pc, d, i)
+            else:
+                self.gen_ctrl(pc, d, i + 1)
+            pc      += WORD_SIZE
+        if insts[-1][3][IN_CLASS] != CL_CTRL:
+            self.exit(len(insts), pc)
+
+        head    = [ "def block(R, PC, mmu, trap):" ]
+        if self.mem:
+            head += [ "    load = mmu.mem_load",
+                      "    store = mmu.mem_store",
+                      "    cache = mmu.block_cache",
+                      "    version = cache.version" ]
+        head    += [ "    x%d = R[%d]" % (r, r) for r in self.loaded ]
+        source  = "\n".join(head + self.lines) + "\n"
+        env     = { 'EXC_EBREAK': EXC_EBREAK, 'EXC_ECALL': EXC_ECALL }
+        exec(compile(source, "<block 0x%08x>" % self.pc, "exec"), env)
+        return Block(self.pc, env['block'], len(insts), counts, source)
+
+
+#--------------------------------------------------------------------------
+#   BlockSim: runs the CPU on translated basic blocks
+#
+#   A drop-in replacement for Sim (see SNURISC(vm, engine = BlockSim)).
+#   Instruction fetch faults, illegal instructions and blocks that do not
+#   fit in the remaining budget (up to the timer deadline in run()) are
+#   handed to single_step(), so events, timer interrupts and stats are the
+#   same as with the interpreter. Stats by instruction class are added per
+#   block, only if enabled.
+#--------------------------------------------------------------------------
+
+class BlockSim(Sim):
+
+    def resume(self, budget) -> RunResult:
+        # Same as Sim.resume(), running whole blocks while they fit in
+        # the remaining budget
+
+        if self.traced():
+            return Sim.resume(self, budget)
+
+        cpu     = self.cpu
+
+        mmu     = cpu.mmu
+        stat    = self.stat
+        R       = cpu.regs.reg
+        PC      = cpu.pc
+        trap    = self.trap
+        counted = stat.enabled
+        counts  = [ 0, 0, 0 ]
+        n       = 0
+
+        while n < budget:
+            pc      = PC.read()
+            blk     = None
+            frame, mem_status = mmu.code_page(pc)
+            if mem_status == EXC_NONE:
+                blk = BlockSim.lookup(mmu, frame, pc)
+
+            if blk is None or n + blk.ninsts > budget:
+                n += 1
+                status = self.single_step()
+                if status is not None:
+                    break
+                continue
+
+            k, status = blk.func(R, PC, mmu, trap)
+            n += k
+            if counted:
+                for i, c in enumerate(blk.counts[k]):
+                    counts[i] += c
+            if status is not None:
+                # A block ends at an ecall, which may be handled inline
+                if status.type != EXC_ECALL or not self.syscall():
+                    break
+        else:
+            status = None
+
+        stat.cycle      += n
+        stat.icount     += n
+        stat.inst_alu   += counts[CL_ALU]
+        stat.inst_mem   += counts[CL_MEM]
+        stat.inst_ctrl  += counts[CL_CTRL]
+        cpu.timer.mtime += n
+        return RunResult(status.event() if status is not None else None, n)
+
+    @staticmethod
+    def lookup(mmu, frame, pc):
+        # returns None if the block starts with an illegal instruction
+        vpo = pc & VPO_MASK
+        blk = mmu.block_cache.lookup(frame, vpo)
+        # The same frame may be mapped at several virtual addresses
+        if blk is None or blk.pc != pc:
+            insts = Translator.scan(mmu.memory, frame, pc)
+            if not insts:
+                return None
+            blk = Translator(pc).translate(insts)
+            mmu.block_cache.add(frame, vpo, blk)
+        return blk
@@ -0,0 +1,111 @@
+#==========================================================================
+#
+#   The PyRISC Project
+#
+#   Guest programs and helpers shared by the tests.
+#
+#==========================================================================
+
+import struct
+import random
+
+from pyrisc.sim.consts import *
+from pyrisc.sim.isa import *
+from pyrisc.sim.components import *
+from pyrisc.sim.kernels import *
+
+
+DATA_PAGES  = 2
+
+
+def make_elf(code, data = b'', bss = 0):
+    # A 32-bit RISC-V ELF executable with a text segment at TEXT_START and,
+    # if data or bss, a writable segment at DATA_START
+    text    = b''.join(w.to_bytes(WORD_SIZE, "little") for w in code)
+    nph     = 2 if data or bss else 1
+    header  = b'\x7fELF' + bytes([ 1, 1, 1, 0 ]) + bytes(8) + \
+              struct.pack('<HHIIIIIHHHHHH', 2, 243, 1, TEXT_START, 52, 0, 0, 52, 32, nph, 40, 0, 0)
+    phdrs   = struct.pack('<IIIIIIII', 1, PAGE_SIZE, TEXT_START, TEXT_START, len(text), len(text), 5, PAGE_SIZE)
+    doff    = PAGE_SIZE + (len(text) + PAGE_SIZE - 1) // PAGE_SIZE * PAGE_SIZE
+    if nph == 2:
+        phdrs += struct.pack('<IIIIIIII', 1, doff, DATA_START, DATA_START, len(data), len(data) + bss, 6, PAGE_SIZE)
+    out     = bytearray(header + phdrs)
+    out     += bytes(PAGE_SIZE - len(out)) + text
+    if nph == 2:
+        out += bytes(doff - len(out)) + data
+    return bytes(out)
+
+
+def load(code, text_prot = M_READ_ONLY):
+    # A PageTable with code at TEXT_START and DATA_PAGES zeroed data pages
+    vm      = PageTable()
+    text    = b''.join(w.to_bytes(WORD_SIZE, "little") for w in code)
+    for off in range(0, len(text), PAGE_SIZE):
+        pte = vm.map((TEXT_START + off) >> VPO_LENTGH, text_prot)
+        pte.physical_page[0:len(text[off:off+PAGE_SIZE])] = text[off:off+PAGE_SIZE]
+    for i in range(DATA_PAGES):
+        vm.map((DATA_START >> VPO_LENTGH) + i, M_READ_WRITE)
+    return vm
+
+
+def random_program(seed, iterations = 20):
+    # A loop over random ALU instructions, loads and stores of every size
+    # around the boundary of the data pages (s0), forward branches and
+    # ecalls
+    rnd     = random.Random(seed)
+    S0, T0  = 8, 5
+    regs    = [ r for r in range(1, 32) if r not in ( S0, T0 ) ]
+    body    = [ ]
+    while len(body) < 40:
+        k   = rnd.random()
+        rd, a, b = rnd.choice(regs), rnd.choice(regs + [ 0 ]), rnd.choice(regs + [ 0 ])
+        if k < 0.35:
+            op = rnd.choice([ ADD, SUB, SLL, SLT, SLTU, XOR, SRL, SRA, OR, AND ])
+            body.append(enc_r(op, rd, a, b))
+        elif k < 0.6:
+            op = rnd.choice([ ADDI, SLTI, SLTIU, XORI, ORI, ANDI ])
+            body.append(enc_i(op, rd, a, rnd.randint(-2048, 2047)))
+        elif k < 0.65:
+            op = rnd.choice([ SLLI, SRLI, SRAI ])
+            body.append(enc_i(op, rd, a, rnd.randint(0, 31) | (0x400 if op == SRAI else 0)))
+        elif k < 0.7:
+            body.append(enc_u(rnd.choice([ LUI, AUIPC ]), rd, rnd.getrandbits(32)))
+        elif k < 0.8:
+            off = rnd.randint(-2048, 2047 - 4)
+            body.append(enc_i(rnd.choice([ LB, LH, LW, LBU, LHU ]), rd, S0, off))
+        elif k < 0.9:
+            off = rnd.randint(-2048, 2047 - 4)
+            body.append(enc_s(rnd.choice([ SB, SH, SW ]), b, S0, off))
+        elif k < 0.97:
+            skip = rnd.randint(1, 3)
+            op = rnd.choice([ BEQ, BNE, BLT, BGE, BLTU, BGEU ])
+            body.append(enc_b(op, a, b, (skip + 1) * 4))
+            body += [ enc_i(ADDI, rd, rd, rnd.randint(-100, 100)) for i in range(skip) ]
+        else:
+            body.append(int(ECALL))
+    # s0 points to the second data page
+    code    = [ enc_u(LUI, T0, iterations << 12), enc_i(SRLI, T0, T0, 12),
+                enc_u(LUI, S0, DATA_START + PAGE_SIZE) ]
+    code    += body
+    code    += [ enc_i(ADDI, T0, T0, -1), enc_b(BNE, T0, 0, -4 * (len(body) + 1)), int(EBREAK) ]
+    return code
+
+
+def run(cpu, entry = TEXT_START):
+    # Runs to the end of the program; ecalls return 7 in a0. Returns the
+    # list of ( event type, icount ) seen by the kernel.
+    events  = [ ]
+    event   = cpu.run(entry)
+    while True:
+        events.append(( event.type, cpu.stat.icount ))
+        if event.type == EXC_ECALL:
+            cpu.regs.write(10, 7)
+        elif event.type != EXC_CLOCK:
+            return events
+        event   = cpu.run(cpu.pc.read())
+
+
+def state(cpu):
+    # Registers, pc and the contents of all mapped pages
+    pages   = { vpn: bytes(pte.physical_page) for vpn, pte in cpu.mmu.page_table.entries.items() }
+    return ( list(cpu.regs.reg), cpu.pc.read(), pages )
@@ -0,0 +1,97 @@
+#==========================================================================
+#
+#   The PyRISC Project
+#
+#   Tests for run_async() and posted interrupts.
+#
+#==========================================================================
+
+import asyncio
+
+import pytest
+
+from pyrisc.sim.consts import *
+from pyrisc.sim.isa import *
+from pyrisc.sim.components import *
+from pyrisc.sim.sim import Sim, IrqEvent
+from pyrisc.sim.translate import BlockSim
+from pyrisc.sim.snurisc import SNURISC
+
+from guest import *
+
+
+A0      = 10
+COUNT   = 20000
+
+
+def counter(engine, count = COUNT):
+    # a0 counts the iterations of a loop, then ebreak
+    return SNURISC(load(kernel([ enc_i(ADDI, A0, A0, 1) ], count)), engine, 0)
+
+
+@pytest.mark.parametrize('engine', [ Sim, BlockSim ])
+def test_run_async(engine):
+    cpu     = counter(engine)
+    event   = asyncio.run(cpu.run_async(TEXT_START, 1000))
+    assert event.type == EXC_EBREAK
+    ref     = counter(engine)
+    assert ref.run(TEXT_START).type == EXC_EBREAK
+    assert state(cpu) == state(ref) and cpu.stat.icount == ref.stat.icount
+
+
+@pytest.mark.parametrize('engine', [ Sim, BlockSim ])
+def test_cancel_and_continue(engine):
+    # Cancelling stops the CPU between two slices; continuing from cpu.pc
+    # loses and repeats no instruction
+    cpu     = counter(engine)
+
+    async def cancelled():
+        task = asyncio.ensure_future(cpu.run_async(TEXT_START, 100))
+        for i in range(5):
+            await asyncio.sleep(0)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(cancelled())
+    icount  = cpu.stat.icount
+    assert 0 < icount < 3 * COUNT and icount % 100 == 0
+    assert TEXT_START <= cpu.pc.read() < TEXT_START + 7 * 4
+    event   = asyncio.run(cpu.run_async(cpu.pc.read(), 100))
+    assert event.type == EXC_EBREAK
+    assert cpu.regs.read(A0) == COUNT
+
+
+@pytest.mark.parametrize('engine', [ Sim, BlockSim ])
+def test_post_interrupt_while_running(engine):
+    cpu     = counter(engine)
+
+    async def device():
+        await asyncio.sleep(0)
+        cpu.post_interrupt('disk')
+        cpu.post_interrupt('net')
+
+    async def supervisor():
+        events  = [ ]
+        task    = asyncio.ensure_future(device())
+        event   = await cpu.run_async(TEXT_START, 100)
+        while event.type == EXC_INTERRUPT:
+            events.append(( event.source, cpu.stat.icount ))
+            event = await cpu.run_async(cpu.pc.read(), 100)
+        await task
+        return events, event
+
+    events, event = asyncio.run(supervisor())
+    assert event.type == EXC_EBREAK and cpu.regs.read(A0) == COUNT
+    # One interrupt per slice boundary, in the order posted
+    assert [ source for source, icount in events ] == [ 'disk', 'net' ]
+    assert events[0][1] == events[1][1] and events[0][1] % 100 == 0
+
+
+def test_post_interrupt_before_run():
+    cpu     = counter(Sim)
+    cpu.post_interrupt(3)
+    event   = cpu.run(TEXT_START)
+    assert isinstance(event, IrqEvent) and ( event.type, event.source ) == ( EXC_INTERRUPT, 3 )
+    assert cpu.stat.icount == 0 and cpu.pc.read() == TEXT_START
+    assert cpu.run(cpu.pc.read()).type == EXC_EBREAK
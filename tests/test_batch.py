@@ -0,0 +1,96 @@
+#==========================================================================
+#
+#   The PyRISC Project
+#
+#   Tests for the batch runner.
+#
+#==========================================================================
+
+import pytest
+
+from pyrisc.sim.consts import *
+from pyrisc.sim.isa import *
+from pyrisc.sim.components import *
+from pyrisc.sim.program import *
+from pyrisc.sim.sim import Sim
+from pyrisc.sim.translate import BlockSim
+from pyrisc.sim.batch import *
+
+from guest import *
+
+
+A0      = 10
+
+
+def exits(value):
+    # a0 = value; ebreak
+    return make_elf([ enc_i(ADDI, A0, 0, value), int(EBREAK) ])
+
+
+def loops():
+    # a0 = 1; loop: j loop
+    return make_elf([ enc_i(ADDI, A0, 0, 1), enc_j(JAL, 0, 0) ])
+
+
+def job(image, engine = Sim, max_insts = BATCH_MAX_INSTS, timeout = BATCH_TIMEOUT):
+    return run_job(0, image, PageTable, engine, max_insts, timeout)
+
+
+@pytest.mark.parametrize('engine', [ Sim, BlockSim ])
+def test_job(engine):
+    r = job(exits(42), engine)
+    assert ( r.status, r.event, r.retired ) == ( JOB_DONE, EXC_EBREAK, 2 )
+    assert r.regs[A0] == 42 and r.pc == TEXT_START + 4
+    assert str(r).startswith("<image 0>: ebreak at 0x%08x, 2 instructions" % (TEXT_START + 4))
+
+
+def test_job_fault():
+    T0 = 5
+    r = job(make_elf([ enc_i(LW, A0, T0, 0), int(EBREAK) ]))
+    assert ( r.status, r.event, r.fault_addr ) == ( JOB_DONE, EXC_PAGE_FAULT_MISS, 0 )
+    assert r.pc == TEXT_START and r.retired == 1
+
+
+@pytest.mark.parametrize('engine', [ Sim, BlockSim ])
+@pytest.mark.parametrize('max_insts', [ 1000, BATCH_SLICE + 7 ])
+def test_instruction_cap(engine, max_insts):
+    r = job(loops(), engine, max_insts)
+    assert ( r.status, r.retired, r.regs[A0] ) == ( JOB_MAX_INSTS, max_insts, 1 )
+    assert r.pc == TEXT_START + 4
+    assert "instruction limit" in str(r)
+
+
+def test_timeout():
+    r = job(loops(), timeout = 0)
+    assert r.status == JOB_TIMEOUT and r.retired <= BATCH_SLICE
+
+
+def test_load_errors(tmp_path):
+    missing = str(tmp_path / 'missing')
+    r = job(missing)
+    assert ( r.status, r.error ) == ( JOB_LOAD_ERROR, ELF_ERR_MSG[ELF_ERR_OPEN] % missing )
+    assert str(r) == r.error
+    r = job(b'not an ELF file')
+    assert r.status == JOB_LOAD_ERROR and r.retired == 0
+
+
+def test_run_batch(tmp_path):
+    # More images than jobs in flight, from files and bytes, with errors
+    path    = tmp_path / 'exit.elf'
+    path.write_bytes(exits(100))
+    images  = [ exits(i) for i in range(5) ] + [ str(path), b'', loops() ]
+    results = sorted(run_batch(iter(images), workers = 2, max_insts = 5000), key = lambda r: r.index)
+    assert [ r.index for r in results ] == list(range(len(images)))
+    assert [ r.regs[A0] for r in results[:6] ] == [ 0, 1, 2, 3, 4, 100 ]
+    assert all(r.status == JOB_DONE and r.event == EXC_EBREAK for r in results[:6])
+    assert results[5].name == str(path)
+    assert results[6].status == JOB_LOAD_ERROR
+    assert ( results[7].status, results[7].retired ) == ( JOB_MAX_INSTS, 5000 )
+
+
+def test_parse_args():
+    files, opts = parse_args([ 'batch.py', '-j', '3', '-n', '100', '-b', 'a', 'b' ])
+    assert files == [ 'a', 'b' ]
+    assert opts == { 'workers': 3, 'max_insts': 100, 'timeout': BATCH_TIMEOUT, 'engine': BlockSim }
+    assert parse_args([ 'batch.py', '-n', 'x', 'a' ]) is None
+    assert parse_args([ 'batch.py', '-j', '2' ]) is None
@@ -0,0 +1,66 @@
+#==========================================================================
+#
+#   The PyRISC Project
+#
+#   Tests of the table-driven decoder against the reference linear scan.
+#
+#==========================================================================
+
+import random
+
+import pytest
+
+from pyrisc.sim.consts import *
+from pyrisc.sim.isa import *
+
+
+def check(insts):
+    for inst in insts:
+        assert RISCV.opcode(inst) == RISCV.opcode_scan(inst), hex(inst)
+
+
+def test_random_words():
+    rnd     = random.Random(0)
+    check(rnd.getrandbits(32) for i in range(100000))
+
+
+def test_isa_shaped_words():
+    # Valid encodings with random operand fields, and the same with single
+    # bits of opcode, funct3 or funct7 flipped
+    rnd     = random.Random(1)
+    fields  = int(OP_MASK | FUNCT3_MASK | FUNCT7_MASK)
+    insts   = [ ]
+    for k, v in isa.items():
+        mask    = int(v[IN_MASK])
+        for i in range(200):
+            inst    = (rnd.getrandbits(32) & ~mask) | int(k)
+            insts.append(inst)
+            bit     = rnd.choice([ b for b in range(32) if fields >> b & 1 ])
+            insts.append(inst ^ (1 << bit))
+    check(insts)
+
+
+def test_ecall_ebreak_neighbours():
+    # ecall and ebreak only match with all other fields zero
+    insts   = [ ]
+    for base in ( int(ECALL), int(EBREAK) ):
+        insts += [ base ^ (1 << b) for b in range(32) ]
+        insts += [ base | (f << FUNCT3_SHIFT) for f in range(8) ]
+        insts += [ base | (r << 7) for r in range(32) ]
+        insts += [ base | (r << 15) for r in range(32) ]
+        insts += [ base | (imm << 20) for imm in range(4096) ]
+    check(insts)
+    assert RISCV.opcode(int(ECALL)) == ECALL
+    assert RISCV.opcode(int(EBREAK)) == EBREAK
+    assert RISCV.opcode(int(ECALL) | (1 << 7)) == ILLEGAL
+
+
+def test_unused_opcodes():
+    rnd     = random.Random(2)
+    used    = set(int(k) & 0x7f for k in isa)
+    for op in range(0x80):
+        insts = [ (rnd.getrandbits(32) & ~0x7f) | op for i in range(200) ]
+        check(insts)
+        if op not in used:
+            assert all(RISCV.opcode(inst) == ILLEGAL for inst in insts)
+    assert RISCV.opcode(int(ILLEGAL)) == ILLEGAL
@@ -0,0 +1,93 @@
+#==========================================================================
+#
+#   The PyRISC Project
+#
+#   Tests that the interpreter (Sim) and the block translation engine
+#   (BlockSim) execute guest programs identically.
+#
+#==========================================================================
+
+import pytest
+
+from pyrisc.sim.consts import *
+from pyrisc.sim.isa import *
+from pyrisc.sim.components import *
+from pyrisc.sim.program import Stat
+from pyrisc.sim.sim import Sim
+from pyrisc.sim.translate import BlockSim
+from pyrisc.sim.snurisc import SNURISC
+
+from guest import *
+
+
+def program_calls():
+    # Calls a function through jal and returns with jalr, 50 times
+    RA, SP, S0, A0 = 1, 2, 8, 10
+    code    = [ enc_u(LUI, SP, DATA_START + PAGE_SIZE), enc_i(ADDI, S0, 0, 50),
+                enc_j(JAL, RA, 20), enc_i(ADDI, S0, S0, -1), enc_b(BNE, S0, 0, -8),
+                int(ECALL), int(EBREAK),
+                enc_i(ADDI, SP, SP, -8), enc_s(SW, RA, SP, 4), enc_i(ADDI, A0, A0, 3),
+                enc_i(LW, RA, SP, 4), enc_i(ADDI, SP, SP, 8), enc_i(JALR, 0, RA, 0) ]
+    return load(code)
+
+def program_smc():
+    # Rewrites an instruction of its own loop: addi a0, a0, 1 -> 5
+    A0, S0, T1, T2 = 10, 8, 6, 7
+    patch   = enc_i(ADDI, A0, A0, 5)
+    code    = [ enc_i(ADDI, S0, 0, 3), enc_u(LUI, T1, patch + 0x800), enc_i(ADDI, T1, T1, patch & 0xfff),
+                enc_u(AUIPC, T2, 0),
+                enc_i(ADDI, A0, A0, 1), enc_s(SW, T1, T2, 4), enc_i(ADDI, S0, S0, -1),
+                enc_b(BNE, S0, 0, -12), int(EBREAK) ]
+    return load(code, M_READ_WRITE)
+
+PROGRAMS = dict([ ( name, lambda k = k: load(k(200)) ) for name, k in kernels.items() ] +
+                [ ( 'calls', program_calls ), ( 'smc', program_smc ) ] +
+                [ ( 'random%d' % seed, lambda seed = seed: load(random_program(seed)) ) for seed in range(12) ])
+
+
+def execute(name, engine, period, stats):
+    cpu     = SNURISC(PROGRAMS[name](), engine, period)
+    cpu.stat.enabled = stats
+    events  = run(cpu)
+    stat    = cpu.stat
+    return ( events, state(cpu), stat.icount, stat.cycle,
+             ( stat.inst_alu, stat.inst_mem, stat.inst_ctrl ), cpu.timer.interrupts )
+
+
+@pytest.mark.parametrize('name', sorted(PROGRAMS))
+@pytest.mark.parametrize('period', [ 0, 7, 500 ])
+@pytest.mark.parametrize('stats', [ False, True ])
+def test_engines_agree(name, period, stats):
+    assert execute(name, Sim, period, stats) == execute(name, BlockSim, period, stats)
+
+
+def test_smc_runs_patched_code():
+    for engine in ( Sim, BlockSim ):
+        cpu = SNURISC(program_smc(), engine, 0)
+        assert run(cpu)[-1][0] == EXC_EBREAK
+        assert cpu.regs.read(10) == 1 + 5 + 5
+
+
+def test_calls():
+    for engine in ( Sim, BlockSim ):
+        cpu = SNURISC(program_calls(), engine, 0)
+        events = run(cpu)
+        assert [ e[0] for e in events ] == [ EXC_ECALL, EXC_EBREAK ]
+        assert cpu.regs.read(10) == 7
+
+
+@pytest.mark.parametrize('engine', [ Sim, BlockSim ])
+def test_store_invalidates_other_cpus(engine):
+    # Two CPUs over the same page table with separate caches: a store by
+    # one must reach the code the other has decoded from the frame
+    A0      = 10
+    vm      = load([ enc_i(ADDI, A0, A0, 1), int(EBREAK) ], M_READ_WRITE)
+    a, b    = SNURISC(vm, engine, 0), SNURISC(vm, engine, 0)
+    assert b.run(TEXT_START).type == EXC_EBREAK
+    assert b.regs.read(A0) == 1
+    assert a.mmu.mem_store(TEXT_START, enc_i(ADDI, A0, A0, 5))[1] == EXC_NONE
+    assert b.run(TEXT_START).type == EXC_EBREAK
+    assert b.regs.read(A0) == 1 + 5
+    assert a.mmu.write_bytes(TEXT_START, enc_i(ADDI, A0, A0, 9).to_bytes(WORD_SIZE, "little")) == EXC_NONE
+    assert b.run(TEXT_START).type == EXC_EBREAK
+    assert b.regs.read(A0) == 1 + 5 + 9
@@ -0,0 +1,149 @@
+#==========================================================================
+#
+#   The PyRISC Project
+#
+#   Tests for physical frames, demand-zero pages and frame stats.
+#
+#==========================================================================
+
+import gc
+import pytest
+
+from pyrisc.sim.consts import *
+from pyrisc.sim.isa import *
+from pyrisc.sim.components import *
+from pyrisc.sim.sim import Sim
+from pyrisc.sim.translate import BlockSim
+from pyrisc.sim.snurisc import SNURISC
+
+from guest import *
+
+
+VA      = 0x80010000
+VPN     = VA >> VPO_LENTGH
+
+
+def test_reused_frame_drops_decoded_code():
+    memory  = PhysicalMemory(4)
+    cache   = DecodeCache(memory)
+    frame   = memory.alloc()
+    cache.add(frame, 0, 'decoded')
+    assert cache.lookup(frame, 0) == 'decoded'
+    memory.free(frame)
+    assert memory.alloc() == frame
+    assert cache.lookup(frame, 0) is None
+
+
+def test_alloc_skips_frames_without_code():
+    memory  = PhysicalMemory(4)
+    cache   = DecodeCache(memory)
+    cache.add(memory.alloc(), 0, 'decoded')
+    memory.alloc()
+    assert len(memory.code_frames) == 1
+
+
+def test_demand_zero():
+    vm      = PageTable()
+    pte     = vm.map(VPN, M_READ_WRITE, demand_zero = True)
+    cpu     = SNURISC(vm)
+    assert pte.frame is None and vm.resident() == 0
+    assert cpu.mmu.mem_load(VA) == ( 0, EXC_NONE )
+    assert pte.frame is not None and vm.resident() == 1
+    assert vm.stat.allocated == 1
+
+
+def test_frame_stat_of_clone():
+    vm      = PageTable()
+    vm.map(VPN, M_READ_WRITE)
+    vm.map(VPN + 1, M_READ_WRITE)
+    pt      = vm.clone()
+    assert ( pt.stat.allocated, pt.stat.shared, pt.stat.freed ) == ( 0, 2, 0 )
+
+    cpu     = SNURISC(pt)
+    assert cpu.mmu.mem_store(VA, 1) == ( 0, EXC_NONE )
+    assert ( pt.stat.allocated, pt.stat.shared, pt.stat.freed ) == ( 1, 2, 1 )
+    assert pt.stat.referenced() == 2
+
+    pt.release()
+    assert pt.stat.referenced() == 0
+    assert vm.stat.referenced() == 2
+
+
+def test_release():
+    vm      = PageTable()
+    ptes    = [ vm.map(VPN, M_READ_WRITE), vm.map(VPN + 1, M_READ_WRITE, demand_zero = True),
+                vm.map(VPN + 2, M_READ_WRITE, PageTableEntry.memory.alloc()) ]
+    kernel  = ptes[2].frame
+    resident = PageTableEntry.memory.resident()
+    vm.release()
+    assert vm.entries == { } and vm.stat.referenced() == 0
+    assert PageTableEntry.memory.resident() == resident - 1
+    assert ptes[0].frame is None
+    assert ptes[2].frame == kernel          # frames of the kernel are kept
+    PageTableEntry.memory.free(kernel)
+
+
+@pytest.fixture
+def arena(monkeypatch):
+    # An empty arena, replaced by set_memory() and restored afterwards.
+    # PTEs left in reference cycles (a CPU and its engine) are collected
+    # before switching, so that they free their frames into their arena.
+    gc.collect()
+    monkeypatch.setattr(PageTableEntry, 'memory', PhysicalMemory(1))
+    yield
+    gc.collect()
+
+
+def test_set_memory(arena):
+    memory  = PageTableEntry.set_memory(8)
+    assert PageTableEntry.memory is memory and memory.frames == 8
+    pte     = PageTableEntry(VPN, M_READ_WRITE)
+    with pytest.raises(ValueError):
+        PageTableEntry.set_memory(16)
+    del pte
+    assert PageTableEntry.set_memory(16).frames == 16
+
+
+def test_out_of_memory(arena):
+    PageTableEntry.set_memory(2)
+    vm      = PageTable()
+    vm.map(VPN, M_READ_WRITE, demand_zero = True)
+    vm.map(VPN + 1, M_READ_WRITE)
+    vm.map(VPN + 2, M_READ_WRITE, demand_zero = True)
+    mmu     = MMU(vm)
+    assert mmu.mem_load(VA) == ( 0, EXC_NONE )
+    assert mmu.mem_store(VA + 2 * PAGE_SIZE, 1) == ( 0, EXC_OUT_OF_MEMORY )
+    assert mmu.fault_addr == VA + 2 * PAGE_SIZE
+    assert mmu.read_bytes(VA + 2 * PAGE_SIZE, 4) == ( b'', EXC_OUT_OF_MEMORY )
+    assert mmu.mem_load(VA + 3 * PAGE_SIZE) == ( 0, EXC_PAGE_FAULT_MISS )
+    vm.unmap(VPN + 1)
+    assert mmu.mem_store(VA + 2 * PAGE_SIZE, 1) == ( 0, EXC_NONE )
+
+
+def test_out_of_memory_on_copy_on_write(arena):
+    PageTableEntry.set_memory(2)
+    vm      = PageTable()
+    vm.map(VPN, M_READ_WRITE)
+    vm.map(VPN + 1, M_READ_WRITE)
+    pt      = vm.clone()
+    mmu     = MMU(pt)
+    assert mmu.mem_store(VA, 1) == ( 0, EXC_OUT_OF_MEMORY )
+    assert mmu.write_bytes(VA, b'\1') == EXC_OUT_OF_MEMORY
+    assert pt.entries[VPN].cow and pt.entries[VPN].frame == vm.entries[VPN].frame
+    vm.release()
+    assert mmu.mem_store(VA, 1) == ( 0, EXC_NONE )
+
+
+@pytest.mark.parametrize('engine', [ Sim, BlockSim ])
+def test_out_of_memory_event(arena, engine):
+    # A store to a demand-zero page with no free frame left stops the
+    # program with the store at pc
+    S0      = 8
+    PageTableEntry.set_memory(1 + DATA_PAGES)
+    vm      = load([ enc_u(LUI, S0, DATA_START + DATA_PAGES * PAGE_SIZE), enc_s(SW, 0, S0, 0), int(EBREAK) ])
+    vm.map((DATA_START >> VPO_LENTGH) + DATA_PAGES, M_READ_WRITE, demand_zero = True)
+    cpu     = SNURISC(vm, engine)
+    event   = cpu.run(TEXT_START)
+    assert event.type == EXC_OUT_OF_MEMORY
+    assert event.fault_addr == DATA_START + DATA_PAGES * PAGE_SIZE
+    assert event.fault_pc == cpu.pc.read() == TEXT_START + 4
@@ -0,0 +1,35 @@
+#==========================================================================
+#
+#   The PyRISC Project
+#
+#   Tests for execution counts (histogram.py).
+#
+#==========================================================================
+
+import json
+
+from pyrisc.sim.consts import *
+from pyrisc.sim.isa import *
+from pyrisc.sim.histogram import Histogram
+from pyrisc.sim.snurisc import SNURISC
+
+from guest import *
+
+
+def test_branch_outcomes():
+    # Branches to pc + 8 and to pc + 4, taken and not taken
+    code    = [ enc_b(BEQ, 0, 0, 8), int(NOP),
+                enc_b(BNE, 0, 0, 8),
+                enc_b(BEQ, 0, 0, 4),
+                enc_b(BNE, 0, 0, 4),
+                int(EBREAK) ]
+    cpu     = SNURISC(load(code), period = 0)
+    cpu.hist = Histogram(TEXT_START)
+    assert run(cpu)[-1][0] == EXC_EBREAK
+
+    branches = json.loads(cpu.hist.to_json())['branches']
+    assert branches == { "0x%08x" % (TEXT_START + 0) : [ 1, 0 ],
+                         "0x%08x" % (TEXT_START + 8) : [ 0, 1 ],
+                         "0x%08x" % (TEXT_START + 12): [ 1, 0 ],
+                         "0x%08x" % (TEXT_START + 16): [ 0, 1 ] }
+    assert cpu.hist.opcode_counts() == { 'beq': 2, 'bne': 2, 'ebreak': 1 }
@@ -0,0 +1,99 @@
+#==========================================================================
+#
+#   The PyRISC Project
+#
+#   Tests for loading executables and sharing their read-only pages.
+#
+#==========================================================================
+
+import io
+
+import pytest
+
+from pyrisc.sim.consts import *
+from pyrisc.sim.isa import *
+from pyrisc.sim.components import *
+from pyrisc.sim.program import *
+from pyrisc.sim.snurisc import SNURISC
+
+from guest import *
+
+
+@pytest.fixture
+def executable():
+    # a0 = word at DATA_START + 1; stores it to the first bss word
+    A0, S0, S1 = 10, 8, 9
+    code    = [ enc_u(LUI, S0, DATA_START), enc_u(LUI, S1, DATA_START + PAGE_SIZE),
+                enc_i(LW, A0, S0, 0), enc_i(ADDI, A0, A0, 1), enc_s(SW, A0, S1, 0), int(EBREAK) ]
+    Program.image_cache = ImageCache()
+    yield make_elf(code, data = (41).to_bytes(4, "little"), bss = PAGE_SIZE)
+    Program.image_cache = ImageCache()
+
+
+def load_vm(executable):
+    vm      = PageTable()
+    entry, status = Program().load_image(vm, io.BytesIO(executable))
+    assert ( entry, status ) == ( TEXT_START, ELF_OK )
+    return vm
+
+
+def test_read_only_pages_are_shared(executable):
+    memory  = PageTableEntry.memory
+    vms     = [ load_vm(executable) ]
+    used    = memory.resident()
+    vms     += [ load_vm(executable) for i in range(3) ]
+    # Only the data page is copied for the other address spaces
+    assert memory.resident() == used + 3
+    assert Program.image_cache.hits == 3
+    text    = TEXT_START >> VPO_LENTGH
+    assert len(set(vm.translate(text).frame for vm in vms)) == 1
+    assert len(set(vm.translate(DATA_START >> VPO_LENTGH).frame for vm in vms)) == 4
+    # The bss page is demand-zero
+    assert all(vm.translate((DATA_START >> VPO_LENTGH) + 1).frame is None for vm in vms)
+
+
+def test_image_keeps_no_copy_of_text(executable):
+    load_vm(executable)
+    image, = Program.image_cache.images.values()
+    text    = TEXT_START >> VPO_LENTGH
+    assert text in image.frames
+    assert [ data for vpn, prot, data in image.pages if vpn == text ] == [ None ]
+
+
+def test_processes_run_independently(executable):
+    cpus    = [ SNURISC(load_vm(executable), period = 0) for i in range(2) ]
+    assert cpus[0].mmu.mem_store(DATA_START, 99) == ( 0, EXC_NONE )
+    for cpu in cpus:
+        assert run(cpu)[-1][0] == EXC_EBREAK
+    assert [ cpu.regs.read(10) for cpu in cpus ] == [ 100, 42 ]
+    assert [ cpu.mmu.mem_load(DATA_START + PAGE_SIZE)[0] for cpu in cpus ] == [ 100, 42 ]
+
+
+def test_reload_zeroes_bss(executable):
+    # Loading an image over a used address space leaves no old bss data
+    vm      = load_vm(executable)
+    bss     = vm.translate((DATA_START >> VPO_LENTGH) + 1)
+    bss.physical_page[0:4] = (7).to_bytes(4, "little")
+    assert Program().load_image(vm, io.BytesIO(executable)) == ( TEXT_START, ELF_OK )
+    assert vm.translate((DATA_START >> VPO_LENTGH) + 1) is bss
+    assert bytes(bss.physical_page) == bytes(PAGE_SIZE)
+
+
+@pytest.mark.parametrize('bss', [ (1 << 32) - DATA_START, 0x7ff00000 + (1 << 31), 0xffffffff - 4 ])
+def test_segment_out_of_range(executable, bss):
+    # DATA_START + 4 + bss is past the end of the address space
+    image   = make_elf([ int(EBREAK) ], data = bytes(4), bss = bss)
+    assert Program().load_image(PageTable(), io.BytesIO(image)) == ( 0, ELF_ERR_RANGE )
+
+
+def test_exec_runs_new_text(tmp_path, executable):
+    # Program.load() over a running address space: the new text replaces
+    # the PTE cached by the I-TLB
+    A0      = 10
+    cpu     = SNURISC(PageTable(), period = 0)
+    for value in ( 1, 2 ):
+        path = tmp_path / ('prog%d' % value)
+        path.write_bytes(make_elf([ enc_i(ADDI, A0, 0, value), int(EBREAK) ]))
+        assert Program().load(cpu, str(path)) == TEXT_START
+        assert run(cpu)[-1][0] == EXC_EBREAK
+        assert cpu.regs.read(A0) == value
@@ -0,0 +1,47 @@
+#==========================================================================
+#
+#   The PyRISC Project
+#
+#   Tests for the logs of the instrumented execution loop.
+#
+#==========================================================================
+
+import pytest
+
+from pyrisc.sim.consts import *
+from pyrisc.sim.isa import *
+from pyrisc.sim.program import Log
+from pyrisc.sim.snurisc import SNURISC
+
+from guest import *
+
+
+@pytest.mark.parametrize('level', [ 2, 6 ])
+def test_memory_dump(capsys, level):
+    code    = [ enc_u(LUI, 8, DATA_START), enc_i(ADDI, 5, 0, 0x123),
+                enc_s(SW, 5, 8, 16), int(EBREAK) ]
+    cpu     = SNURISC(load(code), period = 0)
+    cpu.log = Log(level)
+    assert run(cpu)[-1][0] == EXC_EBREAK
+    out     = capsys.readouterr().out
+    assert "Memory 0x%08x - 0x%08x" % (DATA_START, DATA_START + PAGE_SIZE - 1) in out
+    assert "0x%08x:  23 01 00 00  (0x00000123)" % (DATA_START + 16) in out
+    # Zero pages are skipped
+    assert "Memory 0x%08x" % (DATA_START + PAGE_SIZE) not in out
+
+
+def loop(iterations):
+    # t0 = iterations; loop: t0 -= 1; bnez t0, loop; ebreak
+    return load([ enc_i(ADDI, 5, 0, iterations), enc_i(ADDI, 5, 5, -1), enc_b(BNE, 5, 0, -4),
+                  int(EBREAK) ])
+
+
+@pytest.mark.parametrize('period', [ 0, 500 ])
+def test_log_cycles(capsys, period):
+    # Each line shows the cycle of its instruction, from start_cycle on
+    cpu     = SNURISC(loop(300), period = period)
+    cpu.log = Log(3, 100)
+    run(cpu)
+    lines   = [ l for l in capsys.readouterr().out.splitlines() if ": " in l and l.split()[0].isdigit() ]
+    cycles  = [ int(l.split()[0]) for l in lines ]
+    assert cycles == list(range(100, cpu.stat.icount))
@@ -0,0 +1,99 @@
+#==========================================================================
+#
+#   The PyRISC Project
+#
+#   Tests for the multi-hart machine and its scheduler.
+#
+#==========================================================================
+
+import pytest
+
+from pyrisc.sim.consts import *
+from pyrisc.sim.isa import *
+from pyrisc.sim.components import *
+from pyrisc.sim.sim import Sim
+from pyrisc.sim.translate import BlockSim
+from pyrisc.sim.machine import Machine
+from pyrisc.sim.kernels import kernel
+
+from guest import *
+
+
+def program():
+    # Each hart increments a shared counter (racy read-modify-write) and
+    # adds its hart id to another, 3000 times
+    A0, A1, S0 = 10, 11, 8
+    return kernel([ enc_i(LW, A1, S0, 0), enc_i(ADDI, A1, A1, 1), enc_s(SW, A1, S0, 0),
+                    enc_i(LW, A1, S0, 8), enc_r(ADD, A1, A1, A0), enc_s(SW, A1, S0, 8) ], 3000)
+
+def execute(engine, policy, seed, quantum, harts = 3, timer = 0):
+    vm      = load(program())
+    m       = Machine(vm, harts, engine, quantum, policy, seed)
+    if timer:
+        m.harts[1].timer.periodic(timer)
+    m.start(TEXT_START)
+    events  = [ ]
+    while True:
+        hartid, event = m.run()
+        if hartid is None:
+            break
+        events.append(( hartid, event.type, m.harts[hartid].stat.icount ))
+        if event.type != EXC_CLOCK:
+            m.halt(hartid)
+    data    = bytes(vm.translate(DATA_START >> VPO_LENTGH).physical_page[0:12])
+    return ( data, [ h.stat.icount for h in m.harts ], events, m.switches )
+
+
+@pytest.mark.parametrize('policy, seed, quantum', [ ( 'rr', 0, 7 ), ( 'random', 1, 13 ), ( 'rr', 0, 100 ) ])
+def test_deterministic(policy, seed, quantum):
+    # The same seed gives the same interleaving, on either engine
+    r       = execute(Sim, policy, seed, quantum)
+    assert execute(Sim, policy, seed, quantum) == r
+    assert execute(BlockSim, policy, seed, quantum) == r
+
+
+def test_seeds_differ():
+    assert execute(Sim, 'random', 1, 13) != execute(Sim, 'random', 2, 13)
+
+
+def test_timer_per_hart():
+    r       = execute(Sim, 'rr', 0, 100, timer = 333)
+    assert execute(BlockSim, 'rr', 0, 100, timer = 333) == r
+    clocks  = [ e for e in r[2] if e[1] == EXC_CLOCK ]
+    assert clocks and all(hartid == 1 for hartid, type, icount in clocks)
+    assert [ icount for hartid, type, icount in clocks ] == list(range(333, 24005, 333))
+
+
+def test_round_robin():
+    # Each quantum is exact, so the harts take turns in hart id order
+    m       = Machine(load(program()), 3, Sim, 10)
+    m.start(TEXT_START)
+    order   = [ ]
+    for i in range(6):
+        assert m.run(10) == ( None, None )
+        order.append([ h.stat.icount for h in m.harts ])
+    assert order == [ [ 10, 0, 0 ], [ 10, 10, 0 ], [ 10, 10, 10 ],
+                      [ 20, 10, 10 ], [ 20, 20, 10 ], [ 20, 20, 20 ] ]
+
+
+def test_halt_and_wake():
+    m       = Machine(load(program()), 2, Sim, 10)
+    m.start(TEXT_START)
+    m.halt(0)
+    m.run(50)
+    assert [ h.stat.icount for h in m.harts ] == [ 0, 50 ]
+    m.wake(0)
+    m.halt(1)
+    m.run(30)
+    assert [ h.stat.icount for h in m.harts ] == [ 30, 50 ]
+    m.halt(0)
+    assert m.run() == ( None, None )
+
+
+def test_posted_interrupt():
+    m       = Machine(load(program()), 2, Sim, 10)
+    m.start(TEXT_START)
+    m.harts[1].post_interrupt('uart')
+    hartid, event = m.run()
+    assert hartid == 1 and event.type == EXC_INTERRUPT and event.source == 'uart'
+    assert m.harts[0].stat.icount == 10
@@ -0,0 +1,102 @@
+#==========================================================================
+#
+#   The PyRISC Project
+#
+#   Tests for snapshots and copy-on-write cloning (snapshot.py).
+#
+#==========================================================================
+
+from pyrisc.sim.consts import *
+from pyrisc.sim.components import *
+from pyrisc.sim.snurisc import SNURISC
+from pyrisc.sim.snapshot import *
+
+
+VA      = 0x80010000
+VPN     = VA >> VPO_LENTGH
+
+
+def load(cpu, va):
+    value, status = cpu.mmu.mem_load(va)
+    assert status == EXC_NONE
+    return value
+
+def store(cpu, va, value):
+    _, status = cpu.mmu.mem_store(va, value)
+    assert status == EXC_NONE
+
+
+def test_clone_is_copy_on_write():
+    vm      = PageTable()
+    vm.map(VPN, M_READ_WRITE)
+    parent  = SNURISC(vm)
+    store(parent, VA, 0x1111)
+    child   = clone(parent)
+
+    # Nothing is copied until a store
+    assert child.mmu.page_table.translate(VPN).frame == vm.translate(VPN).frame
+    store(child, VA, 0x2222)
+    assert load(parent, VA) == 0x1111
+    assert load(child, VA) == 0x2222
+    store(parent, VA + 4, 0x3333)
+    assert load(child, VA + 4) == 0
+
+
+def test_clone_copies_kernel_frames():
+    memory  = PageTableEntry.memory
+    frame   = memory.alloc()
+    vm      = PageTable()
+    vm.map(VPN, M_READ_WRITE, frame = frame)
+    parent  = SNURISC(vm)
+    store(parent, VA, 0x1111)
+    child   = clone(parent)
+
+    store(child, VA, 0x1234)
+    assert load(parent, VA) == 0x1111
+    assert load(child, VA) == 0x1234
+    store(parent, VA, 0x5678)
+    assert load(child, VA) == 0x1234
+    # The parent still maps the frame of the kernel
+    assert vm.translate(VPN).frame == frame
+    del parent, child, vm
+    memory.free(frame)
+
+
+def test_snapshot_restore():
+    vm      = PageTable()
+    vm.map(VPN, M_READ_WRITE)
+    vm.map(VPN + 1, M_READ_WRITE, demand_zero = True)
+    cpu     = SNURISC(vm)
+    store(cpu, VA, 0xdeadbeef)
+    cpu.regs.write(10, 42)
+    cpu.pc.write(0x80000010)
+    cpu.timer.mtime = 1234
+
+    copy    = restore(snapshot(cpu))
+    assert copy.regs.read(10) == 42
+    assert copy.pc.read() == 0x80000010
+    assert copy.timer.mtime == 1234
+    assert copy.timer.mtimecmp == cpu.timer.mtimecmp
+    assert load(copy, VA) == 0xdeadbeef
+    assert load(copy, VA + PAGE_SIZE) == 0
+    store(copy, VA, 0)
+    assert load(cpu, VA) == 0xdeadbeef
+
+
+def test_restore_counts_shared_frames():
+    # Pages that share a frame are restored sharing one frame again; the
+    # copy made by the first store is counted in the new page table
+    vm      = PageTable()
+    vm.map(VPN, M_READ_WRITE)
+    cpu     = SNURISC(vm)
+    store(cpu, VA, 7)
+    vm.entries[VPN + 1] = vm.translate(VPN).share(VPN + 1, stat = vm.stat)
+
+    copy    = restore(snapshot(cpu))
+    pt      = copy.mmu.page_table
+    assert pt.translate(VPN).frame == pt.translate(VPN + 1).frame
+    assert pt.stat.allocated == 1
+    store(copy, VA + PAGE_SIZE, 8)
+    assert pt.stat.allocated == 2
+    assert load(copy, VA) == 7
+    assert load(copy, VA + PAGE_SIZE) == 8
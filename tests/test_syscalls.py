@@ -0,0 +1,112 @@
+#==========================================================================
+#
+#   The PyRISC Project
+#
+#   Tests for syscalls handled inside the engines.
+#
+#==========================================================================
+
+import pytest
+
+from pyrisc.sim.consts import *
+from pyrisc.sim.isa import *
+from pyrisc.sim.components import *
+from pyrisc.sim.sim import Sim
+from pyrisc.sim.translate import BlockSim
+from pyrisc.sim.snurisc import SNURISC
+
+from guest import *
+
+
+A0, A1, A7, S1  = 10, 11, 17, 9
+
+SYS_SKIP        = 1
+SYS_WRITE       = 64
+SYS_GETPID      = 172
+
+ENGINES         = [ Sim, BlockSim ]
+
+
+def program(engine):
+    # s1 = getpid(); write(DATA_START, 5); ebreak
+    code    = [ enc_i(ADDI, A7, 0, SYS_GETPID), int(ECALL), enc_i(ADDI, S1, A0, 0),
+                enc_i(ADDI, A7, 0, SYS_WRITE), enc_u(LUI, A0, DATA_START), enc_i(ADDI, A1, 0, 5),
+                int(ECALL), int(EBREAK) ]
+    cpu     = SNURISC(load(code), engine, 0)
+    cpu.mmu.write_bytes(DATA_START, b'hello')
+    return cpu
+
+
+def getpid(cpu):
+    cpu.regs.write(A0, 1234)
+    return True
+
+
+@pytest.mark.parametrize('engine', ENGINES)
+def test_handled_syscalls(engine):
+    out     = [ ]
+
+    def write(cpu):
+        # Copies the buffer out and leaves a reply after it
+        va      = cpu.regs.read(A0)
+        data, status = cpu.mmu.read_bytes(va, cpu.regs.read(A1))
+        assert status == EXC_NONE
+        out.append(data)
+        assert cpu.mmu.write_bytes(va + 8, b'done') == EXC_NONE
+        cpu.regs.write(A0, len(data))
+        return True
+
+    cpu     = program(engine)
+    cpu.register_syscall(SYS_GETPID, getpid)
+    cpu.register_syscall(SYS_WRITE, write)
+    assert run(cpu) == [ ( EXC_EBREAK, 8 ) ]
+    assert out == [ b'hello' ]
+    assert cpu.regs.read(S1) == 1234 and cpu.regs.read(A0) == 5
+    assert cpu.mmu.read_bytes(DATA_START + 8, 4) == ( b'done', EXC_NONE )
+    assert cpu.pc.read() == TEXT_START + 7 * 4
+
+
+@pytest.mark.parametrize('engine', ENGINES)
+def test_unhandled_syscalls(engine):
+    # A handler returning False, or none, leaves the ecall to the kernel
+    calls   = [ ]
+
+    def declines(cpu):
+        calls.append(cpu.pc.read())
+        return False
+
+    cpu     = program(engine)
+    cpu.register_syscall(SYS_GETPID, getpid)
+    cpu.register_syscall(SYS_WRITE, declines)
+    cpu.register_syscall(SYS_GETPID, None)
+    event   = cpu.run(TEXT_START)
+    assert event.type == EXC_ECALL and cpu.pc.read() == TEXT_START + 2 * 4
+    event   = cpu.run(cpu.pc.read())
+    assert event.type == EXC_ECALL and cpu.pc.read() == TEXT_START + 7 * 4
+    assert calls == [ TEXT_START + 7 * 4 ]
+    assert cpu.regs.read(S1) == 0 and cpu.stat.icount == 7
+
+
+@pytest.mark.parametrize('engine', ENGINES)
+def test_handler_sets_pc(engine):
+    # The handler skips the instruction after the ecall
+    def skip(cpu):
+        cpu.pc.write(cpu.pc.read() + 4)
+        return True
+
+    code    = [ enc_i(ADDI, A7, 0, SYS_SKIP), int(ECALL), enc_i(ADDI, A0, A0, 100),
+                enc_i(ADDI, A0, A0, 1), int(EBREAK) ]
+    cpu     = SNURISC(load(code), engine, 0)
+    cpu.register_syscall(SYS_SKIP, skip)
+    assert run(cpu) == [ ( EXC_EBREAK, 4 ) ]
+    assert cpu.regs.read(A0) == 1
+
+
+def test_engines_agree_with_handlers():
+    cpus    = [ program(engine) for engine in ENGINES ]
+    for cpu in cpus:
+        cpu.register_syscall(SYS_GETPID, getpid)
+        cpu.stat.enabled = True
+        run(cpu)
+    assert state(cpus[0]) == state(cpus[1])
+    assert cpus[0].stat.icount == cpus[1].stat.icount == 8
@@ -0,0 +1,67 @@
+#==========================================================================
+#
+#   The PyRISC Project
+#
+#   Tests for the timer and the clock view of it.
+#
+#==========================================================================
+
+import pytest
+
+from pyrisc.sim.consts import *
+from pyrisc.sim.isa import *
+from pyrisc.sim.components import *
+from pyrisc.sim.sim import Sim
+from pyrisc.sim.translate import BlockSim
+from pyrisc.sim.snurisc import SNURISC
+
+from guest import *
+
+
+def interrupts(events):
+    return [ icount for type, icount in events if type == EXC_CLOCK ]
+
+
+@pytest.mark.parametrize('engine', [ Sim, BlockSim ])
+def test_periodic(engine):
+    cpu     = SNURISC(load(kernels['alu'](100)), engine, 100)
+    events  = run(cpu)
+    assert interrupts(events) == list(range(100, cpu.stat.icount, 100))
+    assert cpu.timer.interrupts == len(interrupts(events))
+    assert cpu.timer.mtime == cpu.stat.icount
+
+
+@pytest.mark.parametrize('engine', [ Sim, BlockSim ])
+def test_oneshot(engine):
+    cpu     = SNURISC(load(kernels['alu'](100)), engine, 0)
+    cpu.timer.oneshot(123)
+    assert interrupts(run(cpu)) == [ 123 ]
+
+
+def test_resume_coalesces_missed_periods():
+    cpu     = SNURISC(load(kernels['alu'](100)), Sim, 10)
+    cpu.pc.write(TEXT_START)
+    assert cpu.resume(35).retired == 35
+    assert cpu.run(cpu.pc.read()).type == EXC_CLOCK
+    assert cpu.stat.icount == 35 and cpu.timer.interrupts == 1
+    # The missed periods are one interrupt, the next comes a period later
+    assert cpu.run(cpu.pc.read()).type == EXC_CLOCK
+    assert cpu.stat.icount == 45 and cpu.timer.interrupts == 2
+
+
+def test_clock_view():
+    cpu     = SNURISC(load(kernels['alu'](100)), Sim, 500)
+    clock   = cpu.clock
+    assert ( clock.period, clock.cycles ) == ( 500, 0 )
+    cpu.pc.write(TEXT_START)
+    cpu.resume(30)
+    assert cpu.clock.cycles == 30
+
+    clock.period = 50
+    assert cpu.timer.interval == 50
+    clock.cycles = 40
+    assert cpu.run(cpu.pc.read()).type == EXC_CLOCK
+    assert cpu.stat.icount == 40
+
+    clock.period = 0
+    assert cpu.timer.mtimecmp == Timer.NEVER and cpu.clock.cycles == 0
@@ -0,0 +1,134 @@
+#==========================================================================
+#
+#   The PyRISC Project
+#
+#   Tests for the TLBs and their flush operations.
+#
+#==========================================================================
+
+import pytest
+
+from pyrisc.sim.consts import *
+from pyrisc.sim.components import *
+
+
+VPN     = 0x80010
+VA      = VPN << VPO_LENTGH
+
+
+def space(value, vpns = ( VPN, )):
+    # A page table with value in the first word of each page
+    vm      = PageTable()
+    for vpn in vpns:
+        vm.map(vpn, M_READ_WRITE).physical_page[0:4] = value.to_bytes(WORD_SIZE, "little")
+    return vm
+
+
+def remap(vm, value, vpn = VPN):
+    # Replaces the PTE of vpn by one over another frame
+    vm.map(vpn, M_READ_WRITE).physical_page[0:4] = value.to_bytes(WORD_SIZE, "little")
+
+
+def load(mmu, va = VA):
+    value, status = mmu.mem_load(va)
+    assert status == EXC_NONE
+    return value
+
+
+def test_tlb_hits_and_fifo_replacement():
+    tlb     = TLB(sets = 2, ways = 2)
+    ptes    = [ PageTableEntry(vpn, M_READ_ONLY) for vpn in range(8) ]
+    for vpn in ( 0, 2 ):
+        assert tlb.lookup(vpn, 0) is None
+        tlb.insert(vpn, 0, ptes[vpn])
+    assert tlb.lookup(0, 0) is ptes[0] and tlb.lookup(2, 0) is ptes[2]
+    tlb.insert(4, 0, ptes[4])               # evicts vpn 0, the oldest of the set
+    assert tlb.lookup(0, 0) is None
+    assert tlb.lookup(2, 0) is ptes[2] and tlb.lookup(4, 0) is ptes[4]
+    tlb.insert(1, 0, ptes[1])               # another set
+    assert tlb.lookup(1, 0) is ptes[1] and tlb.lookup(2, 0) is ptes[2]
+    assert ( tlb.hits, tlb.misses ) == ( 6, 3 )
+
+
+def test_tlb_disabled_and_sets():
+    tlb     = TLB(ways = 0)
+    tlb.insert(1, 0, PageTableEntry(1, M_READ_ONLY))
+    assert tlb.lookup(1, 0) is None
+    with pytest.raises(ValueError):
+        TLB(sets = 48)
+
+
+def test_replaced_pte_needs_flush():
+    vm      = space(1)
+    mmu     = MMU(vm)
+    assert load(mmu) == 1
+    remap(vm, 2)
+    assert load(mmu) == 1                   # stale mapping in the TLB
+    mmu.tlb_flush()
+    assert load(mmu) == 2
+
+
+def test_flush_vpn():
+    vm      = space(1, ( VPN, VPN + 1 ))
+    mmu     = MMU(vm)
+    assert load(mmu) == 1 and load(mmu, VA + PAGE_SIZE) == 1
+    remap(vm, 2)
+    remap(vm, 2, VPN + 1)
+    mmu.tlb_flush_vpn(VPN)
+    assert load(mmu) == 2
+    assert load(mmu, VA + PAGE_SIZE) == 1   # other pages are kept
+
+
+def test_flush_vpn_of_asid():
+    a, b    = space(1), space(2)
+    mmu     = MMU(a)
+    mmu.switch(a, 1)
+    assert load(mmu) == 1
+    mmu.switch(b, 2)
+    assert load(mmu) == 2
+    remap(a, 3)
+    remap(b, 4)
+    mmu.tlb_flush_vpn(VPN, 1)
+    assert load(mmu) == 2                   # asid 2 is kept
+    mmu.switch(a, 1)
+    assert load(mmu) == 3
+
+
+def test_switch_with_asid_keeps_entries():
+    a, b    = space(1), space(2)
+    mmu     = MMU(a)
+    mmu.switch(a, 1)
+    assert load(mmu) == 1
+    mmu.switch(b, 2)
+    assert load(mmu) == 2
+    misses  = mmu.dtlb.misses
+    mmu.switch(a, 1)
+    assert load(mmu) == 1
+    mmu.switch(b, 2)
+    assert load(mmu) == 2
+    assert mmu.dtlb.misses == misses
+
+
+def test_switch_without_asid_flushes():
+    a, b    = space(1), space(2)
+    mmu     = MMU(a)
+    assert load(mmu) == 1
+    mmu.switch(b)
+    assert load(mmu) == 2
+    mmu.page_table = a
+    assert load(mmu) == 1
+
+
+def test_flush_asid():
+    a, b    = space(1), space(2)
+    mmu     = MMU(a)
+    mmu.switch(a, 1)
+    assert load(mmu) == 1
+    mmu.switch(b, 2)
+    assert load(mmu) == 2
+    remap(a, 3)
+    remap(b, 4)
+    mmu.tlb_flush_asid(1)
+    assert load(mmu) == 2                   # asid 2 is kept
+    mmu.switch(a, 1)
+    assert load(mmu) == 3
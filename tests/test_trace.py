@@ -0,0 +1,108 @@
+#==========================================================================
+#
+#   The PyRISC Project
+#
+#   Tests for the binary execution traces.
+#
+#==========================================================================
+
+import io
+
+import pytest
+
+from pyrisc.sim.consts import *
+from pyrisc.sim.isa import *
+from pyrisc.sim.components import *
+from pyrisc.sim.sim import Sim
+from pyrisc.sim.translate import BlockSim
+from pyrisc.sim.snurisc import SNURISC
+from pyrisc.sim.trace import *
+
+from guest import *
+
+
+def records(count):
+    # ( pc, inst, rd, wbdata, kind, addr, data, event ), as passed to write()
+    return [ ( TEXT_START + 4 * i, i * 7919 & MASK32, i % 32, i * 31, i % 3, i * 4, i ^ 0x5a,
+               EXC_EBREAK if i == count - 1 else EXC_NONE ) for i in range(count) ]
+
+
+def decoded(number, rec):
+    # The tuple read_trace() yields for rec
+    pc, inst, rd, wbdata, kind, addr, data, event = rec
+    return ( number, pc, inst, wbdata, addr, data, rd, kind, event )
+
+
+def round_trip(recs, **kwargs):
+    f   = io.BytesIO()
+    with TraceWriter(f, **kwargs) as w:
+        for rec in recs:
+            w.write(*rec)
+    return f.getvalue(), list(read_trace(io.BytesIO(f.getvalue())))
+
+
+@pytest.mark.parametrize('compress', [ False, True ])
+@pytest.mark.parametrize('count', [ 0, 1, TRACE_BUFFER, 2 * TRACE_BUFFER + 3 ])
+def test_round_trip(compress, count):
+    recs        = records(count)
+    data, out   = round_trip(recs, compress = compress)
+    assert data.startswith(GZIP_MAGIC) == compress
+    assert out == [ decoded(i, rec) for i, rec in enumerate(recs) ]
+
+
+@pytest.mark.parametrize('compress', [ False, True ])
+@pytest.mark.parametrize('count', [ 3, 5, 10, 12 ])
+def test_ring(compress, count):
+    # Only the last 5 records are kept, numbered from the first one traced
+    recs        = records(count)
+    _, out      = round_trip(recs, compress = compress, ring = 5)
+    first       = max(0, count - 5)
+    assert out == [ decoded(i, recs[i]) for i in range(first, count) ]
+
+
+def test_file_name(tmp_path):
+    path    = str(tmp_path / 'run.trace')
+    recs    = records(10)
+    w       = TraceWriter(path, compress = True)
+    for rec in recs:
+        w.write(*rec)
+    w.close()
+    w.close()
+    assert list(read_trace(path)) == [ decoded(i, rec) for i, rec in enumerate(recs) ]
+
+
+def test_not_a_trace():
+    for data in ( b'', b'PRT', b'XXXX' + bytes(TRACE_HEADER.size) ):
+        with pytest.raises(ValueError):
+            list(read_trace(io.BytesIO(data)))
+
+
+def traced(engine, ring = 0):
+    # Traces the memory kernel up to its ebreak
+    cpu         = SNURISC(load(kernels['mem'](20)), engine, 0)
+    f           = io.BytesIO()
+    cpu.trace   = TraceWriter(f, compress = True, ring = ring)
+    event       = cpu.run(TEXT_START)
+    cpu.trace.close()
+    assert event.type == EXC_EBREAK
+    return cpu, list(read_trace(io.BytesIO(f.getvalue())))
+
+
+def test_trace_of_run():
+    cpu, recs = traced(Sim)
+    assert len(recs) == cpu.stat.icount
+    assert [ r[0] for r in recs ] == list(range(len(recs)))
+    assert recs[-1][1] == cpu.pc.read() and recs[-1][8] == EXC_EBREAK
+    assert all(r[8] == EXC_NONE for r in recs[:-1])
+    loads   = [ r for r in recs if r[7] == TR_LOAD ]
+    stores  = [ r for r in recs if r[7] == TR_STORE ]
+    assert len(loads) == 3 * 20 and len(stores) == 2 * 20
+    assert all(r[4] in ( DATA_START, DATA_START + 1, DATA_START + 4 ) for r in loads + stores)
+    line    = format_record(loads[0], Program.disasm(loads[0][1], loads[0][2]))
+    assert "[0x%08x] -> 0x%08x" % (loads[0][4], loads[0][5]) in line
+
+
+def test_engines_trace_alike():
+    assert traced(Sim)[1] == traced(BlockSim)[1]
+    cpu, recs = traced(BlockSim, ring = 16)
+    assert recs == traced(Sim)[1][-16:]
@@ -0,0 +1,156 @@
+#==========================================================================
+#
+#   The PyRISC Project
+#
+#   Differential tests of the integer execution core against the NumPy
+#   scalar implementation it replaced.
+#
+#==========================================================================
+
+import random
+
+import numpy as np
+import pytest
+
+from pyrisc.sim.consts import *
+from pyrisc.sim.isa import *
+from pyrisc.sim.components import *
+from pyrisc.sim.sim import *
+from pyrisc.sim.snurisc import SNURISC
+
+
+VA      = 0x80010000
+NPAGES  = 2
+
+EDGES   = [ 0, 1, 2, 0x1f, 0x20, 0x7f, 0x80, 0xff, 0x7fff, 0x8000, 0xffff,
+            0x7fffffff, 0x80000000, 0x80000001, 0xfffffffe, 0xffffffff ]
+
+
+def operands(count = 2000, seed = 0):
+    rnd     = random.Random(seed)
+    pairs   = [ ( a, b ) for a in EDGES for b in EDGES ]
+    pairs   += [ ( rnd.getrandbits(32), rnd.getrandbits(32) ) for i in range(count) ]
+    return pairs
+
+
+#--------------------------------------------------------------------------
+#   ALU and branches
+#--------------------------------------------------------------------------
+
+def numpy_alu(op, a, b):
+    # As Sim.run_alu() computed it on np.uint32 and np.int32 scalars
+    a, b    = np.uint32(a), np.uint32(b)
+    return np.uint32(a + b)                             if op == ALU_ADD    else \
+           np.uint32(a - b)                             if op == ALU_SUB    else \
+           np.uint32(a & b)                             if op == ALU_AND    else \
+           np.uint32(a | b)                             if op == ALU_OR     else \
+           np.uint32(a ^ b)                             if op == ALU_XOR    else \
+           np.uint32(np.int32(a) < np.int32(b))         if op == ALU_SLT    else \
+           np.uint32(a < b)                             if op == ALU_SLTU   else \
+           np.uint32(a << (b & np.uint32(0x1f)))        if op == ALU_SLL    else \
+           np.uint32(np.int32(a) >> np.int32(b & np.uint32(0x1f)))  if op == ALU_SRA    else \
+           np.uint32(a >> (b & np.uint32(0x1f)))
+
+def numpy_cond(opcode, a, b):
+    sa, sb  = np.int32(np.uint32(a)), np.int32(np.uint32(b))
+    a, b    = np.uint32(a), np.uint32(b)
+    return a == b       if opcode == BEQ    else \
+           a != b       if opcode == BNE    else \
+           sa < sb      if opcode == BLT    else \
+           sa >= sb     if opcode == BGE    else \
+           a < b        if opcode == BLTU   else \
+           a >= b
+
+
+@pytest.mark.parametrize('op', sorted(Sim.alu))
+def test_alu(op):
+    func    = eval("lambda a, b: " + Sim.alu[op] % { 'a': 'a', 'b': 'b' })
+    with np.errstate(all = 'ignore'):
+        for a, b in operands():
+            assert func(a, b) == int(numpy_alu(op, a, b)), (hex(a), hex(b))
+
+
+@pytest.mark.parametrize('opcode', sorted(Sim.cond))
+def test_branch(opcode):
+    func    = eval("lambda a, b: " + Sim.cond[opcode] % { 'a': 'a', 'b': 'b' })
+    for a, b in operands():
+        assert bool(func(a, b)) == bool(numpy_cond(opcode, a, b)), (hex(a), hex(b))
+
+
+#--------------------------------------------------------------------------
+#   Loads and stores
+#--------------------------------------------------------------------------
+
+# Little-endian NumPy types of each access
+DTYPES  = {
+    ( 1, False ): '<u1', ( 1, True ): '<i1',
+    ( 2, False ): '<u2', ( 2, True ): '<i2',
+    ( 4, False ): '<u4', ( 4, True ): '<i4',
+}
+
+class NumPyMemory(object):
+
+    # Reference model: a byte array accessed through NumPy types
+
+    def __init__(self):
+        self.mem = np.zeros(NPAGES * PAGE_SIZE, dtype = np.uint8)
+
+    def load(self, off, size, signed):
+        value = np.frombuffer(self.mem[off:off+size].tobytes(), dtype = DTYPES[(size, signed)])[0]
+        return int(np.int64(value).astype(np.uint32))
+
+    def store(self, off, data, size):
+        self.mem[off:off+size] = np.array([ data ], dtype = '<u4').view(np.uint8)[:size]
+
+
+@pytest.fixture(params = [ 'native', 'wordview' ])
+def cpu(request, monkeypatch):
+    # 'wordview' runs the accesses through the struct-based views used on
+    # big-endian hosts instead of memoryview.cast()
+    if request.param == 'wordview':
+        memory = PageTableEntry.memory
+        monkeypatch.setattr(memory, 'words', WordView(memory.mem, "<I"))
+        monkeypatch.setattr(memory, 'halves', WordView(memory.mem, "<H"))
+    vm      = PageTable()
+    for i in range(NPAGES):
+        vm.map((VA >> VPO_LENTGH) + i, M_READ_WRITE)
+    return SNURISC(vm)
+
+
+def offsets():
+    # Every alignment at the start and in the middle of a page, and across
+    # the page boundary
+    base    = [ 0, 0x100, PAGE_SIZE - 4, PAGE_SIZE ]
+    return sorted(set(b + i for b in base for i in range(8) if b + i + 4 <= NPAGES * PAGE_SIZE))
+
+
+@pytest.mark.parametrize('size', [ 1, 2, 4 ])
+def test_store_load(cpu, size):
+    ref     = NumPyMemory()
+    rnd     = random.Random(size)
+    for off in offsets():
+        data    = rnd.getrandbits(32)
+        assert cpu.mmu.mem_store(VA + off, data, size) == ( 0, EXC_NONE )
+        ref.store(off, data, size)
+        for signed in ( False, True ):
+            value, status = cpu.mmu.mem_load(VA + off, size, signed)
+            assert status == EXC_NONE
+            assert value == ref.load(off, size, signed), (hex(off), size, signed)
+
+    data, status = cpu.mmu.read_bytes(VA, NPAGES * PAGE_SIZE)
+    assert status == EXC_NONE and data == ref.mem.tobytes()
+
+
+@pytest.mark.parametrize('size', [ 1, 2, 4 ])
+@pytest.mark.parametrize('signed', [ False, True ])
+def test_load_sizes(cpu, size, signed):
+    # Loads of every size over bytes with and without the sign bit set
+    ref     = NumPyMemory()
+    rnd     = random.Random(0)
+    pattern = bytes(rnd.choice([ 0x00, 0x7f, 0x80, 0xff, rnd.getrandbits(8) ]) for i in range(NPAGES * PAGE_SIZE))
+    assert cpu.mmu.write_bytes(VA, pattern) == EXC_NONE
+    ref.mem[:] = np.frombuffer(pattern, dtype = np.uint8)
+    for off in range(0, NPAGES * PAGE_SIZE - size + 1, 3):
+        value, status = cpu.mmu.mem_load(VA + off, size, signed)
+        assert status == EXC_NONE
+        assert value == ref.load(off, size, signed), (hex(off), size, signed)